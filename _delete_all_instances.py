@@ -1,21 +1,14 @@
 from typing import Any
-from azure.keyvault.secrets import SecretClient
-from azure.identity import DefaultAzureCredential
 from pathlib import Path
 import logging
 from dotenv import load_dotenv
 import os
 
 from clients.instance_client import AltinnInstanceClient, get_meta_data_info
+from clients.instance_store import open_instance_store
 from config.config_loader import load_full_config
 
 load_dotenv()
-credential = DefaultAzureCredential()
-client = SecretClient(
-    vault_url=os.getenv("MASKINPORTEN_SECRET_VAULT_URL"), credential=credential
-)
-secret = client.get_secret(os.getenv("MASKINPORTEN_SECRET_NAME"))
-secret_value = secret.value
 def main() -> None:
     logging.info("Starting Altinn survey sending instance processing")
     path_to_config_folder = Path(__file__).parent / "config_files"
@@ -26,6 +19,7 @@ def main() -> None:
     regvil_instance_client = AltinnInstanceClient.init_from_config(
         config,
     )
+    instance_store = open_instance_store()
     answer = input("Write DELETE to delete all instances: ")
     if answer != "DELETE":
         logging.info("Skipping deletion of all instances")
@@ -34,7 +28,7 @@ def main() -> None:
     else:
         logging.info("Deleting all instances")
         print("Deleting all instances")
-        instance_ids = regvil_instance_client.get_stored_instances_ids()
+        instance_ids = regvil_instance_client.iter_stored_instances_ids()
         for instance in instance_ids:
             partyID, instance_id = instance["instanceId"].split("/")
             logging.info(f"Deleting instance {instance_id} for party {partyID}")
@@ -50,6 +44,8 @@ def main() -> None:
             instance_deleted = regvil_instance_client.delete_instance(partyID, instance_id)
             if instance_deleted.status_code in [200,201,204]:
                 logging.info(f"Successfully deleted instance {instance_id}")
+                if instance_store is not None:
+                    instance_store.remove(regvil_skjema, f"{partyID}/{instance_id}")
             else:
                 logging.error(f"Failed to delete instance {instance_id}: {instance_deleted.text}")
         return "All instances deleted successfully"
@@ -1,6 +1,9 @@
+from typing import Any, Dict, Optional, Tuple
 from flask import Flask, request, jsonify
 import logging
 import os
+import threading
+import time
 from dotenv import load_dotenv
 from pathlib import Path
 
@@ -10,6 +13,10 @@ from send_warning import run as send_notification
 from send_reminders import run as run_reminder_job
 from config.config_loader import load_full_config
 from send_seasonal_reminders import run as run_seasonal_reminder_job
+from clients.circuit_breaker import CircuitBreaker, circuit_breaker_states
+from clients.event_queue import EventQueue
+from clients.event_dedup import EventDeduplicator, SingleFlight
+from clients.pipeline_context import PipelineContext
 
 load_dotenv()
 
@@ -22,59 +29,211 @@ def extract_ids_from_source(source_url: str):
 
 @app.route("/health")
 def health():
-    return "ok", 200
+    breakers = circuit_breaker_states()
+    status = "degraded" if any(b["state"] != CircuitBreaker.CLOSED for b in breakers.values()) else "ok"
+    body = {"status": status, "circuit_breakers": breakers}
+    if _event_queue is not None:
+        body["event_queue"] = _event_queue.stats()
+    if _event_deduplicator is not None:
+        body["event_dedup"] = _event_deduplicator.stats()
+    return jsonify(body), 200
+
+def process_event(event: Dict[str, Any]) -> Tuple[str, int]:
+    """Download, upload and notify for one app.instance.process.completed event."""
+    context = PipelineContext()
+    started = time.monotonic()
+    with context.activate():
+        message, status = run_pipeline(event, context)
+    logging.info(
+        f"APP:Event {event.get('id')} finished with {status} after {len(context.http_calls)} HTTP calls "
+        f"in {time.monotonic() - started:.2f}s: {context.call_summary()}"
+    )
+    return message, status
+
+
+def run_pipeline(event: Dict[str, Any], context: PipelineContext) -> Tuple[str, int]:
+    source_url = event.get("source")
+    instance_id, party_id, app_name = extract_ids_from_source(source_url)
+    logging.info(
+        f"APP:Party ID: {party_id}, Instance ID: {instance_id}, App name: {app_name}"
+    )
+    ## IF CLOUD EVENT
+    path_to_config_folder = Path(__file__).parent / "config_files"
+    config = context.get_or_create(("config", app_name), lambda: load_full_config(path_to_config_folder, app_name, os.getenv("ENV")))
+    download_params, download_response = download_skjema(
+        party_id=party_id, instance_id=instance_id, app_name=app_name, context=context
+    )
+    if not download_params:
+        logging.error(
+            f"APP:Download failed for app name: {app_name} party id: {party_id} instance id: {instance_id}."
+        )
+        return (
+            f"APP:Download failed for app name: {app_name} party id: {party_id} instance id: {instance_id},",
+            download_response,
+        )
+
+    if app_name == "regvil-2025-slutt":
+        logging.info(
+            f"APP:Terminal app reached: {app_name}. No further processing."
+        )
+        return "Workflow complete - no further action.", 200
+
+    result = upload_skjema(**download_params, context=context)
+    download_params["email_subject"] = config.app_config.emailSubject
+    download_params["email_body"] = config.app_config.emailBody
+    if result == 200:
+        notification_results = send_notification(**download_params, context=context)
+        if notification_results == 200:
+            logging.info(
+                f"APP:Notification sent successfully for app name: {app_name} party id: {party_id} instance id: {instance_id}."
+            )
+            return "Event received and processed. Notification sent", 200
+        else:
+            logging.error(
+                f"APP:Notification failed for app name: {app_name} party id: {party_id} instance id: {instance_id}. Status code: {notification_results}"
+            )
+
+            return "Event received and processed. Notification failed", 200
+    else:
+        return "Error in processing", result
+
+
+_event_queue: Optional[EventQueue] = None
+_event_deduplicator: Optional[EventDeduplicator] = None
+_event_queue_lock = threading.Lock()
+instance_flights = SingleFlight()
+event_flights = SingleFlight()
+
+
+def get_event_deduplicator() -> EventDeduplicator:
+    global _event_deduplicator
+    with _event_queue_lock:
+        if _event_deduplicator is None:
+            _event_deduplicator = EventDeduplicator(
+                max_entries=int(os.getenv("WEBHOOK_DEDUP_MAX_ENTRIES", "10000")),
+                store_path=os.getenv("WEBHOOK_DEDUP_PATH"),
+            )
+        return _event_deduplicator
+
+
+class EventProcessingError(Exception):
+    """A queued event whose pipeline returned a non-2xx status, so the queue retries it."""
+
+
+def run_completed_event(event: Dict[str, Any]) -> Tuple[str, int]:
+    """Run process_event once per instance at a time; concurrent events for it share the run."""
+    instance_id, party_id, app_name = extract_ids_from_source(event.get("source"))
+    return instance_flights.do(f"{app_name}/{party_id}/{instance_id}", lambda: process_event(event))
+
+
+def handle_completed_event(event: Dict[str, Any]) -> Tuple[str, int]:
+    """Process an event in the request and remember its id when it succeeded."""
+    deduplicator = get_event_deduplicator()
+    try:
+        message, status = run_completed_event(event)
+    except Exception:
+        deduplicator.release(event.get("id"))
+        raise
+    if 200 <= int(status) < 300:
+        deduplicator.mark_processed(event.get("id"))
+    else:
+        deduplicator.release(event.get("id"))
+    return message, status
+
+
+def handle_queued_event(event: Dict[str, Any]) -> Tuple[str, int]:
+    """Queue handler: raise on failure so the queue retries, keeping the claim until it gives up.
+
+    Altinn already got 202 for the event and will not redeliver it, so the queue is the
+    only place left to retry.
+    """
+    message, status = run_completed_event(event)
+    if not 200 <= int(status) < 300:
+        raise EventProcessingError(f"{message} ({status})")
+    get_event_deduplicator().mark_processed(event.get("id"))
+    return message, status
+
+
+def release_failed_event(event: Dict[str, Any]) -> None:
+    get_event_deduplicator().release(event.get("id"))
+
+
+def duplicate_event_response(event: Dict[str, Any]):
+    """200 for an event already processed; 503 with Retry-After while it is still in flight,
+    since the first delivery may yet fail and the sender has to keep the event until then."""
+    if get_event_deduplicator().in_flight(event.get("id")):
+        logging.info(f"APP:Event {event.get('id')} is still being processed, asking the sender to retry")
+        return "Event is being processed", 503, {"Retry-After": os.getenv("WEBHOOK_RETRY_AFTER_SECONDS", "30")}
+    logging.info(f"APP:Duplicate event {event.get('id')} ignored")
+    return "Event already received", 200
+
+
+def handle_event_in_request(event: Dict[str, Any]):
+    """Sync mode: claim and process inside a flight keyed by event id, so concurrent
+    deliveries of the same event wait for the first one and return its status."""
+
+    def claim_and_process():
+        if not get_event_deduplicator().claim(event.get("id")):
+            return duplicate_event_response(event)
+        return handle_completed_event(event)
+
+    if not event.get("id"):
+        return claim_and_process()
+    return event_flights.do(event["id"], claim_and_process)
+
+
+def get_event_queue() -> EventQueue:
+    """Started webhook work queue, created on first use or by start_persistent_event_queue."""
+    global _event_queue
+    with _event_queue_lock:
+        if _event_queue is None:
+            _event_queue = EventQueue(
+                handle_queued_event,
+                workers=int(os.getenv("WEBHOOK_WORKERS", "4")),
+                store_path=os.getenv("WEBHOOK_QUEUE_PATH"),
+                max_attempts=int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "3")),
+                on_failure=release_failed_event,
+                lease_seconds=float(os.getenv("WEBHOOK_LEASE_SECONDS", "600")),
+            )
+            _event_queue.start()
+        return _event_queue
+
+
+def start_persistent_event_queue() -> None:
+    """Start the queue at startup when it is persisted, so events left pending by the last
+    process are recovered without waiting for the next webhook."""
+    if os.getenv("WEBHOOK_QUEUE_PATH"):
+        get_event_queue()
+
+
+def create_app() -> Flask:
+    """Entrypoint for servers (`gunicorn "app:create_app()"`); starts the queue in the serving
+    process rather than at import, so importing the module never spawns worker threads."""
+    start_persistent_event_queue()
+    return app
+
 
 @app.route("/httppost", methods=["POST"])
 def handle_event():
     try:
-        event = request.get_json()
+        event = request.get_json(silent=True)
+        if not isinstance(event, dict):
+            return "Invalid CloudEvent", 400
         logging.info(f"APP:Event type: {event.get('type')}")
-        source_url = event.get("source")
         if event.get("type") == "app.instance.process.completed":
-
-            instance_id, party_id, app_name = extract_ids_from_source(source_url)
-            logging.info(
-                f"APP:Party ID: {party_id}, Instance ID: {instance_id}, App name: {app_name}"
-            )
-            ## IF CLOUD EVENT
-            path_to_config_folder = Path(__file__).parent / "config_files"
-            config = load_full_config(path_to_config_folder, app_name, os.getenv("ENV"))
-            download_params, download_response = download_skjema(
-                party_id=party_id, instance_id=instance_id, app_name=app_name
-            )
-            if not download_params:
-                logging.error(
-                    f"APP:Download failed for app name: {app_name} party id: {party_id} instance id: {instance_id}."
-                )
-                return (
-                    f"APP:Download failed for app name: {app_name} party id: {party_id} instance id: {instance_id},",
-                    download_response,
-                )
-
-            if app_name == "regvil-2025-slutt":
-                logging.info(
-                    f"APP:Terminal app reached: {app_name}. No further processing."
-                )
-                return "Workflow complete - no further action.", 200
-
-            result = upload_skjema(**download_params)
-            download_params["email_subject"] = config.app_config.emailSubject
-            download_params["email_body"] = config.app_config.emailBody
-            if result == 200:
-                notification_results = send_notification(**download_params)
-                if notification_results == 200:
-                    logging.info(
-                        f"APP:Notification sent successfully for app name: {app_name} party id: {party_id} instance id: {instance_id}."
-                    )
-                    return "Event received and processed. Notification sent", 200
-                else:
-                    logging.error(
-                        f"APP:Notification failed for app name: {app_name} party id: {party_id} instance id: {instance_id}. Status code: {notification_results}"
-                    )
-
-                    return "Event received and processed. Notification failed", 200
-            else:
-                return "Error in processing", result
+            if len((event.get("source") or "").split("/")) < 4:
+                logging.error(f"APP:Invalid event source: {event.get('source')}")
+                return "Invalid event source", 400
+            if os.getenv("WEBHOOK_PROCESSING_MODE", "async") == "sync":
+                return handle_event_in_request(event)
+            if not get_event_deduplicator().claim(event.get("id")):
+                return duplicate_event_response(event)
+            try:
+                get_event_queue().enqueue(event)
+            except Exception:
+                get_event_deduplicator().release(event.get("id"))
+                raise
+            return "Event accepted", 202
         else:
             logging.info("APP:Event type not handled.")
             return "Event type not handled", 204
@@ -112,4 +271,4 @@ def send_seasonal_reminder():
         return jsonify({"status": "error", "message": str(e)}), 500
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=80)
+    create_app().run(host="0.0.0.0", port=80)
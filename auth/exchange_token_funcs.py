@@ -1,8 +1,25 @@
 import requests
 import uuid
+import base64
+import functools
+import json
+import threading
+import time
+from typing import Dict, Optional, Tuple
 from jwcrypto import jwk, jwt
 from datetime import datetime, timezone
 import logging
+import os
+from clients.http_session import add_unauthorized_listener, http_request
+
+# A cached Altinn token is treated as expired this many seconds before its exp claim
+TOKEN_EXPIRY_MARGIN_SECONDS = 60
+# Start renewing the token in the background this many seconds before its exp claim
+TOKEN_REFRESH_MARGIN_SECONDS = int(os.getenv("ALTINN_TOKEN_REFRESH_MARGIN_SECONDS", "300"))
+# Stop renewing a token in the background once it has not been used for this many seconds
+TOKEN_IDLE_SECONDS = float(os.getenv("ALTINN_TOKEN_IDLE_SECONDS", "1800"))
+# Used when the exchanged token has no readable exp claim
+DEFAULT_TOKEN_LIFETIME_SECONDS = 300
 
 
 class MaskinportenTokenError(Exception):
@@ -19,40 +36,64 @@ class MaskinportenTokenRequestError(Exception):
     pass
 
 
-def get_maskinporten_token(
-    audience: str, secret: str, kid: str, client_id: str, scope: str
-):
-    maskinporten_token = audience + "token"
-    timestamp = int(datetime.now(timezone.utc).timestamp())
+@functools.lru_cache(maxsize=8)
+def load_signing_key(secret: str) -> jwk.JWK:
+    """Parse the Maskinporten JWK secret once per secret value."""
     private_pem = (
         jwk.JWK.from_json(secret)
         .export_to_pem(private_key=True, password=None)
         .decode("ascii")
     )
-    key = jwk.JWK.from_pem(
+    return jwk.JWK.from_pem(
         data=bytes(private_pem, "ascii"),
     )
 
-    jwt_header = {"alg": "RS256", "kid": kid}
-    jwt_claims = {
-        "aud": audience,
-        "iss": client_id,
-        "scope": scope,
-        "resource": "https://api.samarbeid.digdir.no/api/v1/clients",
-        "iat": timestamp,
-        "exp": timestamp + 100,
-        "jti": str(uuid.uuid4()),
-    }
-    jwt_token = jwt.JWT(
-        header=jwt_header,
-        claims=jwt_claims,
-    )
 
-    jwt_token.make_signed_token(key)
-    signed_jwt = jwt_token.serialize()
+class MaskinportenAssertionSigner:
+    """Builds signed JWT grant assertions for one Maskinporten client."""
+
+    def __init__(self, audience: str, secret: str, kid: str, client_id: str, scope: str):
+        self.audience = audience
+        self.key = load_signing_key(secret)
+        self.jwt_header = {"alg": "RS256", "kid": kid}
+        self.client_id = client_id
+        self.scope = scope
+
+    def build_assertion(self) -> str:
+        timestamp = int(datetime.now(timezone.utc).timestamp())
+        jwt_claims = {
+            "aud": self.audience,
+            "iss": self.client_id,
+            "scope": self.scope,
+            "resource": "https://api.samarbeid.digdir.no/api/v1/clients",
+            "iat": timestamp,
+            "exp": timestamp + 100,
+            "jti": str(uuid.uuid4()),
+        }
+        jwt_token = jwt.JWT(
+            header=self.jwt_header,
+            claims=jwt_claims,
+        )
+        jwt_token.make_signed_token(self.key)
+        return jwt_token.serialize()
+
+
+@functools.lru_cache(maxsize=8)
+def get_assertion_signer(
+    audience: str, secret: str, kid: str, client_id: str, scope: str
+) -> MaskinportenAssertionSigner:
+    return MaskinportenAssertionSigner(audience, secret, kid, client_id, scope)
+
+
+def get_maskinporten_token(
+    audience: str, secret: str, kid: str, client_id: str, scope: str
+):
+    maskinporten_token = audience + "token"
+    signed_jwt = get_assertion_signer(audience, secret, kid, client_id, scope).build_assertion()
 
     try:
-        res = requests.post(
+        res = http_request(
+            "POST",
             maskinporten_token,
             data={
                 "grant_type": "urn:ietf:params:oauth:grant-type:jwt-bearer",
@@ -91,7 +132,8 @@ def exchange_token(
     "https://maskinporten.no/":"https://platform.altinn.no/authentication/api/v1/exchange/maskinporten"}
     url = endpoint[maskinporten_endpoint]
     try:
-        response = requests.get(
+        response = http_request(
+            "GET",
             url,
             headers={"Authorization": f"Bearer {maskinport_token}"},
         )
@@ -108,3 +150,267 @@ def exchange_token(
     except requests.RequestException as e:
         logging.exception("HTTP request to Altinn failed")
         raise AltinnExchangeTokenError("Request to Altinn failed") from e
+
+
+
+def get_token_expiry(token: str) -> Optional[float]:
+    """Read the exp claim (epoch seconds) from a JWT without verifying it."""
+    try:
+        payload = token.strip().strip('"').split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+        return float(claims["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+class _TokenRefresh:
+    def __init__(self):
+        self.done = threading.Event()
+        self.token: Optional[str] = None
+        self.error: Optional[Exception] = None
+
+
+class AltinnTokenProvider:
+    """Holds the current Altinn token for one (endpoint, client_id, scope).
+
+    The token is renewed by a background timer refresh_margin_seconds before exp, so
+    requests normally read it from memory. Concurrent refreshes share one exchange. The
+    timer stops once the token has been unused for idle_seconds, and a token Altinn
+    answered 401 for is dropped through invalidate_token.
+    """
+
+    def __init__(
+        self,
+        maskinporten_endpoint: str,
+        secret: str,
+        kid: str,
+        client_id: str,
+        scope: str,
+        refresh_margin_seconds: int = TOKEN_REFRESH_MARGIN_SECONDS,
+        expiry_margin_seconds: int = TOKEN_EXPIRY_MARGIN_SECONDS,
+        background_refresh: bool = True,
+        idle_seconds: float = TOKEN_IDLE_SECONDS,
+    ):
+        self.maskinporten_endpoint = maskinporten_endpoint
+        self.secret = secret
+        self.kid = kid
+        self.client_id = client_id
+        self.scope = scope
+        self.refresh_margin_seconds = max(refresh_margin_seconds, expiry_margin_seconds)
+        self.expiry_margin_seconds = expiry_margin_seconds
+        self.background_refresh = background_refresh
+        self.idle_seconds = idle_seconds
+        self._last_used = time.time()
+        self._token: Optional[str] = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+        self._in_flight: Optional[_TokenRefresh] = None
+        self._timer: Optional[threading.Timer] = None
+        self._closed = False
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+
+    def get_token(self) -> str:
+        now = time.time()
+        with self._lock:
+            self._last_used = now
+            if self._token and now < self._expires_at - self.expiry_margin_seconds:
+                self.hits += 1
+                needs_refresh = now >= self._expires_at - self.refresh_margin_seconds
+                token = self._token
+            else:
+                self.misses += 1
+                token = None
+        if token is None:
+            return self.refresh()
+        if needs_refresh and self.background_refresh:
+            self.refresh_in_background()
+        return token
+
+    def refresh(self) -> str:
+        """Exchange a new token, or wait for the exchange already in flight."""
+        with self._lock:
+            flight = self._in_flight
+            leader = flight is None
+            if leader:
+                flight = self._in_flight = _TokenRefresh()
+        if not leader:
+            flight.done.wait()
+        else:
+            try:
+                token = exchange_token(
+                    maskinporten_endpoint=self.maskinporten_endpoint,
+                    secret=self.secret,
+                    kid=self.kid,
+                    client_id=self.client_id,
+                    scope=self.scope,
+                )
+                expires_at = get_token_expiry(token) or time.time() + DEFAULT_TOKEN_LIFETIME_SECONDS
+                with self._lock:
+                    self._token, self._expires_at = token, expires_at
+                    self.refreshes += 1
+                flight.token = token
+                self._schedule_refresh(expires_at)
+            except Exception as e:
+                flight.error = e
+            finally:
+                with self._lock:
+                    self._in_flight = None
+                flight.done.set()
+        if flight.error:
+            raise flight.error
+        return flight.token
+
+    def refresh_in_background(self) -> None:
+        with self._lock:
+            if self._in_flight is not None or self._closed:
+                return
+        threading.Thread(target=self._background_refresh, daemon=True).start()
+
+    def _background_refresh(self) -> None:
+        try:
+            self.refresh()
+        except Exception:
+            logging.exception("Background refresh of Altinn token failed")
+
+    def _scheduled_refresh(self) -> None:
+        with self._lock:
+            self._timer = None
+            idle = time.time() - self._last_used
+        if idle >= self.idle_seconds:
+            logging.info(f"Altinn token for {self.client_id} unused for {idle:.0f}s, stopping background refresh")
+            return
+        self._background_refresh()
+
+    def invalidate_token(self, token: str) -> bool:
+        """Drop token if it is the cached one and exchange a new one. Returns True if it was cached."""
+        with self._lock:
+            if not self._token or token.strip('"') != self._token.strip('"'):
+                return False
+            self._token, self._expires_at = None, 0.0
+        logging.warning(f"Altinn rejected the token for {self.client_id}, exchanging a new one")
+        self.refresh_in_background()
+        return True
+
+    def _schedule_refresh(self, expires_at: float) -> None:
+        if not self.background_refresh:
+            return
+        delay = expires_at - self.refresh_margin_seconds - time.time()
+        with self._lock:
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+            if self._closed or delay <= 0:
+                return
+            self._timer = threading.Timer(delay, self._scheduled_refresh)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+
+
+class AltinnTokenCache:
+    """Shares one AltinnTokenProvider per (endpoint, client_id, scope) across all clients."""
+
+    def __init__(
+        self,
+        expiry_margin_seconds: int = TOKEN_EXPIRY_MARGIN_SECONDS,
+        refresh_margin_seconds: int = TOKEN_REFRESH_MARGIN_SECONDS,
+        background_refresh: bool = True,
+    ):
+        self.expiry_margin_seconds = expiry_margin_seconds
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self.background_refresh = background_refresh
+        self._providers: Dict[Tuple[str, str, str], AltinnTokenProvider] = {}
+        self._lock = threading.Lock()
+
+    def get_provider(
+        self, maskinporten_endpoint: str, secret: str, kid: str, client_id: str, scope: str
+    ) -> AltinnTokenProvider:
+        key = (maskinporten_endpoint, client_id, scope)
+        with self._lock:
+            provider = self._providers.get(key)
+            if provider is None:
+                provider = AltinnTokenProvider(
+                    maskinporten_endpoint=maskinporten_endpoint,
+                    secret=secret,
+                    kid=kid,
+                    client_id=client_id,
+                    scope=scope,
+                    refresh_margin_seconds=self.refresh_margin_seconds,
+                    expiry_margin_seconds=self.expiry_margin_seconds,
+                    background_refresh=self.background_refresh,
+                )
+                self._providers[key] = provider
+            elif provider.secret != secret or provider.kid != kid:
+                provider.secret, provider.kid = secret, kid
+            return provider
+
+    def get_token(
+        self, maskinporten_endpoint: str, secret: str, kid: str, client_id: str, scope: str
+    ) -> str:
+        return self.get_provider(maskinporten_endpoint, secret, kid, client_id, scope).get_token()
+
+    def invalidate(self, maskinporten_endpoint: str, client_id: str, scope: str) -> None:
+        with self._lock:
+            provider = self._providers.pop((maskinporten_endpoint, client_id, scope), None)
+        if provider:
+            provider.close()
+
+    def on_unauthorized(self, authorization: str) -> None:
+        """Invalidate the cached token a request answered with 401 was sent with."""
+        token = authorization.removeprefix("Bearer ").strip()
+        with self._lock:
+            providers = list(self._providers.values())
+        for provider in providers:
+            if provider.invalidate_token(token):
+                return
+
+    def clear(self) -> None:
+        with self._lock:
+            providers = list(self._providers.values())
+            self._providers.clear()
+        for provider in providers:
+            provider.close()
+
+    @property
+    def hits(self) -> int:
+        with self._lock:
+            return sum(provider.hits for provider in self._providers.values())
+
+    @property
+    def misses(self) -> int:
+        with self._lock:
+            return sum(provider.misses for provider in self._providers.values())
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            providers = list(self._providers.values())
+        return {
+            "hits": sum(provider.hits for provider in providers),
+            "misses": sum(provider.misses for provider in providers),
+            "cached_tokens": len(providers),
+        }
+
+
+altinn_token_cache = AltinnTokenCache()
+add_unauthorized_listener(altinn_token_cache.on_unauthorized)
+
+
+def get_altinn_token(
+    maskinporten_endpoint: str, secret: str, kid: str, client_id: str, scope: str
+) -> str:
+    return altinn_token_cache.get_token(
+        maskinporten_endpoint=maskinporten_endpoint,
+        secret=secret,
+        kid=kid,
+        client_id=client_id,
+        scope=scope,
+    )
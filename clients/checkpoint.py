@@ -0,0 +1,118 @@
+from pathlib import Path
+from typing import Any, Dict, Optional
+import datetime
+import json
+import logging
+import os
+import re
+import threading
+
+from config.utils import list_blobs_with_prefix, read_blob, write_blob
+
+IN_PROGRESS = "in_progress"
+DONE = "done"
+FAILED = "failed"
+
+
+def send_out_run_id(app_name: str, visible_after: Optional[str]) -> Optional[str]:
+    """Default run id for one send-out of an app, or None when it has no fixed visibleAfter."""
+    return f"{app_name}-{visible_after}" if visible_after else None
+
+
+def open_checkpoint_journal(run_name: str, default_run_id: Optional[str] = None) -> "CheckpointJournal":
+    """Journal for run_name, namespaced by CHECKPOINT_RUN_ID or else default_run_id.
+
+    Journals are kept, so the run id must differ between runs that should not skip each
+    other's reports, e.g. send_out_run_id. With CHECKPOINT_DIR set the journal is a local
+    JSONL file, otherwise one blob per report under {ENV}/checkpoints/.
+    """
+    run_id = os.getenv("CHECKPOINT_RUN_ID") or default_run_id
+    if not run_id:
+        raise ValueError(f"CHECKPOINT_RUN_ID must be set for {run_name}")
+    run_id = re.sub(r"[^A-Za-z0-9._-]+", "-", run_id).strip("-")
+    return CheckpointJournal(f"{run_name}-{run_id}", directory=os.getenv("CHECKPOINT_DIR"))
+
+
+class CheckpointJournal:
+    """Progress of a bulk run per digitaliseringstiltak_report_id, so a rerun can resume."""
+
+    def __init__(self, run_name: str, directory: Optional[str] = None):
+        self.run_name = run_name
+        self._lock = threading.Lock()
+        self._file_lock = threading.Lock()
+        self._report_locks: Dict[str, threading.Lock] = {}
+        self._file = Path(directory) / f"{run_name}.jsonl" if directory else None
+        self._prefix = f"{os.getenv('ENV')}/checkpoints/{run_name}/"
+        self._entries: Dict[str, Dict[str, Any]] = self._load()
+        if self._entries:
+            logging.info(f"CHECKPOINT:Loaded {len(self._entries)} entries for {run_name}")
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        entries = {}
+        if self._file is not None:
+            if not self._file.exists():
+                return entries
+            with open(self._file, "r", encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A crash can leave the last line half written
+                        continue
+                    entries[entry["report_id"]] = entry
+            return entries
+        for blob_name in list_blobs_with_prefix(self._prefix):
+            entry = read_blob(blob_name)
+            if entry:
+                entries[entry["report_id"]] = entry
+        return entries
+
+    def get(self, report_id: str) -> Optional[Dict[str, Any]]:
+        """Latest entry for report_id, including the details passed to mark()."""
+        with self._lock:
+            entry = self._entries.get(report_id)
+        return dict(entry) if entry else None
+
+    def state(self, report_id: str) -> Optional[str]:
+        entry = self.get(report_id)
+        return entry["state"] if entry else None
+
+    def mark(self, report_id: str, state: str, **details: Any) -> None:
+        entry = {
+            "report_id": report_id,
+            "state": state,
+            "updated": datetime.datetime.now(datetime.UTC).isoformat(),
+            **details,
+        }
+        with self._lock:
+            self._entries[report_id] = entry
+            report_lock = self._report_locks.setdefault(report_id, threading.Lock())
+        # Persist outside self._lock so workers marking other reports are not held up by I/O
+        if self._file is not None:
+            self._append(report_id)
+        else:
+            with report_lock:
+                write_blob(f"{self._prefix}{report_id}.json", self._latest(report_id))
+
+    def _latest(self, report_id: str) -> Dict[str, Any]:
+        # Writers persist the newest entry rather than their own, so a slow write of an
+        # older state for the same report can never land after a newer one
+        with self._lock:
+            return self._entries[report_id]
+
+    def _append(self, report_id: str) -> None:
+        with self._file_lock:
+            self._file.parent.mkdir(parents=True, exist_ok=True)
+            with open(self._file, "a", encoding="utf-8") as file:
+                file.write(json.dumps(self._latest(report_id)) + "\n")
+                file.flush()
+                fd = os.dup(file.fileno())
+        try:
+            # Concurrent fsyncs share the disk flush instead of queueing behind the append lock
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
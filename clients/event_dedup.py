@@ -0,0 +1,130 @@
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+import datetime
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS processed_events (
+    event_id TEXT PRIMARY KEY,
+    processed_at TEXT NOT NULL
+);
+"""
+
+
+class EventDeduplicator:
+    """Remembers CloudEvent ids that are in flight or processed, so redeliveries are dropped.
+
+    Processed ids are kept in a bounded LRU and, with store_path set, in SQLite so they
+    survive restarts. Claims for ids still in flight are only held in memory.
+    """
+
+    def __init__(self, max_entries: int = 10000, store_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.duplicates = 0
+        self._processed: "OrderedDict[str, None]" = OrderedDict()
+        self._in_flight: set[str] = set()
+        self._lock = threading.Lock()
+        self._conn = None
+        if store_path:
+            self._conn = sqlite3.connect(store_path, check_same_thread=False)
+            with self._conn:
+                self._conn.executescript(SCHEMA)
+
+    def _is_processed(self, event_id: str) -> bool:
+        if event_id in self._processed:
+            self._processed.move_to_end(event_id)
+            return True
+        if self._conn is not None:
+            row = self._conn.execute("SELECT 1 FROM processed_events WHERE event_id = ?", (event_id,)).fetchone()
+            if row:
+                self._remember(event_id)
+                return True
+        return False
+
+    def _remember(self, event_id: str) -> None:
+        self._processed[event_id] = None
+        self._processed.move_to_end(event_id)
+        while len(self._processed) > self.max_entries:
+            self._processed.popitem(last=False)
+
+    def claim(self, event_id: Optional[str]) -> bool:
+        """True if the caller should process event_id; False for a duplicate. Events without id are never deduplicated."""
+        if not event_id:
+            return True
+        with self._lock:
+            if event_id in self._in_flight or self._is_processed(event_id):
+                self.duplicates += 1
+                return False
+            self._in_flight.add(event_id)
+            return True
+
+    def in_flight(self, event_id: Optional[str]) -> bool:
+        """True while event_id is claimed but neither processed nor released."""
+        if not event_id:
+            return False
+        with self._lock:
+            return event_id in self._in_flight
+
+    def mark_processed(self, event_id: Optional[str]) -> None:
+        if not event_id:
+            return
+        with self._lock:
+            self._in_flight.discard(event_id)
+            self._remember(event_id)
+            if self._conn is not None:
+                with self._conn:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO processed_events VALUES (?, ?)",
+                        (event_id, datetime.datetime.now(datetime.UTC).isoformat()),
+                    )
+
+    def release(self, event_id: Optional[str]) -> None:
+        """Drop the claim on an event that failed, so a redelivery is processed again."""
+        if not event_id:
+            return
+        with self._lock:
+            self._in_flight.discard(event_id)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"in_flight": len(self._in_flight), "remembered": len(self._processed), "duplicates": self.duplicates}
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[Exception] = None
+
+
+class SingleFlight:
+    """Runs one call per key at a time; concurrent callers with the same key share its result."""
+
+    def __init__(self):
+        self.shared = 0
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self.shared += 1
+        if not leader:
+            flight.done.wait()
+        else:
+            try:
+                flight.result = fn()
+            except Exception as e:
+                flight.error = e
+            finally:
+                with self._lock:
+                    del self._flights[key]
+                flight.done.set()
+        if flight.error:
+            raise flight.error
+        return flight.result
@@ -0,0 +1,229 @@
+from typing import Any, Callable, Dict, Optional
+import datetime
+import json
+import logging
+import os
+import queue
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    event_id TEXT,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    enqueued_at TEXT NOT NULL,
+    last_error TEXT,
+    owner TEXT,
+    lease_expires_at REAL
+);
+"""
+
+# Columns added after the first release, so stores created before them are migrated in place
+LEASE_COLUMNS = {"owner": "TEXT", "lease_expires_at": "REAL"}
+
+
+class EventQueue:
+    """Work queue that runs `handler` for each event on background worker threads.
+
+    With store_path set, events are written to SQLite before they are acknowledged and
+    removed once handled. Several processes may share the store: each row is leased to the
+    process handling it for lease_seconds, renewed on every attempt, and only rows whose
+    lease has expired (their process stopped or died) are recovered by start() and by the
+    workers every recover_interval seconds. The handler signals failure by raising;
+    on_failure is called with the event once max_attempts have failed.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Dict[str, Any]], Any],
+        workers: int = 4,
+        store_path: Optional[str] = None,
+        max_attempts: int = 3,
+        on_failure: Optional[Callable[[Dict[str, Any]], None]] = None,
+        lease_seconds: float = 600,
+        recover_interval: float = 30,
+    ):
+        self.handler = handler
+        self.on_failure = on_failure
+        self.workers = max(1, workers)
+        self.max_attempts = max(1, max_attempts)
+        self.lease_seconds = lease_seconds
+        self.recover_interval = recover_interval
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.processed = 0
+        self.failed = 0
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._threads: list[threading.Thread] = []
+        self._local_rows: set[int] = set()
+        self._next_recovery = 0.0
+        self._lock = threading.Lock()
+        self._conn = None
+        if store_path:
+            self._conn = sqlite3.connect(store_path, check_same_thread=False, timeout=30)
+            with self._lock, self._conn:
+                self._conn.executescript(SCHEMA)
+                columns = {row[1] for row in self._conn.execute("PRAGMA table_info(events)")}
+                for column, column_type in LEASE_COLUMNS.items():
+                    if column not in columns:
+                        self._conn.execute(f"ALTER TABLE events ADD COLUMN {column} {column_type}")
+
+    def _store(self, sql: str, params: tuple = ()):
+        if self._conn is None:
+            return None
+        with self._lock, self._conn:
+            return self._conn.execute(sql, params)
+
+    def _put(self, row_id: Optional[int], event: Dict[str, Any], attempt: int) -> None:
+        if row_id is not None:
+            with self._lock:
+                self._local_rows.add(row_id)
+        self._queue.put((row_id, event, attempt))
+
+    def enqueue(self, event: Dict[str, Any]) -> None:
+        cursor = self._store(
+            "INSERT INTO events (event_id, payload, enqueued_at, owner, lease_expires_at) VALUES (?, ?, ?, ?, ?)",
+            (
+                event.get("id"),
+                json.dumps(event),
+                datetime.datetime.now(datetime.UTC).isoformat(),
+                self.owner,
+                time.time() + self.lease_seconds,
+            ),
+        )
+        self._put(cursor.lastrowid if cursor else None, event, 1)
+
+    def recover_expired(self) -> int:
+        """Lease pending rows whose lease expired to this queue and put them on it."""
+        if self._conn is None:
+            return 0
+        now = time.time()
+        with self._lock, self._conn:
+            # One UPDATE takes the write lock, so two processes never lease the same row
+            self._conn.execute(
+                "UPDATE events SET owner = ?, lease_expires_at = ? "
+                "WHERE status = 'pending' AND (owner IS NULL OR lease_expires_at < ?)",
+                (self.owner, now + self.lease_seconds, now),
+            )
+            rows = self._conn.execute(
+                "SELECT id, payload, attempts FROM events WHERE status = 'pending' AND owner = ? ORDER BY id",
+                (self.owner,),
+            ).fetchall()
+            recovered = [row for row in rows if row[0] not in self._local_rows]
+        for row_id, payload, attempts in recovered:
+            self._put(row_id, json.loads(payload), attempts + 1)
+        if recovered:
+            logging.info(f"EVENT QUEUE:Recovered {len(recovered)} pending events with expired leases")
+        return len(recovered)
+
+    def _claim(self, row_id: int) -> bool:
+        """Renew this queue's lease on the row, or take it over if the lease expired."""
+        now = time.time()
+        cursor = self._store(
+            "UPDATE events SET owner = ?, lease_expires_at = ? "
+            "WHERE id = ? AND status = 'pending' AND (owner IS NULL OR owner = ? OR lease_expires_at < ?)",
+            (self.owner, now + self.lease_seconds, row_id, self.owner, now),
+        )
+        return cursor is None or cursor.rowcount == 1
+
+    def start(self) -> None:
+        with self._lock:
+            if self._threads:
+                return
+            self._threads = [
+                threading.Thread(target=self._work, name=f"event-worker-{i}", daemon=True) for i in range(self.workers)
+            ]
+        self.recover_expired()
+        self._next_recovery = time.monotonic() + self.recover_interval
+        for thread in self._threads:
+            thread.start()
+
+    def _work(self) -> None:
+        while True:
+            try:
+                item = self._queue.get(timeout=self.recover_interval)
+            except queue.Empty:
+                item = ()
+            try:
+                if item is None:
+                    return
+                if item:
+                    self._handle(*item)
+                if self._conn is not None and time.monotonic() >= self._next_recovery:
+                    self._next_recovery = time.monotonic() + self.recover_interval
+                    self.recover_expired()
+            finally:
+                if item != ():
+                    self._queue.task_done()
+
+    def _handle(self, row_id: Optional[int], event: Dict[str, Any], attempt: int) -> None:
+        try:
+            if row_id is not None and not self._claim(row_id):
+                logging.info(f"EVENT QUEUE:Event {event.get('id')} is leased by another worker, skipping")
+                return
+            self._attempt(row_id, event, attempt)
+        finally:
+            if row_id is not None:
+                with self._lock:
+                    self._local_rows.discard(row_id)
+
+    def _attempt(self, row_id: Optional[int], event: Dict[str, Any], attempt: int) -> None:
+        try:
+            self.handler(event)
+        except Exception as e:
+            if attempt < self.max_attempts:
+                logging.warning(f"EVENT QUEUE:Event {event.get('id')} failed on attempt {attempt}, retrying: {e}")
+                self._store("UPDATE events SET attempts = ?, last_error = ? WHERE id = ?", (attempt, str(e), row_id))
+                self._put(row_id, event, attempt + 1)
+                return
+            logging.error(f"EVENT QUEUE:Event {event.get('id')} failed after {attempt} attempts: {e}")
+            self._store("UPDATE events SET status = 'failed', attempts = ?, last_error = ? WHERE id = ?", (attempt, str(e), row_id))
+            with self._lock:
+                self.failed += 1
+            if self.on_failure is not None:
+                try:
+                    self.on_failure(event)
+                except Exception as failure_error:
+                    logging.error(f"EVENT QUEUE:on_failure for event {event.get('id')} raised: {failure_error}")
+            return
+        self._store("DELETE FROM events WHERE id = ?", (row_id,))
+        with self._lock:
+            self.processed += 1
+
+    def join(self) -> None:
+        """Block until every queued event has been handled."""
+        self._queue.join()
+
+    def stop(self) -> None:
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join()
+
+    def close(self) -> None:
+        """Stop the workers and hand this queue's unfinished rows back to the next start()."""
+        self.stop()
+        if self._conn is not None:
+            self._store(
+                "UPDATE events SET owner = NULL, lease_expires_at = NULL WHERE status = 'pending' AND owner = ?",
+                (self.owner,),
+            )
+            with self._lock:
+                self._conn.close()
+                self._conn = None
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "queued": self._queue.qsize(),
+                "processed": self.processed,
+                "failed": self.failed,
+                "workers": len(self._threads),
+            }
@@ -0,0 +1,102 @@
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from clients.circuit_breaker import FAILURE_STATUS_CODES, CircuitOpenError, get_circuit_breaker
+from clients.pipeline_context import record_http_call
+
+
+@dataclass
+class HTTPSessionConfig:
+    pool_connections: int = 10
+    pool_maxsize: int = 10
+    connect_timeout: float = 5.0
+    read_timeout: float = 30.0
+
+    @classmethod
+    def from_env(cls) -> "HTTPSessionConfig":
+        return cls(
+            pool_connections=int(os.getenv("HTTP_POOL_CONNECTIONS", cls.pool_connections)),
+            pool_maxsize=int(os.getenv("HTTP_POOL_MAXSIZE", cls.pool_maxsize)),
+            connect_timeout=float(os.getenv("HTTP_CONNECT_TIMEOUT", cls.connect_timeout)),
+            read_timeout=float(os.getenv("HTTP_READ_TIMEOUT", cls.read_timeout)),
+        )
+
+    @property
+    def timeout(self) -> tuple[float, float]:
+        return (self.connect_timeout, self.read_timeout)
+
+
+_unauthorized_listeners: List[Callable[[str], None]] = []
+
+
+def add_unauthorized_listener(listener: Callable[[str], None]) -> None:
+    """Call listener with the Authorization header of every request answered with 401."""
+    _unauthorized_listeners.append(listener)
+
+
+_session: Optional[requests.Session] = None
+_session_config: Optional[HTTPSessionConfig] = None
+_session_lock = threading.Lock()
+
+
+def _build_session(config: HTTPSessionConfig) -> requests.Session:
+    session = requests.Session()
+    # pool_connections is the number of hosts kept, pool_maxsize the open connections per host
+    adapter = HTTPAdapter(pool_connections=config.pool_connections, pool_maxsize=config.pool_maxsize)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"Connection": "keep-alive"})
+    return session
+
+
+def configure_session(config: HTTPSessionConfig) -> None:
+    """Replace the shared session, e.g. to change pool sizes or timeouts."""
+    global _session, _session_config
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session_config = config
+        _session = _build_session(config)
+
+
+def get_session() -> requests.Session:
+    """Process-wide session so sequential calls to the same host reuse warm connections."""
+    global _session, _session_config
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session_config = _session_config or HTTPSessionConfig.from_env()
+                _session = _build_session(_session_config)
+    return _session
+
+
+def http_request(method: str, url: str, **kwargs) -> requests.Response:
+    breaker = get_circuit_breaker(url)
+    if not breaker.allow_request():
+        raise CircuitOpenError(f"Circuit for {breaker.name} is open, not calling {method} {url}")
+    session = get_session()
+    kwargs.setdefault("timeout", _session_config.timeout)
+    record_http_call(method, url)
+    try:
+        response = session.request(method, url, **kwargs)
+    except requests.exceptions.RequestException:
+        breaker.record_failure()
+        raise
+    except BaseException:
+        breaker.release_probe()
+        raise
+    if response.status_code in FAILURE_STATUS_CODES:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    if response.status_code == 401:
+        authorization = (kwargs.get("headers") or {}).get("Authorization")
+        if authorization:
+            for listener in list(_unauthorized_listeners):
+                listener(authorization)
+    return response
@@ -1,15 +1,23 @@
 from __future__ import annotations
-from typing import Dict, Optional, Tuple, List
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple, List
 import requests
 import logging
 import json
+import threading
 import uuid
 import datetime as dt
 from unittest.mock import Mock
 
-from auth.exchange_token_funcs import exchange_token
+from auth.exchange_token_funcs import get_altinn_token
+from clients.circuit_breaker import CircuitOpenError
+from clients.http_session import http_request
+from clients.retry_policy import call_with_retry
+from clients.rate_limiter import acquire_for_url, configure_rate_limit
 from config.config_loader import APIConfig
 
+class InstanceListingError(Exception):
+    pass
+
 def get_meta_data_info(list_of_data_instance_meta_info: List[Dict[str, str]]) -> Dict[str, str]:
     if not list_of_data_instance_meta_info:
         raise ValueError("No instance metadata provided.")
@@ -24,21 +32,71 @@ def get_meta_data_info(list_of_data_instance_meta_info: List[Dict[str, str]]) ->
             continue
     raise ValueError("No instance with dataType='DataModel' and contentType='application/xml' or 'application/json' was found.")
 
+def compact_instance_record(instance: Dict[str, Any]) -> Dict[str, Any]:
+    """Fields the jobs need from a storage instance, so they do not have to GET it again."""
+    instance_data_meta_data = get_meta_data_info(instance["data"])
+    status = instance.get("status") or {}
+    return {
+        "instanceOwnerPartyId": instance["instanceOwner"]["partyId"],
+        "organisationNumber": instance["instanceOwner"].get("organisationNumber", ""),
+        "personNumber": instance["instanceOwner"].get("personNumber", ""),
+        "instanceId": instance["id"],
+        "dataGuid": instance_data_meta_data.get("id"),
+        "tags": instance_data_meta_data.get("tags", []),
+        "created": instance_data_meta_data.get("created"),
+        "visibleAfter": instance.get("visibleAfter"),
+        "createdBy": instance.get("createdBy"),
+        "lastChangedBy": instance.get("lastChangedBy"),
+        "lastChanged": instance.get("lastChanged"),
+        "isSoftDeleted": bool(status.get("isSoftDeleted") or instance.get("isSoftDeleted")),
+        "isHardDeleted": bool(status.get("isHardDeleted") or instance.get("isHardDeleted")),
+        "isComplete": bool((instance.get("process") or {}).get("ended")),
+    }
+
 def extract_instances_ids(data_storage_extract):
     instances = []
     for instance in data_storage_extract["instances"]:
         if instance.get("data", []):
-            instance_data_meta_data = get_meta_data_info(instance["data"])
-            instances.append(
-            {"instanceOwnerPartyId": instance["instanceOwner"]["partyId"], 
-            "organisationNumber": instance["instanceOwner"].get("organisationNumber", ""), 
-            "personNumber": instance["instanceOwner"].get("personNumber", ""),
-            "instanceId": instance["id"], 
-            "dataGuid": instance_data_meta_data.get("id"),
-            "tags": instance_data_meta_data.get("tags", [])}
-        )
+            instances.append(compact_instance_record(instance))
     return instances
 
+class InstanceIndex:
+    """Set of (organisationNumber, tag) pairs already in storage, for O(1) duplicate checks."""
+
+    def __init__(self, instances: Iterable[Dict[str, Any]] = ()):
+        self._keys: set[Tuple[str, str]] = set()
+        self._lock = threading.Lock()
+        for instance in instances:
+            self.add_instance(instance)
+
+    def add(self, org_number: str, tag: str) -> None:
+        with self._lock:
+            self._keys.add((org_number, tag))
+
+    def add_instance(self, instance: Dict[str, Any]) -> None:
+        for tag in instance.get("tags") or []:
+            self.add(instance.get("organisationNumber"), tag)
+
+    def contains(self, org_number: str, tag: str) -> bool:
+        with self._lock:
+            return (org_number, tag) in self._keys
+
+    def claim(self, org_number: str, tag: str) -> bool:
+        """Add the pair and return True, or return False if it is already there; atomic for concurrent uploads."""
+        with self._lock:
+            if (org_number, tag) in self._keys:
+                return False
+            self._keys.add((org_number, tag))
+            return True
+
+    def discard(self, org_number: str, tag: str) -> None:
+        with self._lock:
+            self._keys.discard((org_number, tag))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._keys)
+
 def get_default_headers(bearer_token: str) -> Dict[str, str]:
     return {
             "accept": "application/json",
@@ -46,9 +104,31 @@ def get_default_headers(bearer_token: str) -> Dict[str, str]:
             "Content-Type": "application/json"
         }
 
+# Why the last make_api_call on a thread returned None
+NOT_SENT = "not_sent"
+REJECTED = "rejected"
+UNKNOWN = "unknown"
+_last_failure = threading.local()
+
+
+def last_call_failure() -> Optional[str]:
+    """NOT_SENT when the request never left this process or never reached the host, REJECTED
+    when the host answered with an error status, UNKNOWN when it may have been processed."""
+    return getattr(_last_failure, "cause", None)
+
+
+def _send_request(method: str, url: str, **kwargs) -> requests.Response:
+    acquire_for_url(url)
+    return http_request(method, url, **kwargs)
+
 def make_api_call(method: str, url: str, headers: Dict[str, str], data: Optional[Dict[str, str]] = None, params: Optional[Dict[str, str]] = None, files: Optional[Dict[str, str]] = None) -> Optional[requests.Response]:
+    _last_failure.cause = None
     try:
-        response = requests.request(method, url, headers=headers, data=data, params=params, files=files)
+        response = call_with_retry(
+            lambda: _send_request(method, url, headers=headers, data=data, params=params, files=files),
+            method,
+            url,
+        )
             
         if response.status_code in [200, 201, 204]:  # Success codes
             logging.info(f"API call successful: {method} {url}")
@@ -70,8 +150,20 @@ def make_api_call(method: str, url: str, headers: Dict[str, str], data: Optional
             return response
         else:
             logging.warning(f"API call failed with status {response.status_code}: {response.text}")
+        # A gateway timeout does not tell whether the upstream processed the request
+        _last_failure.cause = UNKNOWN if response.status_code == 504 else REJECTED
         return None
-            
+
+    except CircuitOpenError as e:
+        logging.error(f"Request not sent: {str(e)}")
+        _last_failure.cause = NOT_SENT
+        return None
+
+    except requests.exceptions.ConnectTimeout:
+        logging.error(f"Connection timeout when calling {url}")
+        _last_failure.cause = NOT_SENT
+        return None
+
     except requests.exceptions.ConnectionError:
         logging.error(f"Connection error when calling {url}")
 
@@ -83,7 +175,8 @@ def make_api_call(method: str, url: str, headers: Dict[str, str], data: Optional
 
     except Exception as e:
         logging.error(f"Unexpected error in API call: {str(e)}")
-        
+
+    _last_failure.cause = UNKNOWN
     return None
 
 
@@ -215,8 +308,8 @@ class AltinnInstanceClient:
         self.maskinporten_endpoint = maskinporten_endpoint
 
     def _get_headers(self, content_type: Optional[str] = None) -> Dict[str, str]:
-        """Get fresh headers with new token"""
-        token = exchange_token(
+        """Get headers with a cached Altinn token, exchanged again only near expiry"""
+        token = get_altinn_token(
             maskinporten_endpoint=self.maskinporten_endpoint,
             secret=self.secret_value,
             client_id=self.maskinport_client_id,
@@ -230,6 +323,8 @@ class AltinnInstanceClient:
 
     @classmethod
     def init_from_config(cls, api_config: APIConfig) -> AltinnInstanceClient:
+        configure_rate_limit(api_config.altinn_client.base_app_url, api_config.altinn_client.app_requests_per_second)
+        configure_rate_limit(api_config.altinn_client.base_platfrom_url, api_config.altinn_client.platform_requests_per_second)
         return cls(
             base_app_url=api_config.altinn_client.base_app_url,
             base_platfrom_url=api_config.altinn_client.base_platfrom_url,
@@ -262,33 +357,89 @@ class AltinnInstanceClient:
         """Simulates an API response from Altinn after posting a new instance."""
         return mock_post_new_instance(header, files)
         
-    def get_stored_instances_ids(self, header: Optional[Dict[str, str]] = None):
-        url = f"{self.base_platfrom_url}"
+    def iter_instance_pages(self, params: Dict[str, Any], page_size: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """Yield storage listing pages one at a time, following the continuation token."""
+        base_url = url = f"{self.base_platfrom_url}"
+        base_params = dict(params)
+        if page_size:
+            base_params["size"] = page_size
+        params: Optional[Dict[str, Any]] = base_params
+        while url:
+            response = make_api_call(method="GET", url=url, headers=self._get_headers("application/json"), params=params)
+            if response is None or response.status_code != 200:
+                status = response.status_code if response is not None else None
+                raise InstanceListingError(f"Failed to list instances for {self.appname}. Status: {status}")
+            page = response.json()
+            yield page
+            continuation_token = page.get("continuationToken")
+            if page.get("next"):
+                # The next link already carries the query string
+                url, params = page["next"], None
+            elif continuation_token and page.get("instances"):
+                url, params = base_url, {**base_params, "continuationToken": continuation_token}
+            else:
+                url = None
+
+    def iter_stored_instances_ids(self, page_size: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        params = {
+        'org': self.application_owner_organisation,
+        'appId': f"{self.application_owner_organisation}/{self.appname}"
+        }
+        for page in self.iter_instance_pages(params, page_size):
+            yield from extract_instances_ids(page)
+
+    def get_stored_instances_ids(self, header: Optional[Dict[str, str]] = None, page_size: Optional[int] = None):
+        return list(self.iter_stored_instances_ids(page_size))
+
+    def iter_party_instances_ids(self, party_id: str, page_size: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        params = {
+        'org': self.application_owner_organisation,
+        'appId': f"{self.application_owner_organisation}/{self.appname}",
+        'instanceOwner.partyId': party_id
+        }
+        for page in self.iter_instance_pages(params, page_size):
+            yield from extract_instances_ids(page)
+
+    def iter_instances_changed_since(self, last_changed: Optional[str], page_size: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """Yield instances whose lastChanged is after last_changed, or all instances when it is None."""
         params = {
         'org': self.application_owner_organisation,
         'appId': f"{self.application_owner_organisation}/{self.appname}"
         }
-        data_storage_instances = make_api_call(method="GET", url=url, headers=self._get_headers("application/json"), params=params)
-        return extract_instances_ids(data_storage_instances.json())
+        if last_changed:
+            params['lastChanged'] = f"gt:{last_changed}"
+        for page in self.iter_instance_pages(params, page_size):
+            yield from extract_instances_ids(page)
 
-    def instance_created(self, org_number: str, tag: str, header: Optional[Dict[str, str]] = None) -> bool:
-        stored_instances = self.get_stored_instances_ids(self._get_headers("application/json"))
+    def build_instance_index(self, page_size: Optional[int] = None) -> InstanceIndex:
+        """List storage once and index it, for runs that check many organisations."""
+        return InstanceIndex(self.iter_stored_instances_ids(page_size))
+
+    def instance_created(self, org_number: str, tag: str, header: Optional[Dict[str, str]] = None, index: Optional[InstanceIndex] = None, party_id: Optional[str] = None) -> bool:
+        if index is not None:
+            return index.contains(org_number, tag)
+        if party_id is not None:
+            stored_instances = self.iter_party_instances_ids(party_id)
+        else:
+            stored_instances = self.get_stored_instances_ids(self._get_headers("application/json"))
         for instance in stored_instances:
             if instance.get("organisationNumber") != org_number:
                 continue
             if tag in instance.get("tags"):
                 return True
         return False
-    
-    def fetch_instances_by_completion(self, instance_complete: bool, header: Optional[Dict[str, str]] = None):
-        url = f"{self.base_platfrom_url}"
+
+    def iter_instances_by_completion(self, instance_complete: bool, page_size: Optional[int] = None) -> Iterator[Dict[str, Any]]:
         params = {
         'org': self.application_owner_organisation,
         'appId': f"{self.application_owner_organisation}/{self.appname}",
         'process.isComplete': instance_complete
         }
-        data_storage_instances = make_api_call(method="GET", url=url, headers=self._get_headers("application/json"), params=params)
-        return extract_instances_ids(data_storage_instances.json())
+        for page in self.iter_instance_pages(params, page_size):
+            yield from extract_instances_ids(page)
+
+    def fetch_instances_by_completion(self, instance_complete: bool, header: Optional[Dict[str, str]] = None, page_size: Optional[int] = None):
+        return list(self.iter_instances_by_completion(instance_complete, page_size))
     
     def complete_instance(self, instanceOwnerPartyId: str, instance_id: str, header: Optional[Dict[str, str]] = None) -> Optional[requests.Response]:
         url = f"{self.basePathApp}/{instanceOwnerPartyId}/{instance_id}/complete"
@@ -1,11 +1,15 @@
 import re
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 import json
 import datetime
 import os
 import shutil
-from config.utils import chech_file_exists, write_blob, read_blob
+from config.utils import chech_file_exists, write_blob, read_blob, delete_blob, list_blobs_with_prefix, read_blob_with_etag, write_blob_if_match
 import logging
+
+# Attempts at a conditional index update before giving up when other writers keep winning
+NOTIFICATION_INDEX_WRITE_ATTEMPTS = 5
+
 class PrefillValidationError(Exception):
     pass
 
@@ -18,6 +22,117 @@ def get_reportid_from_blob(directory: str, appId: str, instance_id: str, event_t
     return json_data["digitaliseringstiltak_report_id"]
 
 
+def notification_index_path(digitaliseringstiltak_report_id: str, app_name: str) -> str:
+    return f"{os.getenv('ENV')}/varsling_index/{digitaliseringstiltak_report_id}_{app_name}.json"
+
+
+def read_notification_index(digitaliseringstiltak_report_id: str, app_name: str) -> Optional[Dict[str, Any]]:
+    """Sent times of Varsling1Send notifications for a report and app, or None when not indexed yet."""
+    return read_blob(notification_index_path(digitaliseringstiltak_report_id, app_name))
+
+
+def write_notification_index(digitaliseringstiltak_report_id: str, app_name: str, sent_times: List[str]) -> bool:
+    """Merge sent_times into the index blob.
+
+    The index is shared by the reminder jobs and the webhook workers in other processes, so
+    the write is conditional on the ETag that was read and retried when another writer won.
+    """
+    path = notification_index_path(digitaliseringstiltak_report_id, app_name)
+    for _ in range(NOTIFICATION_INDEX_WRITE_ATTEMPTS):
+        index, etag = read_blob_with_etag(path)
+        merged = sorted(
+            set((index or {}).get("sent_times", [])) | set(sent_times),
+            key=lambda sent_time: datetime.datetime.fromisoformat(sent_time),
+        )
+        written = write_blob_if_match(
+            path,
+            {
+                "digitaliseringstiltak_report_id": digitaliseringstiltak_report_id,
+                "app_name": app_name,
+                "last_sent_time": merged[-1] if merged else None,
+                "sent_times": merged,
+            },
+            etag if index is not None else None,
+        )
+        if written is not False:
+            return bool(written)
+        logging.info(f"Notification index {path} changed while updating it, retrying")
+    logging.error(f"Gave up updating notification index {path} after {NOTIFICATION_INDEX_WRITE_ATTEMPTS} attempts")
+    return False
+
+
+def record_notification_sent(digitaliseringstiltak_report_id: str, app_name: str, sent_time: str) -> bool:
+    return write_notification_index(digitaliseringstiltak_report_id, app_name, [sent_time])
+
+
+def pending_shipments_prefix() -> str:
+    return f"{os.getenv('ENV')}/varsling_pending/"
+
+
+def pending_shipment_path(digitaliseringstiltak_report_id: str, app_name: str, shipment_id: str) -> str:
+    return pending_shipments_prefix() + f"{digitaliseringstiltak_report_id}_{app_name}_{shipment_id}.json"
+
+
+def add_pending_shipment(digitaliseringstiltak_report_id: str, app_name: str, shipment_id: str, org_number: str, org_name: str, send_time: str, recipientEmail: str) -> bool:
+    """Register a shipment that notification_status should poll until it reaches a final status."""
+    return write_blob(
+        pending_shipment_path(digitaliseringstiltak_report_id, app_name, shipment_id),
+        {
+            "digitaliseringstiltak_report_id": digitaliseringstiltak_report_id,
+            "app_name": app_name,
+            "shipment_id": shipment_id,
+            "org_number": org_number,
+            "org_name": org_name,
+            "send_time": send_time,
+            "recipientEmail": recipientEmail,
+        },
+    )
+
+
+def list_pending_shipments() -> List[Dict[str, Any]]:
+    pending = []
+    for blob_name in list_blobs_with_prefix(pending_shipments_prefix()):
+        entry = read_blob(blob_name)
+        if entry:
+            pending.append(entry)
+    return pending
+
+
+def remove_pending_shipment(digitaliseringstiltak_report_id: str, app_name: str, shipment_id: str) -> bool:
+    return delete_blob(pending_shipment_path(digitaliseringstiltak_report_id, app_name, shipment_id))
+
+
+def logged_shipment_ids(log_path: str, digitaliseringstiltak_report_id: str, app_name: str, event_type: str) -> List[str]:
+    """Shipment ids of the event_type logs written to log_path for a report and app."""
+    prefix = f"{log_path}{digitaliseringstiltak_report_id}_{app_name}_{event_type}_"
+    return [blob_name[len(prefix):-len(".json")] for blob_name in list_blobs_with_prefix(prefix) if blob_name.endswith(".json")]
+
+
+def backfill_pending_shipments(log_path: str) -> int:
+    """Add every Varsling1Send in log_path without a Varsling1Recieved to the pending manifest."""
+    blob_names = set(list_blobs_with_prefix(log_path))
+    added = 0
+    for blob_name in blob_names:
+        if "_Varsling1Send_" not in blob_name:
+            continue
+        if blob_name.replace("_Varsling1Send_", "_Varsling1Recieved_") in blob_names:
+            continue
+        sent = read_blob(blob_name)
+        if not sent:
+            continue
+        added += add_pending_shipment(
+            sent.get("digitaliseringstiltak_report_id"),
+            sent.get("app_name"),
+            sent.get("shipment_id"),
+            sent.get("org_number"),
+            sent.get("virksomhets_name"),
+            sent.get("sent_time"),
+            sent.get("recipientEmail"),
+        )
+    logging.info(f"NOTIFICATION STATUS:Backfilled {added} pending shipments from {log_path}")
+    return added
+
+
 class InstanceTracker:
     def __init__(self, log_file: Dict[str, Any], log_path: str = None):
         self.log_file = {}
@@ -49,6 +164,10 @@ class InstanceTracker:
         }
         
         write_blob(self.log_path+f"{digitaliseringstiltak_report_id}_{app_name}_{event_type}_{shipment_id}.json",instance_log_entry)
+        if event_type == "Varsling1Send":
+            add_pending_shipment(digitaliseringstiltak_report_id, app_name, shipment_id, org_number, org_name, send_time, recipientEmail)
+            if send_time:
+                record_notification_sent(digitaliseringstiltak_report_id, app_name, send_time)
 
     def logging_instance(self, instance_id: str,org_number: str, digitaliseringstiltak_report_id: str, instance_meta_data: dict, data_dict: dict ,event_type: str):
         if not org_number or not digitaliseringstiltak_report_id:
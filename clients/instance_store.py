@@ -0,0 +1,229 @@
+from __future__ import annotations
+from typing import Any, Dict, Iterable, List, Optional
+import datetime
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+from clients.instance_client import AltinnInstanceClient
+from config.utils import to_utc_aware
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS instances (
+    app_name TEXT NOT NULL,
+    instance_id TEXT NOT NULL,
+    party_id TEXT,
+    org_number TEXT,
+    data_guid TEXT,
+    tags TEXT NOT NULL DEFAULT '[]',
+    is_complete INTEGER NOT NULL DEFAULT 0,
+    last_changed TEXT,
+    record TEXT NOT NULL,
+    PRIMARY KEY (app_name, instance_id)
+);
+CREATE INDEX IF NOT EXISTS instances_org_number ON instances (app_name, org_number);
+CREATE TABLE IF NOT EXISTS reminder_state (
+    app_name TEXT NOT NULL,
+    instance_id TEXT NOT NULL,
+    next_due_at TEXT,
+    evaluated_at TEXT NOT NULL,
+    PRIMARY KEY (app_name, instance_id)
+);
+CREATE TABLE IF NOT EXISTS sync_state (
+    app_name TEXT PRIMARY KEY,
+    watermark TEXT,
+    synced_at TEXT NOT NULL
+);
+"""
+
+
+def open_instance_store() -> Optional[InstanceMetadataStore]:
+    """Store at INSTANCE_STORE_PATH, or None when jobs should list Altinn directly."""
+    path = os.getenv("INSTANCE_STORE_PATH")
+    if not path:
+        return None
+    return InstanceMetadataStore(path, full_sync_days=float(os.getenv("INSTANCE_STORE_FULL_SYNC_DAYS", "7")))
+
+
+class InstanceMetadataStore:
+    """Local SQLite mirror of the compact storage records, kept fresh by delta sync on lastChanged.
+
+    Delta sync cannot see hard deletes, so sync() falls back to a full sync once the last
+    full sync of an app is older than full_sync_days.
+    """
+
+    def __init__(self, path: str, full_sync_days: float = 7):
+        self.path = path
+        self.full_sync_days = full_sync_days
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.executescript(SCHEMA)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def upsert(self, app_name: str, records: Iterable[Dict[str, Any]]) -> int:
+        rows = [
+            (
+                app_name,
+                record["instanceId"],
+                record.get("instanceOwnerPartyId"),
+                record.get("organisationNumber"),
+                record.get("dataGuid"),
+                json.dumps(record.get("tags") or []),
+                int(bool(record.get("isComplete"))),
+                record.get("lastChanged"),
+                json.dumps(record),
+            )
+            for record in records
+        ]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO instances VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+        return len(rows)
+
+    def remove(self, app_name: str, instance_id: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM instances WHERE app_name = ? AND instance_id = ?", (app_name, instance_id)
+            )
+            self._conn.execute(
+                "DELETE FROM reminder_state WHERE app_name = ? AND instance_id = ?", (app_name, instance_id)
+            )
+
+    def get_watermark(self, app_name: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT watermark FROM sync_state WHERE app_name = ?", (app_name,)).fetchone()
+        return row["watermark"] if row else None
+
+    def _synced_at(self, app_name: str) -> Optional[datetime.datetime]:
+        with self._lock:
+            row = self._conn.execute("SELECT synced_at FROM sync_state WHERE app_name = ?", (app_name,)).fetchone()
+        return to_utc_aware(row["synced_at"]) if row else None
+
+    def full_sync_due(self, app_name: str) -> bool:
+        last_full = self._synced_at(f"{app_name}#full")
+        if last_full is None:
+            return True
+        return datetime.datetime.now(datetime.UTC) - last_full >= datetime.timedelta(days=self.full_sync_days)
+
+    def set_watermark(self, app_name: str, watermark: Optional[str]) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?)",
+                (app_name, watermark, datetime.datetime.now(datetime.UTC).isoformat()),
+            )
+
+    def query(
+        self,
+        app_name: Optional[str] = None,
+        org_number: Optional[str] = None,
+        tag: Optional[str] = None,
+        is_complete: Optional[bool] = None,
+        changed_after: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        clauses, params = [], []
+        if app_name is not None:
+            clauses.append("app_name = ?")
+            params.append(app_name)
+        if org_number is not None:
+            clauses.append("org_number = ?")
+            params.append(org_number)
+        if tag is not None:
+            clauses.append("EXISTS (SELECT 1 FROM json_each(instances.tags) WHERE json_each.value = ?)")
+            params.append(tag)
+        if is_complete is not None:
+            clauses.append("is_complete = ?")
+            params.append(int(is_complete))
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT app_name, record FROM instances {where} ORDER BY app_name, instance_id", params
+            ).fetchall()
+        records = [json.loads(row["record"]) for row in rows]
+        if changed_after:
+            threshold = to_utc_aware(changed_after)
+            records = [r for r in records if r.get("lastChanged") and to_utc_aware(r["lastChanged"]) > threshold]
+        return records
+
+    def set_reminder_state(self, app_name: str, instance_id: str, next_due_at: Optional[datetime.datetime]) -> None:
+        """Remember when an unchanged instance next needs a reminder check (None: only after it changes)."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO reminder_state VALUES (?, ?, ?, ?)",
+                (
+                    app_name,
+                    instance_id,
+                    next_due_at.astimezone(datetime.UTC).isoformat() if next_due_at else None,
+                    datetime.datetime.now(datetime.UTC).isoformat(),
+                ),
+            )
+
+    def reminder_candidates(self, app_name: str, changed_since: Optional[str], now: datetime.datetime) -> List[Dict[str, Any]]:
+        """Incomplete instances that are new, changed after changed_since, or due by now."""
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT i.record, r.evaluated_at, r.next_due_at FROM instances i
+                LEFT JOIN reminder_state r ON r.app_name = i.app_name AND r.instance_id = i.instance_id
+                WHERE i.app_name = ? AND i.is_complete = 0
+                ORDER BY i.instance_id
+                """,
+                (app_name,),
+            ).fetchall()
+        threshold = to_utc_aware(changed_since) if changed_since else None
+        candidates = []
+        for row in rows:
+            record = json.loads(row["record"])
+            last_changed = record.get("lastChanged")
+            if (
+                row["evaluated_at"] is None
+                or threshold is None
+                or (last_changed and to_utc_aware(last_changed) > threshold)
+                or (row["next_due_at"] and to_utc_aware(row["next_due_at"]) <= now)
+            ):
+                candidates.append(record)
+        return candidates
+
+    def sync(self, client: AltinnInstanceClient, full: bool = False, page_size: Optional[int] = None) -> int:
+        """Pull instances changed since the last sync of client.appname and return how many changed.
+
+        A full sync also drops rows for instances that are no longer listed, e.g. after hard deletes.
+        It runs when asked for and whenever full_sync_due says the last one is too old.
+        """
+        app_name = client.appname
+        if not full and self.full_sync_due(app_name):
+            logging.info(f"INSTANCE STORE:Last full sync of {app_name} is older than {self.full_sync_days} days, listing all instances")
+            full = True
+        watermark = None if full else self.get_watermark(app_name)
+        latest = to_utc_aware(watermark) if watermark else None
+        new_watermark = watermark
+        seen, batch, changed = set(), [], 0
+        for record in client.iter_instances_changed_since(watermark, page_size):
+            seen.add(record["instanceId"])
+            batch.append(record)
+            last_changed = record.get("lastChanged")
+            if last_changed and (latest is None or to_utc_aware(last_changed) > latest):
+                latest, new_watermark = to_utc_aware(last_changed), last_changed
+            if len(batch) >= 500:
+                changed += self.upsert(app_name, batch)
+                batch = []
+        changed += self.upsert(app_name, batch)
+
+        if full:
+            with self._lock, self._conn:
+                stored = [row[0] for row in self._conn.execute("SELECT instance_id FROM instances WHERE app_name = ?", (app_name,))]
+                stale = [(app_name, instance_id) for instance_id in stored if instance_id not in seen]
+                self._conn.executemany("DELETE FROM instances WHERE app_name = ? AND instance_id = ?", stale)
+            if stale:
+                logging.info(f"INSTANCE STORE:Removed {len(stale)} instances no longer in storage for {app_name}")
+            self.set_watermark(f"{app_name}#full", new_watermark)
+        self.set_watermark(app_name, new_watermark)
+        logging.info(f"INSTANCE STORE:Synced {changed} changed instances for {app_name} (watermark {new_watermark})")
+        return changed
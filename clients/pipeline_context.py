@@ -0,0 +1,45 @@
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+import threading
+
+_active = threading.local()
+
+
+@dataclass
+class PipelineContext:
+    """State shared by the download, upload and notify steps of one webhook event.
+
+    Steps look up configs, clients and trackers with get_or_create, so each is built once
+    per event, and the downloaded instance metadata is kept for the later steps.
+    """
+
+    instance_meta: Optional[Dict[str, Any]] = None
+    http_calls: List[Tuple[str, str]] = field(default_factory=list)
+    _objects: Dict[Hashable, Any] = field(default_factory=dict, repr=False)
+
+    def get_or_create(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        if key not in self._objects:
+            self._objects[key] = factory()
+        return self._objects[key]
+
+    @contextmanager
+    def activate(self) -> Iterator["PipelineContext"]:
+        """Record every HTTP call made by this thread inside the block in http_calls."""
+        previous = getattr(_active, "context", None)
+        _active.context = self
+        try:
+            yield self
+        finally:
+            _active.context = previous
+
+    def call_summary(self) -> Dict[str, int]:
+        return dict(Counter(f"{method} {urlsplit(url).netloc}" for method, url in self.http_calls))
+
+
+def record_http_call(method: str, url: str) -> None:
+    context = getattr(_active, "context", None)
+    if context is not None:
+        context.http_calls.append((method, url))
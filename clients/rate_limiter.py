@@ -0,0 +1,67 @@
+from typing import Dict, Optional
+import threading
+import time
+
+
+class TokenBucket:
+    """Allows `rate` requests per second on average with bursts of up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError("Rate must be positive")
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        """Block until `tokens` are available and return the time spent waiting."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+_limiters: Dict[str, TokenBucket] = {}
+_limiters_lock = threading.Lock()
+
+
+def configure_rate_limit(base_url: str, requests_per_second: Optional[float], burst: Optional[float] = None) -> None:
+    """Limit all calls whose URL starts with base_url. A falsy rate removes the limit."""
+    base_url = base_url.rstrip("/")
+    with _limiters_lock:
+        if not requests_per_second:
+            _limiters.pop(base_url, None)
+            return
+        current = _limiters.get(base_url)
+        if current and current.rate == requests_per_second and current.capacity == (burst or max(1.0, requests_per_second)):
+            return
+        _limiters[base_url] = TokenBucket(requests_per_second, burst)
+
+
+def get_rate_limiter(url: str) -> Optional[TokenBucket]:
+    with _limiters_lock:
+        matches = [base_url for base_url in _limiters if url == base_url or url.startswith(base_url + "/") or url.startswith(base_url + "?")]
+        return _limiters[max(matches, key=len)] if matches else None
+
+
+def acquire_for_url(url: str) -> float:
+    limiter = get_rate_limiter(url)
+    return limiter.acquire() if limiter else 0.0
+
+
+def clear_rate_limits() -> None:
+    with _limiters_lock:
+        _limiters.clear()
@@ -0,0 +1,135 @@
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Optional
+from urllib.parse import urlsplit
+import logging
+import os
+import random
+import re
+import threading
+import time
+
+import requests
+
+RETRYABLE_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+
+_ID_SEGMENT = re.compile(r"^(\d+|[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12})$")
+
+
+def endpoint_key(method: str, url: str) -> str:
+    """Group URLs per endpoint by replacing party ids and guids in the path."""
+    parts = urlsplit(url)
+    path = "/".join("{id}" if _ID_SEGMENT.match(segment) else segment for segment in parts.path.split("/"))
+    return f"{method.upper()} {parts.netloc}{path}"
+
+
+class RetryMetrics:
+    def __init__(self):
+        self._retries: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def record_retry(self, method: str, url: str) -> None:
+        with self._lock:
+            self._retries[endpoint_key(method, url)] += 1
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._retries)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._retries.clear()
+
+
+retry_metrics = RetryMetrics()
+
+
+@dataclass
+class RetryPolicy:
+    max_attempts: int = 4
+    backoff_base: float = 0.5
+    backoff_max: float = 8.0
+    total_deadline: float = 30.0
+    retry_status_codes: frozenset = field(default=RETRYABLE_STATUS_CODES)
+    idempotent_methods: frozenset = field(default=IDEMPOTENT_METHODS)
+
+    @classmethod
+    def from_env(cls) -> "RetryPolicy":
+        return cls(
+            max_attempts=int(os.getenv("HTTP_RETRY_MAX_ATTEMPTS", cls.max_attempts)),
+            backoff_base=float(os.getenv("HTTP_RETRY_BACKOFF_BASE", cls.backoff_base)),
+            backoff_max=float(os.getenv("HTTP_RETRY_BACKOFF_MAX", cls.backoff_max)),
+            total_deadline=float(os.getenv("HTTP_RETRY_TOTAL_DEADLINE", cls.total_deadline)),
+        )
+
+    def should_retry_status(self, method: str, status_code: int) -> bool:
+        if status_code not in self.retry_status_codes:
+            return False
+        # A 429 means the request was rejected before processing, so even a POST is safe to resend
+        return status_code == 429 or method.upper() in self.idempotent_methods
+
+    def should_retry_exception(self, method: str, error: Exception) -> bool:
+        if isinstance(error, requests.exceptions.ConnectTimeout):
+            return True
+        if method.upper() not in self.idempotent_methods:
+            return False
+        return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+    def backoff(self, attempt: int) -> float:
+        """Exponential backoff with full jitter."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+
+    def retry_after(self, response: requests.Response) -> Optional[float]:
+        value = response.headers.get("Retry-After") if response.headers else None
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+default_retry_policy = RetryPolicy.from_env()
+
+
+def call_with_retry(
+    send: Callable[[], requests.Response],
+    method: str,
+    url: str,
+    policy: Optional[RetryPolicy] = None,
+) -> requests.Response:
+    """Call send() until it succeeds, the error is not retryable, or attempts/deadline run out."""
+    policy = policy or default_retry_policy
+    deadline = time.monotonic() + policy.total_deadline
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            response = send()
+        except requests.exceptions.RequestException as e:
+            if attempt >= policy.max_attempts or not policy.should_retry_exception(method, e):
+                raise
+            delay = policy.backoff(attempt)
+            if time.monotonic() + delay > deadline:
+                raise
+            reason = type(e).__name__
+        else:
+            if attempt >= policy.max_attempts or not policy.should_retry_status(method, response.status_code):
+                return response
+            retry_after = policy.retry_after(response)
+            delay = retry_after if retry_after is not None else policy.backoff(attempt)
+            if time.monotonic() + delay > deadline:
+                return response
+            reason = f"status {response.status_code}"
+
+        retry_metrics.record_retry(method, url)
+        logging.warning(f"Retrying {method} {url} after {reason} in {delay:.2f}s (attempt {attempt + 1}/{policy.max_attempts})")
+        time.sleep(delay)
@@ -4,8 +4,9 @@ import uuid
 import re
 from typing import Optional, Dict, Any
 
-from auth.exchange_token_funcs import exchange_token 
+from auth.exchange_token_funcs import get_altinn_token 
 from clients.instance_client import make_api_call
+from clients.rate_limiter import configure_rate_limit
 from config.config_loader import APIConfig
 from datetime import datetime, timezone, timedelta
 
@@ -30,6 +31,7 @@ class AltinnVarslingClient:
     
     @classmethod
     def init_from_config(cls, api_config: APIConfig) -> AltinnVarslingClient:
+        configure_rate_limit(api_config.altinn_client.base_varsling_url, api_config.altinn_client.varsling_requests_per_second)
         return cls(
             base_url=api_config.altinn_client.base_varsling_url,
             maskinport_client_id=api_config.maskinporten_config_instance.client_id,
@@ -41,8 +43,8 @@ class AltinnVarslingClient:
         )
 
     def _get_headers(self, content_type: Optional[str] = None) -> Dict[str, str]:
-        """Get fresh headers with new token"""
-        token = exchange_token(
+        """Get headers with a cached Altinn token, exchanged again only near expiry"""
+        token = get_altinn_token(
             maskinporten_endpoint=self.maskinporten_endpoint,
             secret=self.secret_value,
             client_id=self.maskinport_client_id,
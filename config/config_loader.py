@@ -5,6 +5,8 @@ import json
 from azure.identity import DefaultAzureCredential
 from azure.keyvault.secrets import SecretClient
 import os 
+import threading
+import time
 from dotenv import load_dotenv
 from config.utils import validate_initiell_prefill_data, transform_initiell_data_to_nested_with_prefill, get_status_date, get_initiell_date, get_oppstart_date, get_slutt_date
 load_dotenv()
@@ -36,6 +38,9 @@ class AltinnClientConfig:
     base_platfrom_url: str
     base_varsling_url: str
     application_owner_organisation: str
+    app_requests_per_second: float | None = None
+    platform_requests_per_second: float | None = None
+    varsling_requests_per_second: float | None = None
 
 @dataclass
 class MaskinportenEndpointsConfig:
@@ -106,15 +111,47 @@ def _load_json(path: Path) -> dict:
     with open(path, "r", encoding="utf-8") as f:
         return json.load(f)
 
-def load_full_config(base_path: Path, app_name: str, env: str) -> APIConfig:
+SECRET_CACHE_TTL_SECONDS = int(os.getenv("SECRET_CACHE_TTL_SECONDS", "3600"))
+
+_secret_client: SecretClient | None = None
+_secret_cache: dict[str, tuple[str, float]] = {}
+_config_cache: dict[tuple[str, str, str], APIConfig] = {}
+_cache_lock = threading.Lock()
+key_vault_calls = 0
+
+
+def get_maskinporten_secret() -> str:
+    """Maskinporten secret from Key Vault, fetched again only after SECRET_CACHE_TTL_SECONDS."""
+    global _secret_client, key_vault_calls
+    secret_name = os.getenv("MASKINPORTEN_SECRET_NAME")
+    with _cache_lock:
+        cached = _secret_cache.get(secret_name)
+        if cached and time.monotonic() - cached[1] < SECRET_CACHE_TTL_SECONDS:
+            return cached[0]
+        if _secret_client is None:
+            _secret_client = SecretClient(vault_url="https://keyvaultvss.vault.azure.net/", credential=DefaultAzureCredential())
+        secret_client = _secret_client
+    secret_value = secret_client.get_secret(secret_name).value
+    with _cache_lock:
+        key_vault_calls += 1
+        _secret_cache[secret_name] = (secret_value, time.monotonic())
+    return secret_value
+
+
+def clear_config_cache() -> None:
+    global _secret_client
+    with _cache_lock:
+        _secret_client = None
+        _secret_cache.clear()
+        _config_cache.clear()
+
+
+def _build_full_config(base_path: Path, app_name: str, env: str, secret_value: str) -> APIConfig:
     maskinporten_config_instance = MaskinportenConfig(**_load_json(base_path / env / "maskinporten_config_instance.json"))
     maskinporten_config_varsling = MaskinportenConfig(**_load_json(base_path / env / "maskinporten_config_varsling.json"))
     client_config = AltinnClientConfig(**_load_json(base_path / env / "config_client_file.json"))
     endpoints_config = MaskinportenEndpointsConfig(**_load_json(base_path / env /"maskinporten_endpoints.json"))
     workflow_dag = WorkflowDAG(_load_json(base_path / env / "workflow_DAG.json"))
-    credential = DefaultAzureCredential()
-    secret_client = SecretClient(vault_url="https://keyvaultvss.vault.azure.net/", credential=credential)
-    secret_value = secret_client.get_secret(os.getenv("MASKINPORTEN_SECRET_NAME")).value
     app_configs = _load_json(base_path / env / "app_config.json")
 
     return APIConfig(
@@ -125,4 +162,18 @@ def load_full_config(base_path: Path, app_name: str, env: str) -> APIConfig:
         secret_value=secret_value,
         workflow_dag=workflow_dag,
         app_config=APPConfig(**app_configs[app_name])
-    )
\ No newline at end of file
+    )
+
+
+def load_full_config(base_path: Path, app_name: str, env: str) -> APIConfig:
+    """Config for (env, app_name), shared across calls until the Key Vault secret changes."""
+    secret_value = get_maskinporten_secret()
+    key = (str(base_path), env, app_name)
+    with _cache_lock:
+        config = _config_cache.get(key)
+    if config is not None and config.secret_value == secret_value:
+        return config
+    config = _build_full_config(base_path, app_name, env, secret_value)
+    with _cache_lock:
+        _config_cache[key] = config
+    return config
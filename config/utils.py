@@ -3,11 +3,14 @@ import re
 from typing import Any, Dict, Optional, Tuple
 import logging
 import pytz
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError
 from azure.storage.blob import BlobServiceClient
 from azure.identity import DefaultAzureCredential, EnvironmentCredential
 from dotenv import load_dotenv
 import os
 import json
+import threading
 from datetime import datetime, date
 import isodate
 from .type_dict_structure import DataModel, Prefill
@@ -220,29 +223,54 @@ def _is_valid_phone(phone: str) -> bool:
     return re.match(r"^(\+47)?[0-9]{8}$", cleaned) is not None
 
 
-def connect_blob():
-    try:
-        load_dotenv()
+_container_client = None
+_container_client_lock = threading.Lock()
+blob_client_constructions = 0
 
-        if os.getenv("AZURE_CLIENT_ID"):
-            # print("Using EnvironmentCredential for local dev")
-            credential = EnvironmentCredential()
-        else:
-            # print("Using DefaultAzureCredential (includes managed identity in Azure)")
-            credential = DefaultAzureCredential()
 
-        blob_service_client = BlobServiceClient(
-            os.getenv("BLOB_STORAGE_ACCOUNT_URL"), credential=credential
-        )
-        container_client = blob_service_client.get_container_client(
-            os.getenv("BLOB_CONTAINER_NAME")
-        )
+def _build_container_client():
+    global blob_client_constructions
+    load_dotenv()
 
-        return container_client
+    if os.getenv("AZURE_CLIENT_ID"):
+        # print("Using EnvironmentCredential for local dev")
+        credential = EnvironmentCredential()
+    else:
+        # print("Using DefaultAzureCredential (includes managed identity in Azure)")
+        credential = DefaultAzureCredential()
+
+    blob_service_client = BlobServiceClient(
+        os.getenv("BLOB_STORAGE_ACCOUNT_URL"), credential=credential
+    )
+    container_client = blob_service_client.get_container_client(
+        os.getenv("BLOB_CONTAINER_NAME")
+    )
+    blob_client_constructions += 1
+    return container_client
+
+
+def connect_blob():
+    """Return the process-wide container client, creating it on first use.
+
+    The credential lives as long as the client, so its access token is cached between blob calls.
+    """
+    global _container_client
+    if _container_client is not None:
+        return _container_client
+    with _container_client_lock:
+        if _container_client is None:
+            try:
+                _container_client = _build_container_client()
+            except Exception as e:
+                logging.error(f"Error connecting to Azure Blob Storage: {e}")
+                return None
+        return _container_client
 
-    except Exception as e:
-        logging.error(f"Error connecting to Azure Blob Storage: {e}")
-        return None
+
+def reset_blob_client() -> None:
+    global _container_client
+    with _container_client_lock:
+        _container_client = None
 
 
 def chech_file_exists(file: str) -> bool:
@@ -283,6 +311,56 @@ def write_blob(file: str, data: Dict[str, str]) -> bool:
         return False
 
 
+def read_blob_with_etag(file: str) -> Tuple[Optional[Any], Optional[str]]:
+    """The blob's JSON content and ETag, or (None, None) when it does not exist or cannot be read."""
+    container_client = connect_blob()
+    if not container_client:
+        return None, None
+    try:
+        downloader = container_client.get_blob_client(file).download_blob()
+        return json.loads(downloader.readall()), downloader.properties.etag
+    except Exception as e:
+        logging.error(f"Error reading blob {file}: {e}")
+        return None, None
+
+
+def write_blob_if_match(file: str, data: Dict[str, Any], etag: Optional[str]) -> Optional[bool]:
+    """Write only if the blob still has etag, or does not exist yet when etag is None.
+
+    Returns True when written, False when another writer changed the blob first, and None on
+    other errors.
+    """
+    container_client = connect_blob()
+    if not container_client:
+        return None
+    try:
+        blob_client = container_client.get_blob_client(file)
+        if etag is None:
+            blob_client.upload_blob(json.dumps(data), overwrite=False)
+        else:
+            blob_client.upload_blob(
+                json.dumps(data), overwrite=True, etag=etag, match_condition=MatchConditions.IfNotModified
+            )
+        return True
+    except (ResourceExistsError, ResourceModifiedError):
+        return False
+    except Exception as e:
+        logging.error(f"Error writing blob {file}: {e}")
+        return None
+
+
+def delete_blob(file: str) -> bool:
+    container_client = connect_blob()
+    if not container_client:
+        return False
+    try:
+        container_client.get_blob_client(file).delete_blob()
+        return True
+    except Exception as e:
+        logging.error(f"Error deleting blob {file}: {e}")
+        return False
+
+
 def blob_directory_exists(directory: str) -> bool:
     container_client = connect_blob()
     if not container_client:
@@ -468,6 +546,20 @@ def create_payload(
     return files
 
 
+def verified_local_data(files: Dict[str, Tuple[str, str, str]], data_element: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """The DataModel sent by create_payload, if the created data element matches it in type and size.
+
+    Returns None when Altinn reports a different size (e.g. the app changed the data on
+    create) or no size at all, in which case the data has to be downloaded.
+    """
+    _, content, content_type = files["DataModel"]
+    if data_element.get("contentType") != content_type:
+        return None
+    if data_element.get("size") != len(content.encode("utf-8")):
+        return None
+    return json.loads(content)
+
+
 def split_party_instance_id(party_instance_id: str) -> Tuple[str]:
     party_id, instance_id = party_instance_id.split("/")
     return party_id, instance_id
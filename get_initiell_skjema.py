@@ -1,6 +1,4 @@
-from typing import Any, Dict, Tuple
-from azure.keyvault.secrets import SecretClient
-from azure.identity import DefaultAzureCredential
+from typing import Any, Dict, Optional, Tuple
 from pathlib import Path
 import logging
 import json
@@ -9,6 +7,7 @@ import os
 from datetime import datetime, timezone, timedelta
 from clients.instance_client import AltinnInstanceClient, get_meta_data_info
 from clients.instance_logging import InstanceTracker, get_reportid_from_blob
+from clients.pipeline_context import PipelineContext
 from config.config_loader import load_full_config
 from config.utils import is_before_time_delta
 
@@ -26,18 +25,15 @@ def write_to_json(data: Dict[str, Any], path_to_folder: Path, filename: str) ->
     with open(path_to_folder / filename, 'w', encoding='utf-8') as file:
         json.dump(data, file, ensure_ascii=False, indent=4)
 
-credential = DefaultAzureCredential()
-client = SecretClient(vault_url=os.getenv("MASKINPORTEN_SECRET_VAULT_URL"), credential=credential)
-secret = client.get_secret(os.getenv("MASKINPORTEN_SECRET_NAME"))
-secret_value = secret.value
 
-def run(party_id: str, instance_id: str, app_name: str) -> Tuple[Dict[str, str], str]:
+def run(party_id: str, instance_id: str, app_name: str, context: Optional[PipelineContext] = None) -> Tuple[Dict[str, str], str]:
+    context = context or PipelineContext()
     path_to_config_folder = Path(__file__).parent / "config_files"
-    config = load_full_config(path_to_config_folder, app_name, os.getenv("ENV"))
+    config = context.get_or_create(("config", app_name), lambda: load_full_config(path_to_config_folder, app_name, os.getenv("ENV")))
 
 
-    regvil_instance_client = AltinnInstanceClient.init_from_config(config)
-    tracker = InstanceTracker.from_directory(f"{os.getenv('ENV')}/event_log/")
+    regvil_instance_client = context.get_or_create(("instance_client", app_name), lambda: AltinnInstanceClient.init_from_config(config))
+    tracker = context.get_or_create("event_log_tracker", lambda: InstanceTracker.from_directory(f"{os.getenv('ENV')}/event_log/"))
 
 
     digitaliseringstiltak_report_id = get_reportid_from_blob(f"{os.getenv('ENV')}/event_log/",app_name, instance_id, config.app_config.tag["tag_instance"])
@@ -55,6 +51,7 @@ def run(party_id: str, instance_id: str, app_name: str) -> Tuple[Dict[str, str],
     except ValueError:
         logging.error(f"GET_SKJEMA:Error processing party id: {party_id}, instance id {instance_id}")
         return {}, 502
+    context.instance_meta = instance_meta_info
     meta_data = get_meta_data_info(instance_meta_info.get("data"))
 
     if is_valid_instance(meta_data):
@@ -1,75 +1,90 @@
-from config.utils import connect_blob, chech_file_exists, read_blob
 from dotenv import load_dotenv
 import os
 from config.config_loader import load_full_config
 from clients.varsling_client import AltinnVarslingClient
-from clients.instance_logging import InstanceTracker
+from clients.instance_logging import InstanceTracker, list_pending_shipments, remove_pending_shipment, backfill_pending_shipments
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 load_dotenv()
 
-def main():
-    connection = connect_blob()
-    directory = f"{os.getenv('ENV')}/varsling/"
-    send_blobs = connection.list_blobs(name_starts_with=directory)
-    for blob in send_blobs:
-        name = blob.name
-        if "_Varsling1Send_" not in name:
-            continue
+# Shipment statuses after which Altinn will not change the order any more
+TERMINAL_SHIPMENT_STATUSES = {"Order_Completed", "Order_SendConditionNotMet", "Order_Cancelled"}
 
-        # Extract parts
-        base = os.path.splitext(name)[0]
-        parts = base.split('_')
-        if len(parts) < 4:
-            continue
 
-        report_id = parts[0]
-        app_name = parts[1]
-        shipment_id = parts[3]
-        
-        # Construct the expected 'Recieved' filename
-        recieved_blob_name = f"{report_id}_{app_name}_Varsling1Recieved_{shipment_id}.json"
+def poll_shipment(entry, varsling_client: AltinnVarslingClient, directory: str) -> bool:
+    """Check one pending shipment and drain it when final. Returns True when it was drained."""
+    report_id = entry["digitaliseringstiltak_report_id"]
+    app_name = entry["app_name"]
+    shipment_id = entry["shipment_id"]
 
-        # Check if the Recieved file already exists
+    response = varsling_client.get_shipment_status(shipment_id=shipment_id)
+    if not response:
+        logging.error(f"NOTIFICATION STATUS:Failed to get shipment status for {shipment_id} and {report_id}")
+        return False
+    if response.status_code != 200:
+        logging.error(f"NOTIFICATION STATUS:Failed to get shipment status for {shipment_id}: {response.text}")
+        return False
+    shipment_status = response.json()
+    status = shipment_status.get("status")
+    if status not in TERMINAL_SHIPMENT_STATUSES:
+        return False
 
-        if not chech_file_exists(recieved_blob_name):
-            path_to_config_folder = Path(__file__).parent / "config_files"
-            config = load_full_config(path_to_config_folder, app_name, os.getenv("ENV"))
+    if status == "Order_Completed":
+        recipient_email = entry.get("recipientEmail")
+        tracker = InstanceTracker.from_directory(directory)
+        tracker.logging_varlsing(
+            org_number=entry.get("org_number"),
+            org_name=entry.get("org_name"),
+            app_name=app_name,
+            send_time=entry.get("send_time"),
+            digitaliseringstiltak_report_id=report_id,
+            shipment_id=shipment_id,
+            recipientEmail=recipient_email,
+            event_type="Varsling1Recieved",
+            shipment_status=shipment_status
+        )
+        if shipment_status.get("recipients")[0].get("status") == "Email_Delivered":
+            logging.info(f"NOTIFICATION STATUS:Marked as received: {report_id}_{app_name}_Varsling1Recieved_{shipment_id}.json")
+        else:
+            logging.warning(f"NOTIFICATION STATUS:Shipment {shipment_id} not delivered to {recipient_email}. Status: {shipment_status.get("recipients")[0].get("status")}")
+    else:
+        logging.warning(f"NOTIFICATION STATUS:Shipment {shipment_id} for {report_id} ended with status {status}")
+    remove_pending_shipment(report_id, app_name, shipment_id)
+    return True
 
-            varsling_client = AltinnVarslingClient.init_from_config(config)
-            response = varsling_client.get_shipment_status(shipment_id=shipment_id)
-            if not response:
-                logging.error(f"NOTIFICATION STATUS:Failed to get shipment status for {shipment_id} and {report_id[len(directory):]}")
-                continue
-            if response.status_code != 200:
-                logging.error(f"NOTIFICATION STATUS:Failed to get shipment status for {shipment_id}: {response.text}")
-                continue    
-            if response.json().get("status") == "Order_Completed":
-                sent_blob_name = f"{report_id}_{app_name}_Varsling1Send_{shipment_id}.json"
-                sent_blob = read_blob(sent_blob_name)
-                org_name = sent_blob.get("org_name")
-                org_number = sent_blob.get("org_number")
-                send_time = sent_blob.get("send_time")
-                recipient_email = sent_blob.get("recipientEmail")
-                tracker = InstanceTracker.from_directory(f"{os.getenv('ENV')}/varsling/")
-                tracker.logging_varlsing(
-                    org_number=org_number,
-                    org_name=org_name,
-                    app_name=app_name,
-                    send_time=send_time,
-                    digitaliseringstiltak_report_id=report_id[len(directory):],
-                    shipment_id=shipment_id,
-                    recipientEmail=recipient_email,
-                    event_type="Varsling1Recieved",
-                    shipment_status= response.json()
-                )
-                if response.json().get("recipients")[0].get("status")== "Email_Delivered":
-                    logging.info(f"NOTIFICATION STATUS:Marked as received: {recieved_blob_name}")
-                else:
-                    logging.warning(f"NOTIFICATION STATUS:Shipment {shipment_id} not delivered to {recipient_email}. Status: {response.json().get("recipients")[0].get("status")}")
 
+def main(backfill: bool = False):
+    """Poll pending shipments. The manifest is backfilled from the notification log when it is
+    empty, e.g. on the first run after deploy, or always when backfill is set."""
+    directory = f"{os.getenv('ENV')}/varsling/"
+    pending = [] if backfill else list_pending_shipments()
+    if not pending:
+        backfill_pending_shipments(directory)
+        pending = list_pending_shipments()
+    logging.info(f"NOTIFICATION STATUS:Polling {len(pending)} pending shipments")
+    started = time.monotonic()
 
+    # One client per app; init_from_config also sets the varsling rate limit that bounds the pool below
+    path_to_config_folder = Path(__file__).parent / "config_files"
+    varsling_clients = {
+        app_name: AltinnVarslingClient.init_from_config(load_full_config(path_to_config_folder, app_name, os.getenv("ENV")))
+        for app_name in sorted({entry["app_name"] for entry in pending})
+    }
 
-if __name__ == "__main__":
-    main()
+    concurrency = max(1, int(os.getenv("NOTIFICATION_STATUS_CONCURRENCY", "8")))
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="shipment-status") as pool:
+        drained = sum(pool.map(lambda entry: poll_shipment(entry, varsling_clients[entry["app_name"]], directory), pending))
 
+    elapsed = time.monotonic() - started
+    rate = len(pending) / elapsed if elapsed > 0 else 0.0
+    logging.info(
+        f"NOTIFICATION STATUS:Polled {len(pending)} shipments ({drained} finished) in {elapsed:.1f}s, "
+        f"{rate:.1f} shipments/s with concurrency {concurrency}"
+    )
+    return {"polled": len(pending), "finished": drained, "seconds": elapsed, "shipments_per_second": rate}
+
+
+if __name__ == "__main__":
+    main(backfill=os.getenv("NOTIFICATION_STATUS_BACKFILL", "").lower() in ("1", "true", "yes"))
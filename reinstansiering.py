@@ -6,6 +6,7 @@ import pytz
 
 from clients.varsling_client import AltinnVarslingClient
 from clients.instance_client import AltinnInstanceClient, get_meta_data_info
+from clients.instance_store import open_instance_store
 from config.config_loader import load_full_config
 
 from get_initiell_skjema import run as download_skjema
@@ -25,6 +26,10 @@ def delete(regvil_instance_client: AltinnInstanceClient, partyID: str, instance_
     instance_deleted = regvil_instance_client.delete_instance(partyID, instance_id)
     if instance_deleted.status_code in [200,201,204]:
         print(f"Successfully deleted instance {instance_id}")
+        instance_store = open_instance_store()
+        if instance_store is not None:
+            instance_store.remove(regvil_instance_client.appname, f"{partyID}/{instance_id}")
+            instance_store.close()
     else:
         print(f"Failed to delete instance {instance_id}: {instance_deleted.text}")
 
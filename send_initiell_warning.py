@@ -1,28 +1,24 @@
 from typing import Any, Dict
-from azure.keyvault.secrets import SecretClient
-from azure.identity import DefaultAzureCredential 
 from pathlib import Path
 import json
 import logging
+import time
+from collections import Counter
 from dotenv import load_dotenv
 import os
 import pytz
 from clients.varsling_client import AltinnVarslingClient
-from clients.instance_logging import InstanceTracker
+from clients.instance_client import NOT_SENT, REJECTED, last_call_failure
+from clients.instance_logging import InstanceTracker, logged_shipment_ids
+from clients.checkpoint import DONE, FAILED, IN_PROGRESS, open_checkpoint_journal, send_out_run_id
 from config.config_loader import load_full_config
 from config.utils import read_blob
 from datetime import datetime, timezone, timedelta
 load_dotenv()
 
-credential = DefaultAzureCredential()
-client = SecretClient(
-    vault_url=os.getenv("MASKINPORTEN_SECRET_VAULT_URL"), credential=credential
-)
-secret = client.get_secret(os.getenv("MASKINPORTEN_SECRET_NAME"))
-secret_value = secret.value
 env = os.getenv("ENV")
 
-def main():
+def main(resend_in_progress: bool = False):
     logging.info("NOTIFICATION:Starting sending notifications for regvil-2025-initiell")
     path_to_config_folder = Path(__file__).parent / "config_files"
     config = load_full_config(path_to_config_folder, "regvil-2025-initiell", env)
@@ -30,12 +26,38 @@ def main():
 
     varsling_client = AltinnVarslingClient.init_from_config(config)
     test_prefill_data = read_blob(f"{env}/virksomheter_prefill_with_uuid.json")
-    
+    journal = open_checkpoint_journal(
+        "send_initiell_warning", send_out_run_id(config.app_config.app_name, config.app_config.visibleAfter)
+    )
+    outcomes = Counter()
+    started = time.monotonic()
+
     for prefill_data_row in test_prefill_data:
+        report_id = prefill_data_row["digitaliseringstiltak_report_id"]
+        state = journal.state(report_id)
+        if state == DONE:
+            outcomes["resumed"] += 1
+            continue
+        if state == IN_PROGRESS:
+            # The last run stopped mid-send; the Varsling1Send log shows whether Altinn accepted the order
+            shipment_ids = logged_shipment_ids(f"{env}/varsling/", report_id, config.app_config.app_name, "Varsling1Send")
+            if shipment_ids:
+                logging.info(f"NOTIFICATION:Report ID {report_id} was in progress but already sent with shipment ID {shipment_ids[-1]}")
+                journal.mark(report_id, DONE, shipment_id=shipment_ids[-1])
+                outcomes["resolved"] += 1
+                continue
+            if not resend_in_progress:
+                # Altinn may have accepted the order without the run logging it, so only resend on request
+                logging.error(
+                    f"NOTIFICATION:Report ID {report_id} was in progress when the last run stopped and has no Varsling1Send log; "
+                    f"set NOTIFICATION_RESEND_IN_PROGRESS=true to resend it"
+                )
+                outcomes["unknown"] += 1
+                continue
+            logging.warning(f"NOTIFICATION:Resending report ID {report_id} left in progress by the last run")
         config.app_config.validate_prefill_data(prefill_data_row)
         recipient_email = prefill_data_row["Kontaktperson.EPostadresse"]
         org_number = prefill_data_row["AnsvarligVirksomhet.Organisasjonsnummer"]
-        report_id = prefill_data_row["digitaliseringstiltak_report_id"]
         email_subject = config.app_config.emailSubject
         email_body = config.app_config.emailBody
         send_time = datetime.fromisoformat(config.app_config.visibleAfter)
@@ -44,6 +66,7 @@ def main():
             dt = datetime.fromisoformat(now)
             send_time = dt + timedelta(minutes=1)
         send_time = send_time.isoformat(timespec="microseconds").replace("+00:00", "Z")
+        journal.mark(report_id, IN_PROGRESS)
         response = varsling_client.send_notification(
         recipient_email=recipient_email,
         subject = email_subject,
@@ -51,11 +74,22 @@ def main():
         send_time=send_time,
         appname=config.app_config.app_name
         )
-        if not response:
+        if response is None:
+            cause = last_call_failure()
+            if cause in (NOT_SENT, REJECTED):
+                # Altinn never got or refused the order, so a rerun can safely send it
+                logging.error(f"NOTIFICATION:Notification to {recipient_email} for org number {org_number} and report ID {report_id} was {cause.replace('_', ' ')}")
+                journal.mark(report_id, FAILED, cause=cause)
+                outcomes["failed"] += 1
+                continue
+            # No answer from Altinn, so the order may exist; the report stays in progress and is not resent
             logging.error(f"NOTIFICATION:Failed to send notification to {recipient_email} for org number {org_number} and report ID {report_id}")
+            outcomes["unknown"] += 1
             continue
         if response.status_code != 201:
             logging.error(f"NOTIFICATION:Failed to send notification to {recipient_email} for org number {org_number} and report ID {report_id}. Status code: {response.text}")
+            journal.mark(report_id, FAILED, status_code=response.status_code)
+            outcomes["failed"] += 1
             continue
         if response.status_code == 201:
             response_data = response.json()
@@ -71,12 +105,21 @@ def main():
                 recipientEmail=recipient_email,
                 event_type="Varsling1Send"
             ) 
+            journal.mark(report_id, DONE, shipment_id=shipment_id)
+            outcomes["sent"] += 1
             logging.info(f"NOTIFICATION:Notification sent successfully to {org_number} {report_id} with shipment ID: {shipment_id}")
         else:
             logging.warning(f"NOTIFICATION:Failed to notify org number: {org_number} report_id: {report_id} appname: {config.app_config.app_name}")
             print(f"NOTIFICATION:Failed to notify org number: {org_number} report_id: {report_id} appname: {config.app_config.app_name}")
+    elapsed = time.monotonic() - started
+    processed = outcomes["sent"] + outcomes["failed"]
+    logging.info(
+        f"NOTIFICATION:Sent {outcomes['sent']}, failed {outcomes['failed']}, resumed past {outcomes['resumed']} "
+        f"done, resolved {outcomes['resolved']} and left {outcomes['unknown']} interrupted reports; {processed / elapsed if elapsed > 0 else 0.0:.1f} notifications/s this run"
+    )
     logging.info(f"NOTIFICATION:Successfully send out all notifications")
+    return dict(outcomes)
 
 
 if __name__ == "__main__":
-    main()
+    main(resend_in_progress=os.getenv("NOTIFICATION_RESEND_IN_PROGRESS", "").lower() in ("1", "true", "yes"))
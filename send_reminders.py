@@ -1,42 +1,45 @@
-from typing import List
-from azure.keyvault.secrets import SecretClient
-from azure.identity import DefaultAzureCredential
+from typing import Any, Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import logging
+import time
 from dotenv import load_dotenv
 import os
 from datetime import datetime, timezone, timedelta
-from clients.instance_client import AltinnInstanceClient, get_meta_data_info
+from clients.instance_client import AltinnInstanceClient, compact_instance_record
 from clients.varsling_client import AltinnVarslingClient
+from clients.instance_store import open_instance_store
+from clients.instance_logging import read_notification_index, write_notification_index
 from config.config_loader import load_full_config
 from config.utils import list_blobs_with_prefix, read_blob, parse_date
 from send_warning import run as send_warning
 import pytz
 
 load_dotenv()
-credential = DefaultAzureCredential()
-client = SecretClient(
-    vault_url=os.getenv("MASKINPORTEN_SECRET_VAULT_URL"), credential=credential
-)
-secret = client.get_secret(os.getenv("MASKINPORTEN_SECRET_NAME"))
-secret_value = secret.value
 apps = [
     "regvil-2025-initiell",
     "regvil-2025-oppstart",
     "regvil-2025-status",
     "regvil-2025-slutt",
 ]
+REMINDER_INTERVAL = timedelta(days=14)
 
-def get_latest_notification_date(tag: List[str], app: str) -> bool:
+def get_latest_notification_date(tag: List[str], app: str) -> List[datetime]:
+        index = read_notification_index(tag[0], app)
+        if index is not None:
+            return [datetime.fromisoformat(sent_time) for sent_time in index.get("sent_times", [])]
+
+        # Not indexed yet: scan the notification log once and backfill the index
         already_sent = list_blobs_with_prefix(
                     f"{os.getenv('ENV')}/varsling/{tag[0]}_{app}"
                 )
-        notification_dates = []
+        sent_times = []
         for blob in already_sent:
             blob_content = read_blob(blob)
-            if blob_content["event_type"] == "Varsling1Send":
-                notification_dates.append(datetime.fromisoformat(blob_content["sent_time"]))
-        return notification_dates
+            if blob_content and blob_content["event_type"] == "Varsling1Send":
+                sent_times.append(blob_content["sent_time"])
+        write_notification_index(tag[0], app, sent_times)
+        return [datetime.fromisoformat(sent_time) for sent_time in sent_times]
 
 def check_instance_active(instance_id, instance_meta, tag) -> bool:
     if instance_meta.get("isHardDeleted"):
@@ -52,89 +55,147 @@ def check_instance_active(instance_id, instance_meta, tag) -> bool:
     return True 
 
 
-def run() -> None:
-    logging.info("Checking for instances that have not been answered")
+def listing_record(regvil_instance_client: AltinnInstanceClient, instance: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """The compact listing record, fetching the instance only for records stored before it carried dates and flags."""
+    if "visibleAfter" in instance:
+        return instance
+    partyID, instance_id = instance["instanceId"].split("/")
+    inst_resp = regvil_instance_client.get_instance(partyID, instance_id)
+    if inst_resp is None:
+        logging.error(f"Failed to get instance {instance_id}; it is evaluated again next run")
+        return None
+    if inst_resp.status_code != 200:
+        return None
+    return compact_instance_record(inst_resp.json())
+
+
+def evaluate_instance(regvil_instance_client: AltinnInstanceClient, config, app: str, instance: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], Optional[datetime]]:
+    """Send a reminder for one instance if it is due.
+
+    Returns the reminder that was sent (or None) and when the instance should next be
+    evaluated if nothing about it changes (None means only after it changes).
+    """
+    now = datetime.now(pytz.UTC)
+    partyID, instance_id = instance["instanceId"].split("/")
+    record = listing_record(regvil_instance_client, instance)
+    if record is None:
+        return None, now
+
+    tag = record.get("tags") or []
+    if not check_instance_active(instance_id, record, tag):
+        return None, None
+
+    dateCreatedFormated = parse_date(record.get("created"))
+    visibleAfterformated = parse_date(record.get("visibleAfter"))
+    if dateCreatedFormated > now - REMINDER_INTERVAL:
+        logging.info(f"Instance {instance_id} is not older than 14 days and will not be processed.")
+        return None, dateCreatedFormated + REMINDER_INTERVAL
+    if visibleAfterformated > now - REMINDER_INTERVAL:
+        logging.info(
+            f"Instance {instance_id} is still within the 14-day visibility period."
+        )
+        return None, visibleAfterformated + REMINDER_INTERVAL
+
+    send_notifications_times = get_latest_notification_date(tag, app)
+    if not send_notifications_times:
+        return None, now + timedelta(days=1)
+
+    if max(send_notifications_times)+ REMINDER_INTERVAL > datetime.now(timezone.utc):
+        return None, max(send_notifications_times) + REMINDER_INTERVAL
+
+    data_resp = regvil_instance_client.get_instance_data(partyID, instance_id, record.get("dataGuid"))
+    if data_resp is None:
+        logging.error(f"Failed to get instance data for {instance_id}; it is evaluated again next run")
+        return None, now
+    if data_resp.status_code != 200:
+        return None, now
+
+    data = data_resp.json()
+    org_number = (
+        data.get("Prefill")
+            .get("AnsvarligVirksomhet")
+            .get("Organisasjonsnummer")
+    )
+    dato = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    logging.info(
+            f"Instance {instance_id} is created by the same user as last changed. Instance not answered."
+        )
+
+    file = {
+            "org_number": org_number,
+            "digitaliseringstiltak_report_id": tag[0],
+            "dato": dato,
+            "app_name": app,
+            "prefill_data": data,
+            "email_subject": config.app_config.emailSubject,
+            "email_body": config.app_config.emailBody
+        }
+    send_warning(**file)
+    return {
+            "org_number": org_number,
+            "party_id": partyID,
+            "instance_id": instance_id,
+            "org_name":data.get("Prefill").get("AnsvarligVirksomhet").get("Navn"),
+            "digitaliseringstiltak_report_id": tag[0],
+            "dato": dato,
+            "app_name": app,
+        }, now + REMINDER_INTERVAL
+
+
+def remind_app(app: str, instance_store, instance_pool: ThreadPoolExecutor) -> List[Dict[str, Any]]:
+    """Evaluate all candidate instances of one app on instance_pool, returning reminders in listing order."""
     path_to_config_folder = Path(__file__).parent / "config_files"
-    sent_reminders = []
-    for app in apps:
-        config = load_full_config(path_to_config_folder, app, os.getenv("ENV"))
-        regvil_instance_client = AltinnInstanceClient.init_from_config(
-            config,
+    config = load_full_config(path_to_config_folder, app, os.getenv("ENV"))
+    regvil_instance_client = AltinnInstanceClient.init_from_config(
+        config,
+    )
+    logging.info(f"Checking for instances that have not been answered in {app}")
+    if instance_store:
+        # Only instances changed since the last run, or whose reminder date has arrived
+        reminder_watermark_key = f"{app}#reminders"
+        instance_store.sync(regvil_instance_client)
+        synced_watermark = instance_store.get_watermark(app)
+        instance_ids = instance_store.reminder_candidates(
+            app, instance_store.get_watermark(reminder_watermark_key), datetime.now(pytz.UTC)
         )
-        logging.info("Checking for instances that have not been answered")
-        instance_ids = regvil_instance_client.fetch_instances_by_completion(instance_complete=False)
-        for instance in instance_ids:
-            partyID, instance_id = instance["instanceId"].split("/")
-            inst_resp  = regvil_instance_client.get_instance(partyID, instance_id)
-            if inst_resp.status_code != 200:
-                continue
-
-            instance_meta = inst_resp.json()
-            instance_data = get_meta_data_info(instance_meta.get("data"))
-
-            date_created = instance_data.get("created")
-            visibleAfter = instance_meta.get("visibleAfter")
-            visibleAfterformated = parse_date(visibleAfter)
-            dateCreatedFormated = parse_date(date_created)
-            dataguid = instance_data.get("id")
-            tag = instance_data.get("tags")
-
-            data_resp = regvil_instance_client.get_instance_data(partyID, instance_id, dataguid)
-            if data_resp.status_code != 200:
-                continue
-
-            data = data_resp.json()
-            if not check_instance_active(instance_id, instance_meta, tag):
-                continue
-
-            if dateCreatedFormated > datetime.now(pytz.UTC) - timedelta(days=14):
-                logging.info(f"Instance {instance_id} is not older than 14 days and will not be processed.")
-                continue
-            if visibleAfterformated > datetime.now(pytz.UTC) - timedelta(days=14):
-                logging.info(
-                    f"Instance {instance_id} is still within the 14-day visibility period."
-                )
-                continue
-                
-            send_notifications_times = get_latest_notification_date(tag, app)
-            if not send_notifications_times:
-                continue
-
-            if max(send_notifications_times)+ timedelta(days=14) > datetime.now(timezone.utc):
-                continue
-
-            org_number = (
-                data.get("Prefill")
-                    .get("AnsvarligVirksomhet")
-                    .get("Organisasjonsnummer")
-            )
-            dato = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-            logging.info(
-                    f"Instance {instance_id} is created by the same user as last changed. Instance not answered."
-                )
+        logging.info(f"Re-evaluating {len(instance_ids)} changed or due instances for {app}")
+    else:
+        instance_ids = regvil_instance_client.iter_instances_by_completion(instance_complete=False)
 
-            file = {
-                    "org_number": org_number,
-                    "digitaliseringstiltak_report_id": tag[0],
-                    "dato": dato,
-                    "app_name": app,
-                    "prefill_data": data,
-                    "email_subject": config.app_config.emailSubject,
-                    "email_body": config.app_config.emailBody
-                }
-            send_warning(**file)
-            sent_reminders.append({
-                    "org_number": org_number,
-                    "party_id": partyID,
-                    "instance_id": instance_id,
-                    "org_name":data.get("Prefill").get("AnsvarligVirksomhet").get("Navn"),
-                    "digitaliseringstiltak_report_id": tag[0],
-                    "dato": dato,
-                    "app_name": app,
-                })
+    def evaluate(instance):
+        reminder, next_due = evaluate_instance(regvil_instance_client, config, app, instance)
+        if instance_store:
+            instance_store.set_reminder_state(app, instance["instanceId"], next_due)
+        return reminder
+
+    sent_reminders = [reminder for reminder in instance_pool.map(evaluate, instance_ids) if reminder]
+    if instance_store:
+        instance_store.set_watermark(reminder_watermark_key, synced_watermark)
+    return sent_reminders
+
+
+def run() -> None:
+    logging.info("Checking for instances that have not been answered")
+    concurrency = max(1, int(os.getenv("REMINDER_CONCURRENCY", "8")))
+    sent_reminders = []
+    instance_store = open_instance_store()
+    started = time.monotonic()
+    try:
+        # Apps wait on the shared instance pool, so at most `concurrency` instances are evaluated at once
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="reminder-instance") as instance_pool, \
+             ThreadPoolExecutor(max_workers=min(len(apps), concurrency) or 1, thread_name_prefix="reminder-app") as app_pool:
+            for app_reminders in app_pool.map(lambda app: remind_app(app, instance_store, instance_pool), apps):
+                sent_reminders.extend(app_reminders)
+    finally:
+        if instance_store:
+            instance_store.close()
+    logging.info(
+        f"Sent {len(sent_reminders)} reminders for {len(apps)} apps in {time.monotonic() - started:.1f}s "
+        f"with concurrency {concurrency}"
+    )
 
     if sent_reminders:
         status_code = 201
     else:
         status_code = 200
-    return sent_reminders, status_code
\ No newline at end of file
+    return sent_reminders, status_code
@@ -1,22 +1,14 @@
 from typing import List
-from azure.keyvault.secrets import SecretClient
-from azure.identity import DefaultAzureCredential
 from pathlib import Path
 import logging
 from dotenv import load_dotenv
 import os
 from datetime import datetime, timezone
-from clients.instance_client import AltinnInstanceClient, get_meta_data_info
+from clients.instance_client import AltinnInstanceClient
 from config.config_loader import load_full_config
 from send_warning import run as send_warning
 
 load_dotenv()
-credential = DefaultAzureCredential()
-client = SecretClient(
-    vault_url=os.getenv("MASKINPORTEN_SECRET_VAULT_URL"), credential=credential
-)
-secret = client.get_secret(os.getenv("MASKINPORTEN_SECRET_NAME"))
-secret_value = secret.value
 
 def check_instance_active(instance_id, instance_meta, tag) -> bool:
     if instance_meta.get("isHardDeleted"):
@@ -44,23 +36,15 @@ def run(email_subject, email_body) -> tuple[list, int]:
     instance_ids = regvil_instance_client.fetch_instances_by_completion(instance_complete=False)
     for instance in instance_ids:
         partyID, instance_id = instance["instanceId"].split("/")
-        inst_resp  = regvil_instance_client.get_instance(partyID, instance_id)
-        if inst_resp.status_code != 200:
+        tag = instance.get("tags") or []
+        if not check_instance_active(instance_id, instance, tag):
             continue
 
-        instance_meta = inst_resp.json()
-        instance_data = get_meta_data_info(instance_meta.get("data"))
-        dataguid = instance_data.get("id")
-        tag = instance_data.get("tags")
-
-        data_resp = regvil_instance_client.get_instance_data(partyID, instance_id, dataguid)
+        data_resp = regvil_instance_client.get_instance_data(partyID, instance_id, instance.get("dataGuid"))
         if data_resp.status_code != 200:
             continue
 
         data = data_resp.json()
-        if not check_instance_active(instance_id, instance_meta, tag):
-            continue
-
         org_number = (
             data.get("Prefill")
                 .get("AnsvarligVirksomhet")
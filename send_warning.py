@@ -1,6 +1,4 @@
-from typing import Any, Dict
-from azure.keyvault.secrets import SecretClient
-from azure.identity import DefaultAzureCredential 
+from typing import Any, Dict, Optional
 from pathlib import Path
 import logging
 from dotenv import load_dotenv
@@ -9,25 +7,21 @@ import pytz
 from config.type_dict_structure import DataModel
 from clients.varsling_client import AltinnVarslingClient
 from clients.instance_logging import InstanceTracker
+from clients.pipeline_context import PipelineContext
 from config.config_loader import load_full_config
 from datetime import datetime, timezone, timedelta
 from config.utils import parse_date
 load_dotenv()
 
-credential = DefaultAzureCredential()
-client = SecretClient(
-    vault_url=os.getenv("MASKINPORTEN_SECRET_VAULT_URL"), credential=credential
-)
-secret = client.get_secret(os.getenv("MASKINPORTEN_SECRET_NAME"))
-secret_value = secret.value
 
 
-def run(org_number: str, digitaliseringstiltak_report_id: str, dato: str, app_name: str, prefill_data: DataModel, email_subject: str, email_body: str) -> str:
+def run(org_number: str, digitaliseringstiltak_report_id: str, dato: str, app_name: str, prefill_data: DataModel, email_subject: str, email_body: str, context: Optional[PipelineContext] = None) -> str:
     logging.info("NOTIFICATION:Starting sending notifications for {app_name}")
+    context = context or PipelineContext()
     path_to_config_folder = Path(__file__).parent / "config_files"
-    config = load_full_config(path_to_config_folder, app_name, os.getenv("ENV"))
+    config = context.get_or_create(("config", app_name), lambda: load_full_config(path_to_config_folder, app_name, os.getenv("ENV")))
 
-    varsling_client = AltinnVarslingClient.init_from_config(config)
+    varsling_client = context.get_or_create(("varsling_client", app_name), lambda: AltinnVarslingClient.init_from_config(config))
     recipient_email = prefill_data.get("Prefill").get("Kontaktperson").get("EPostadresse")
     org_name = prefill_data.get("Prefill").get("AnsvarligVirksomhet").get("Navn")  
     naive_dt = parse_date(dato)
@@ -58,7 +52,7 @@ def run(org_number: str, digitaliseringstiltak_report_id: str, dato: str, app_na
     if response.status_code == 201:
         response_data = response.json()
         shipment_id = response_data["notification"]["shipmentId"]
-        tracker = InstanceTracker.from_directory(f"{os.getenv('ENV')}/varsling/")
+        tracker = context.get_or_create("varsling_tracker", lambda: InstanceTracker.from_directory(f"{os.getenv('ENV')}/varsling/"))
         tracker.logging_varlsing(org_number=org_number, org_name=org_name,app_name=app_name, send_time=send_time, digitaliseringstiltak_report_id=digitaliseringstiltak_report_id, shipment_id=shipment_id, recipientEmail=recipient_email, event_type="Varsling1Send")
         logging.info(f"NOTIFICATION:Notification sent successfully to {org_number} {digitaliseringstiltak_report_id} with shipment ID: {shipment_id}")
         return 200
@@ -0,0 +1,200 @@
+import importlib
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+import app
+from clients.event_queue import EventQueue
+
+EVENT = {
+    "id": "event-1",
+    "type": "app.instance.process.completed",
+    "source": "https://digdir.apps.tt02.altinn.no/digdir/regvil-2025-initiell/instances/50015641/abc",
+}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(app, "_event_deduplicator", None)
+    return app.app.test_client()
+
+
+def test_httppost_enqueues_event_and_returns_202(client):
+    event_queue = MagicMock()
+    with patch("app.get_event_queue", return_value=event_queue), \
+         patch("app.process_event") as mock_process:
+        response = client.post("/httppost", json=EVENT)
+    assert response.status_code == 202
+    event_queue.enqueue.assert_called_once_with(EVENT)
+    mock_process.assert_not_called()
+
+
+def test_httppost_sync_mode_processes_in_request(client, monkeypatch):
+    monkeypatch.setenv("WEBHOOK_PROCESSING_MODE", "sync")
+    with patch("app.process_event", return_value=("Event received and processed. Notification sent", 200)) as mock_process, \
+         patch("app.get_event_queue") as mock_queue:
+        response = client.post("/httppost", json=EVENT)
+    assert response.status_code == 200
+    mock_process.assert_called_once_with(EVENT)
+    mock_queue.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "body, expected",
+    [
+        ({"type": "app.instance.process.completed", "source": "bad"}, 400),
+        ({"type": "app.instance.created", "source": EVENT["source"]}, 204),
+    ],
+)
+def test_httppost_validates_before_enqueueing(client, body, expected):
+    with patch("app.get_event_queue") as mock_queue:
+        response = client.post("/httppost", json=body)
+    assert response.status_code == expected
+    mock_queue.assert_not_called()
+
+
+def test_httppost_rejects_non_json(client):
+    response = client.post("/httppost", data="not json", content_type="text/plain")
+    assert response.status_code == 400
+
+
+def test_httppost_drops_redelivered_event(client):
+    event_queue = MagicMock()
+    with patch("app.get_event_queue", return_value=event_queue):
+        assert client.post("/httppost", json=EVENT).status_code == 202
+        in_flight = client.post("/httppost", json=EVENT)
+        assert in_flight.status_code == 503
+        assert in_flight.headers["Retry-After"] == "30"
+        app.get_event_deduplicator().mark_processed(EVENT["id"])
+        response = client.post("/httppost", json=EVENT)
+    assert response.status_code == 200
+    event_queue.enqueue.assert_called_once()
+
+
+def test_sync_duplicate_waits_for_in_flight_delivery(client, monkeypatch):
+    monkeypatch.setenv("WEBHOOK_PROCESSING_MODE", "sync")
+    started, release = threading.Event(), threading.Event()
+
+    def slow_failure(event):
+        started.set()
+        release.wait(5)
+        return "Error in processing", 502
+
+    statuses = []
+    with patch("app.process_event", side_effect=slow_failure) as mock_process:
+        first = threading.Thread(target=lambda: statuses.append(client.post("/httppost", json=EVENT).status_code))
+        first.start()
+        started.wait(5)
+        shared_before = app.event_flights.shared
+        second = threading.Thread(target=lambda: statuses.append(app.app.test_client().post("/httppost", json=EVENT).status_code))
+        second.start()
+        while app.event_flights.shared == shared_before:
+            time.sleep(0.01)
+        release.set()
+        first.join()
+        second.join()
+    assert mock_process.call_count == 1
+    assert statuses == [502, 502]
+
+
+def test_processed_event_is_remembered_and_failed_event_released(client, monkeypatch):
+    monkeypatch.setenv("WEBHOOK_PROCESSING_MODE", "sync")
+    with patch("app.process_event", side_effect=[("Error in processing", 500), ("ok", 200)]) as mock_process:
+        assert client.post("/httppost", json=EVENT).status_code == 500
+        assert client.post("/httppost", json=EVENT).status_code == 200
+        assert client.post("/httppost", json=EVENT).data == b"Event already received"
+    assert mock_process.call_count == 2
+
+
+@pytest.fixture
+def real_queue(monkeypatch):
+    monkeypatch.setattr(app, "_event_queue", None)
+    monkeypatch.setenv("WEBHOOK_WORKERS", "1")
+    monkeypatch.setenv("WEBHOOK_MAX_ATTEMPTS", "2")
+    yield
+    if app._event_queue is not None:
+        app._event_queue.close()
+
+
+def test_async_pipeline_failure_is_retried_and_counted_as_failed(client, real_queue):
+    with patch("app.process_event", return_value=("Error in processing", 502)) as mock_process:
+        assert client.post("/httppost", json=EVENT).status_code == 202
+        app._event_queue.join()
+        assert mock_process.call_count == 2
+        stats = client.get("/health").get_json()["event_queue"]
+        assert (stats["processed"], stats["failed"]) == (0, 1)
+        # The claim is released once the queue gives up, so a redelivery is accepted again
+        assert client.post("/httppost", json=EVENT).status_code == 202
+        app._event_queue.join()
+
+
+def test_async_pipeline_success_remembers_event(client, real_queue):
+    with patch("app.process_event", return_value=("ok", 200)) as mock_process:
+        assert client.post("/httppost", json=EVENT).status_code == 202
+        app._event_queue.join()
+        assert client.post("/httppost", json=EVENT).data == b"Event already received"
+    assert mock_process.call_count == 1
+    assert app._event_queue.stats()["processed"] == 1
+
+
+def test_persistent_queue_recovers_pending_events_at_startup(tmp_path, monkeypatch, real_queue):
+    store_path = str(tmp_path / "events.sqlite")
+    stopped = EventQueue(lambda event: None, store_path=store_path)
+    stopped.enqueue(EVENT)
+    stopped.close()
+
+    monkeypatch.setattr(app, "_event_deduplicator", None)
+    monkeypatch.setenv("WEBHOOK_QUEUE_PATH", store_path)
+    with patch("app.process_event", return_value=("ok", 200)) as mock_process:
+        assert app.create_app() is app.app
+        app._event_queue.join()
+    mock_process.assert_called_once_with(EVENT)
+
+
+def test_importing_app_does_not_start_the_queue(monkeypatch, real_queue):
+    monkeypatch.setenv("WEBHOOK_QUEUE_PATH", "unused.sqlite")
+    importlib.reload(app)
+    assert app._event_queue is None
+
+
+def test_concurrent_events_for_same_instance_share_one_run(monkeypatch):
+    monkeypatch.setattr(app, "_event_deduplicator", None)
+    started, release = threading.Event(), threading.Event()
+
+    def slow_process(event):
+        started.set()
+        release.wait(5)
+        return "ok", 200
+
+    results = []
+    with patch("app.process_event", side_effect=slow_process) as mock_process:
+        first = threading.Thread(target=lambda: results.append(app.handle_completed_event(dict(EVENT, id="a"))))
+        first.start()
+        started.wait(5)
+        second = threading.Thread(target=lambda: results.append(app.handle_completed_event(dict(EVENT, id="b"))))
+        second.start()
+        while app.instance_flights.shared == 0:
+            time.sleep(0.01)
+        release.set()
+        first.join()
+        second.join()
+    assert mock_process.call_count == 1
+    assert results == [("ok", 200), ("ok", 200)]
+
+
+def test_process_event_threads_one_context_through_all_steps():
+    config = MagicMock()
+    download_params = {"org_number": "310075728", "digitaliseringstiltak_report_id": "R1", "dato": "2025-08-01", "app_name": "regvil-2025-oppstart", "prefill_data": {}}
+    with patch("app.load_full_config", return_value=config) as mock_config, \
+         patch("app.download_skjema", return_value=(dict(download_params), 200)) as mock_download, \
+         patch("app.upload_skjema", return_value=200) as mock_upload, \
+         patch("app.send_notification", return_value=200) as mock_notify:
+        assert app.process_event(EVENT) == ("Event received and processed. Notification sent", 200)
+
+    context = mock_download.call_args.kwargs["context"]
+    assert mock_upload.call_args.kwargs["context"] is context
+    assert mock_notify.call_args.kwargs["context"] is context
+    assert context.get_or_create(("config", "regvil-2025-initiell"), MagicMock) is config
+    mock_config.assert_called_once()
@@ -0,0 +1,34 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).parent.parent
+
+# Importing app with Key Vault and blob access made impossible proves that startup does no secret I/O
+STARTUP_SCRIPT = """
+import time
+start = time.perf_counter()
+from azure.keyvault.secrets import SecretClient
+def no_network(*args, **kwargs):
+    raise AssertionError("Key Vault accessed during import")
+SecretClient.get_secret = no_network
+import app
+app.app.test_client()
+print(f"{time.perf_counter() - start:.4f}")
+"""
+
+
+def test_benchmark_app_import_to_ready_without_key_vault():
+    env = {**os.environ, "MASKINPORTEN_SECRET_VAULT_URL": "", "ENV": "test"}
+    result = subprocess.run(
+        [sys.executable, "-c", STARTUP_SCRIPT],
+        cwd=REPO_ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        timeout=120,
+    )
+    assert result.returncode == 0, result.stderr
+    startup_seconds = float(result.stdout.strip().splitlines()[-1])
+    print(f"app.py import-to-ready time: {startup_seconds * 1000:.1f} ms")
@@ -0,0 +1,75 @@
+import threading
+from unittest.mock import patch
+
+import pytest
+
+from clients.checkpoint import DONE, FAILED, IN_PROGRESS, CheckpointJournal, open_checkpoint_journal, send_out_run_id
+
+
+def test_local_journal_survives_restart_and_truncated_line(tmp_path):
+    journal = CheckpointJournal("upload", directory=str(tmp_path))
+    journal.mark("r1", IN_PROGRESS)
+    journal.mark("r1", DONE, outcome="created")
+    journal.mark("r2", IN_PROGRESS)
+    with open(tmp_path / "upload.jsonl", "a", encoding="utf-8") as file:
+        file.write('{"report_id": "r3", "sta')
+
+    reloaded = CheckpointJournal("upload", directory=str(tmp_path))
+    assert reloaded.state("r1") == DONE
+    assert reloaded.state("r2") == IN_PROGRESS
+    assert reloaded.state("r3") is None
+    assert len(reloaded) == 2
+
+
+def test_blob_journal_writes_one_blob_per_report(monkeypatch):
+    monkeypatch.setenv("ENV", "test")
+    stored = {"test/checkpoints/notify/r1.json": {"report_id": "r1", "state": FAILED}}
+    with patch("clients.checkpoint.list_blobs_with_prefix", return_value=list(stored)), \
+         patch("clients.checkpoint.read_blob", side_effect=stored.get), \
+         patch("clients.checkpoint.write_blob") as mock_write:
+        journal = CheckpointJournal("notify")
+        assert journal.state("r1") == FAILED
+        journal.mark("r1", DONE, shipment_id="s1")
+    assert mock_write.call_args.args[0] == "test/checkpoints/notify/r1.json"
+    assert mock_write.call_args.args[1]["shipment_id"] == "s1"
+
+
+def test_slow_blob_write_does_not_block_other_reports(monkeypatch):
+    monkeypatch.setenv("ENV", "test")
+    writing, release = threading.Event(), threading.Event()
+    written = []
+
+    def write_blob(name, entry):
+        if entry["report_id"] == "r1":
+            writing.set()
+            release.wait(5)
+        written.append(entry["report_id"])
+
+    with patch("clients.checkpoint.list_blobs_with_prefix", return_value=[]), \
+         patch("clients.checkpoint.write_blob", side_effect=write_blob):
+        journal = CheckpointJournal("notify")
+        slow = threading.Thread(target=journal.mark, args=("r1", DONE))
+        slow.start()
+        assert writing.wait(5)
+        journal.mark("r2", DONE)
+        assert journal.state("r1") == DONE
+        release.set()
+        slow.join()
+    assert written == ["r2", "r1"]
+
+
+def test_open_checkpoint_journal_is_namespaced_by_run_id(monkeypatch, tmp_path):
+    monkeypatch.setenv("CHECKPOINT_DIR", str(tmp_path))
+    monkeypatch.setenv("CHECKPOINT_RUN_ID", "cohort-2")
+    open_checkpoint_journal("upload_skjema").mark("r1", DONE)
+    assert (tmp_path / "upload_skjema-cohort-2.jsonl").exists()
+
+
+def test_open_checkpoint_journal_defaults_to_send_out_run_id(monkeypatch, tmp_path):
+    monkeypatch.setenv("CHECKPOINT_DIR", str(tmp_path))
+    monkeypatch.delenv("CHECKPOINT_RUN_ID", raising=False)
+    run_id = send_out_run_id("regvil-2025-initiell", "2025-09-01T08:00:00Z")
+    open_checkpoint_journal("upload_skjema", run_id).mark("r1", DONE)
+    assert (tmp_path / "upload_skjema-regvil-2025-initiell-2025-09-01T08-00-00Z.jsonl").exists()
+    with pytest.raises(ValueError):
+        open_checkpoint_journal("upload_skjema", send_out_run_id("regvil-2025-initiell", None))
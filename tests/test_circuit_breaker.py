@@ -0,0 +1,77 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+import requests
+
+from auth.exchange_token_funcs import AltinnExchangeTokenError, exchange_token
+from clients.circuit_breaker import CircuitBreaker, CircuitOpenError, circuit_breaker_states, reset_circuit_breakers
+from clients.http_session import get_session, http_request
+from clients.instance_client import make_api_call
+
+STORAGE_URL = "https://platform.tt02.altinn.no/storage/api/v1/instances"
+
+
+@pytest.fixture(autouse=True)
+def fresh_breakers(monkeypatch):
+    monkeypatch.setenv("CIRCUIT_BREAKER_FAILURE_THRESHOLD", "3")
+    monkeypatch.setenv("CIRCUIT_BREAKER_RESET_TIMEOUT", "30")
+    reset_circuit_breakers()
+    yield
+    reset_circuit_breakers()
+
+
+def test_breaker_opens_after_threshold_and_probes_half_open():
+    breaker = CircuitBreaker("host", failure_threshold=2, reset_timeout=10)
+    with patch("clients.circuit_breaker.time.monotonic", return_value=100):
+        breaker.record_failure()
+        assert breaker.allow_request()
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.OPEN
+        assert not breaker.allow_request()
+    with patch("clients.circuit_breaker.time.monotonic", return_value=111):
+        assert breaker.allow_request()
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        assert not breaker.allow_request()
+        breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.rejected == 2
+
+
+def test_failed_probe_reopens_breaker():
+    breaker = CircuitBreaker("host", failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_http_request_fails_fast_while_open():
+    with patch.object(get_session(), "request", side_effect=requests.exceptions.ConnectionError()) as mock_request:
+        for _ in range(3):
+            with pytest.raises(requests.exceptions.ConnectionError):
+                http_request("GET", STORAGE_URL)
+        with pytest.raises(CircuitOpenError):
+            http_request("GET", STORAGE_URL)
+    assert mock_request.call_count == 3
+    assert circuit_breaker_states()["platform.tt02.altinn.no"]["state"] == CircuitBreaker.OPEN
+
+
+def test_server_errors_count_as_failures_and_client_errors_do_not():
+    with patch.object(get_session(), "request", return_value=MagicMock(status_code=404)):
+        http_request("GET", STORAGE_URL)
+    assert circuit_breaker_states()["platform.tt02.altinn.no"]["consecutive_failures"] == 0
+    with patch.object(get_session(), "request", return_value=MagicMock(status_code=503)):
+        http_request("GET", STORAGE_URL)
+    assert circuit_breaker_states()["platform.tt02.altinn.no"]["consecutive_failures"] == 1
+
+
+def test_make_api_call_and_exchange_token_fail_fast_when_open():
+    with patch.object(get_session(), "request", side_effect=requests.exceptions.ConnectionError()), \
+         patch("clients.retry_policy.time.sleep"):
+        make_api_call("GET", STORAGE_URL, headers={})
+    with patch.object(get_session(), "request") as mock_request, \
+         patch("auth.exchange_token_funcs.get_maskinporten_token", return_value="maskinporten-token"):
+        assert make_api_call("GET", STORAGE_URL, headers={}) is None
+        with pytest.raises(AltinnExchangeTokenError):
+            exchange_token("https://test.maskinporten.no/", "secret", "kid", "client", "scope")
+    mock_request.assert_not_called()
@@ -3,7 +3,12 @@ import os
 from pathlib import Path
 from datetime import datetime, timezone, timedelta
 
-from config.config_loader import load_full_config
+import config.config_loader
+from config.config_loader import clear_config_cache, load_full_config
+from unittest.mock import patch, MagicMock
+
+import config.utils
+from config.utils import chech_file_exists, list_blobs_with_prefix, read_blob, reset_blob_client, write_blob
 from config.utils import add_time_delta, check_date_before, get_initiell_date, get_oppstart_date, get_status_date, to_utc_aware, parse_date
 
 def test_add_time_delta():
@@ -268,3 +273,59 @@ def test_parse_date_invalid_inputs(invalid_date):
     """Ensure parse_date raises ValueError for invalid or missing inputs."""
     with pytest.raises(ValueError):
         parse_date(invalid_date)
+
+
+def test_blob_helpers_share_one_container_client(monkeypatch):
+    monkeypatch.delenv("AZURE_CLIENT_ID", raising=False)
+    reset_blob_client()
+    constructions_before = config.utils.blob_client_constructions
+    mock_service = MagicMock()
+    container = mock_service.return_value.get_container_client.return_value
+    container.get_blob_client.return_value.download_blob.return_value.readall.return_value = b'{"a": 1}'
+    with patch("config.utils.BlobServiceClient", mock_service), \
+         patch("config.utils.DefaultAzureCredential") as mock_credential:
+        assert read_blob("test/file.json") == {"a": 1}
+        assert write_blob("test/file.json", {"a": 1})
+        assert chech_file_exists("test/file.json")
+        list_blobs_with_prefix("test/")
+    reset_blob_client()
+    assert mock_service.call_count == 1
+    assert mock_credential.call_count == 1
+    assert config.utils.blob_client_constructions == constructions_before + 1
+
+
+def test_load_full_config_is_cached_per_env_and_app(monkeypatch):
+    monkeypatch.setenv("MASKINPORTEN_SECRET_NAME", "maskinporten-secret")
+    clear_config_cache()
+    config_path = Path(__file__).parent.parent / "config_files"
+    calls_before = config.config_loader.key_vault_calls
+    with patch("config.config_loader.SecretClient") as mock_secret_client, \
+         patch("config.config_loader.DefaultAzureCredential"):
+        mock_secret_client.return_value.get_secret.return_value.value = "secret"
+        first = load_full_config(config_path, "regvil-2025-initiell", "test")
+        for _ in range(3):
+            assert load_full_config(config_path, "regvil-2025-initiell", "test") is first
+        other_app = load_full_config(config_path, "regvil-2025-status", "test")
+    assert other_app.app_config.app_name == "regvil-2025-status"
+    assert first.secret_value == "secret"
+    assert mock_secret_client.return_value.get_secret.call_count == 1
+    assert config.config_loader.key_vault_calls == calls_before + 1
+    clear_config_cache()
+
+
+def test_secret_is_fetched_again_after_ttl(monkeypatch):
+    monkeypatch.setenv("MASKINPORTEN_SECRET_NAME", "maskinporten-secret")
+    monkeypatch.setattr("config.config_loader.SECRET_CACHE_TTL_SECONDS", 10)
+    clear_config_cache()
+    config_path = Path(__file__).parent.parent / "config_files"
+    with patch("config.config_loader.SecretClient") as mock_secret_client, \
+         patch("config.config_loader.DefaultAzureCredential"), \
+         patch("config.config_loader.time.monotonic", side_effect=[0, 5, 20, 20]):
+        mock_secret_client.return_value.get_secret.side_effect = [MagicMock(value="old"), MagicMock(value="rotated")]
+        first = load_full_config(config_path, "regvil-2025-initiell", "test")
+        assert load_full_config(config_path, "regvil-2025-initiell", "test") is first
+        rotated = load_full_config(config_path, "regvil-2025-initiell", "test")
+    assert rotated.secret_value == "rotated"
+    assert mock_secret_client.return_value.get_secret.call_count == 2
+    clear_config_cache()
+
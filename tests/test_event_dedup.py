@@ -0,0 +1,38 @@
+from clients.event_dedup import EventDeduplicator
+
+
+def test_claim_rejects_in_flight_and_processed_ids():
+    dedup = EventDeduplicator()
+    assert dedup.claim("a")
+    assert not dedup.claim("a")
+    assert dedup.in_flight("a")
+    dedup.mark_processed("a")
+    assert not dedup.claim("a")
+    assert not dedup.in_flight("a")
+    assert dedup.stats()["duplicates"] == 2
+
+
+def test_released_id_can_be_claimed_again():
+    dedup = EventDeduplicator()
+    assert dedup.claim("a")
+    dedup.release("a")
+    assert dedup.claim("a")
+
+
+def test_events_without_id_are_never_deduplicated():
+    dedup = EventDeduplicator()
+    assert dedup.claim(None)
+    assert dedup.claim(None)
+
+
+def test_lru_is_bounded_but_persistent_store_remembers(tmp_path):
+    memory_only = EventDeduplicator(max_entries=2)
+    for event_id in ("a", "b", "c"):
+        memory_only.mark_processed(event_id)
+    assert memory_only.claim("a")
+    assert not memory_only.claim("c")
+
+    store_path = str(tmp_path / "dedup.sqlite")
+    EventDeduplicator(max_entries=1, store_path=store_path).mark_processed("a")
+    restarted = EventDeduplicator(max_entries=1, store_path=store_path)
+    assert not restarted.claim("a")
@@ -0,0 +1,112 @@
+import threading
+
+from clients.event_queue import EventQueue
+
+
+def make_event(event_id):
+    return {"id": event_id, "type": "app.instance.process.completed", "source": f"https://x/a/b/c/{event_id}"}
+
+
+def test_workers_handle_all_events():
+    handled = []
+    lock = threading.Lock()
+
+    def handler(event):
+        with lock:
+            handled.append(event["id"])
+
+    event_queue = EventQueue(handler, workers=3)
+    event_queue.start()
+    for i in range(10):
+        event_queue.enqueue(make_event(str(i)))
+    event_queue.join()
+    event_queue.close()
+
+    assert sorted(handled, key=int) == [str(i) for i in range(10)]
+    assert event_queue.stats()["processed"] == 10
+
+
+def test_failed_event_is_retried_until_max_attempts():
+    attempts = []
+
+    def handler(event):
+        attempts.append(event["id"])
+        raise RuntimeError("upstream down")
+
+    given_up = []
+    event_queue = EventQueue(handler, workers=1, max_attempts=3, on_failure=given_up.append)
+    event_queue.start()
+    event_queue.enqueue(make_event("1"))
+    event_queue.join()
+    event_queue.close()
+
+    assert attempts == ["1", "1", "1"]
+    assert event_queue.stats()["failed"] == 1
+    assert given_up == [make_event("1")]
+
+
+def test_durable_queue_recovers_pending_events_after_restart(tmp_path):
+    store_path = str(tmp_path / "events.sqlite")
+    stopped = EventQueue(lambda event: None, store_path=store_path)
+    stopped.enqueue(make_event("1"))
+    stopped.enqueue(make_event("2"))
+    stopped.close()
+
+    handled = []
+    restarted = EventQueue(lambda event: handled.append(event["id"]), workers=1, store_path=store_path)
+    restarted.start()
+    restarted.join()
+    restarted.close()
+    assert handled == ["1", "2"]
+
+    empty = EventQueue(lambda event: handled.append(event["id"]), workers=1, store_path=store_path)
+    empty.start()
+    empty.join()
+    empty.close()
+    assert handled == ["1", "2"]
+
+
+def test_live_peer_lease_is_not_recovered(tmp_path):
+    store_path = str(tmp_path / "events.sqlite")
+    peer = EventQueue(lambda event: None, store_path=store_path)
+    peer.enqueue(make_event("1"))
+
+    handled = []
+    second = EventQueue(lambda event: handled.append(event["id"]), workers=1, store_path=store_path)
+    second.start()
+    second.join()
+    second.close()
+    peer._conn.close()
+    assert handled == []
+
+
+def test_expired_lease_of_crashed_peer_is_recovered_once(tmp_path):
+    store_path = str(tmp_path / "events.sqlite")
+    crashed = EventQueue(lambda event: None, store_path=store_path, lease_seconds=0)
+    crashed.enqueue(make_event("1"))
+    crashed._conn.close()
+
+    handled = []
+    first = EventQueue(lambda event: handled.append(event["id"]), workers=1, store_path=store_path)
+    second = EventQueue(lambda event: handled.append(event["id"]), workers=1, store_path=store_path)
+    first.start()
+    second.start()
+    first.join()
+    second.join()
+    first.close()
+    second.close()
+    assert handled == ["1"]
+
+
+def test_workers_recover_expired_leases_periodically(tmp_path):
+    store_path = str(tmp_path / "events.sqlite")
+    handled = threading.Event()
+    running = EventQueue(lambda event: handled.set(), workers=1, store_path=store_path, recover_interval=0.05)
+    running.start()
+
+    crashed = EventQueue(lambda event: None, store_path=store_path, lease_seconds=0)
+    crashed.enqueue(make_event("1"))
+    crashed._conn.close()
+
+    assert handled.wait(5)
+    running.close()
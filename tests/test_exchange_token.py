@@ -0,0 +1,197 @@
+import base64
+import json
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+from jwcrypto import jwk, jwt
+
+from auth.exchange_token_funcs import (
+    AltinnExchangeTokenError,
+    AltinnTokenCache,
+    AltinnTokenProvider,
+    MaskinportenAssertionSigner,
+    get_token_expiry,
+    load_signing_key,
+)
+
+
+def make_jwt(exp: float) -> str:
+    def encode(part):
+        return base64.urlsafe_b64encode(json.dumps(part).encode()).decode().rstrip("=")
+    return f"{encode({'alg': 'RS256'})}.{encode({'exp': exp})}.signature"
+
+
+TOKEN_ARGS = {
+    "maskinporten_endpoint": "https://test.maskinporten.no/",
+    "secret": "secret",
+    "kid": "kid",
+    "client_id": "client",
+    "scope": "altinn:serviceowner",
+}
+
+
+def test_get_token_expiry_reads_exp_claim():
+    assert get_token_expiry(make_jwt(1700000000)) == 1700000000
+    assert get_token_expiry(f'"{make_jwt(1700000000)}"') == 1700000000
+    assert get_token_expiry("not-a-jwt") is None
+
+
+def test_token_cache_reuses_token_until_expiry():
+    cache = AltinnTokenCache(expiry_margin_seconds=60)
+    token = make_jwt(time.time() + 1800)
+    with patch("auth.exchange_token_funcs.exchange_token", return_value=token) as mock_exchange:
+        for _ in range(200):
+            assert cache.get_token(**TOKEN_ARGS) == token
+    assert mock_exchange.call_count == 1
+    assert cache.stats() == {"hits": 199, "misses": 1, "cached_tokens": 1}
+
+
+def test_token_cache_exchanges_again_within_margin():
+    cache = AltinnTokenCache(expiry_margin_seconds=60)
+    tokens = [make_jwt(time.time() + 30), make_jwt(time.time() + 1800)]
+    with patch("auth.exchange_token_funcs.exchange_token", side_effect=tokens) as mock_exchange:
+        assert cache.get_token(**TOKEN_ARGS) == tokens[0]
+        assert cache.get_token(**TOKEN_ARGS) == tokens[1]
+    assert mock_exchange.call_count == 2
+    assert cache.misses == 2
+
+
+@pytest.mark.parametrize("field", ["maskinporten_endpoint", "client_id", "scope"])
+def test_token_cache_is_keyed_by_endpoint_client_and_scope(field):
+    cache = AltinnTokenCache()
+    token = make_jwt(time.time() + 1800)
+    with patch("auth.exchange_token_funcs.exchange_token", return_value=token) as mock_exchange:
+        cache.get_token(**TOKEN_ARGS)
+        cache.get_token(**{**TOKEN_ARGS, field: "other"})
+    assert mock_exchange.call_count == 2
+
+
+def test_provider_collapses_concurrent_refreshes_into_one_exchange():
+    provider = AltinnTokenProvider(**TOKEN_ARGS, background_refresh=False)
+    token = make_jwt(time.time() + 1800)
+
+    def slow_exchange(**kwargs):
+        time.sleep(0.2)
+        return token
+
+    with patch("auth.exchange_token_funcs.exchange_token", side_effect=slow_exchange) as mock_exchange:
+        threads = [threading.Thread(target=provider.get_token) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    assert mock_exchange.call_count == 1
+    assert provider.refreshes == 1
+
+
+def test_provider_shares_refresh_error_with_waiting_callers():
+    provider = AltinnTokenProvider(**TOKEN_ARGS, background_refresh=False)
+    with patch("auth.exchange_token_funcs.exchange_token", side_effect=AltinnExchangeTokenError("down")):
+        with pytest.raises(AltinnExchangeTokenError):
+            provider.get_token()
+
+
+def test_provider_serves_current_token_while_refreshing_in_background():
+    provider = AltinnTokenProvider(**TOKEN_ARGS, refresh_margin_seconds=300, expiry_margin_seconds=60)
+    old_token, new_token = make_jwt(time.time() + 120), make_jwt(time.time() + 1800)
+    with patch("auth.exchange_token_funcs.exchange_token", side_effect=[old_token, new_token]) as mock_exchange:
+        assert provider.get_token() == old_token
+        assert provider.get_token() == old_token
+        deadline = time.time() + 2
+        while provider.refreshes < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        assert provider.get_token() == new_token
+    assert mock_exchange.call_count == 2
+    assert provider.misses == 1
+    provider.close()
+
+
+def test_provider_renews_token_before_expiry_without_requests():
+    provider = AltinnTokenProvider(**TOKEN_ARGS, refresh_margin_seconds=1, expiry_margin_seconds=0)
+    tokens = [make_jwt(time.time() + 1.2), make_jwt(time.time() + 1800)]
+    with patch("auth.exchange_token_funcs.exchange_token", side_effect=tokens):
+        provider.get_token()
+        deadline = time.time() + 2
+        while provider.refreshes < 2 and time.time() < deadline:
+            time.sleep(0.01)
+    assert provider.refreshes == 2
+    assert provider.get_token() == tokens[1]
+    provider.close()
+
+
+def test_provider_stops_background_refresh_when_idle():
+    provider = AltinnTokenProvider(**TOKEN_ARGS, refresh_margin_seconds=1, expiry_margin_seconds=0, idle_seconds=0.3)
+    tokens = [make_jwt(time.time() + 1.6), make_jwt(time.time() + 1800)]
+    with patch("auth.exchange_token_funcs.exchange_token", side_effect=tokens) as mock_exchange:
+        provider.get_token()
+        # The timer fires about 0.6s later, after the token has been idle longer than 0.3s
+        time.sleep(1.0)
+    assert mock_exchange.call_count == 1
+    assert provider._timer is None
+    provider.close()
+
+
+def test_401_from_altinn_invalidates_cached_token():
+    from clients.http_session import get_session, http_request
+
+    cache = AltinnTokenCache()
+    old_token, new_token = make_jwt(time.time() + 1800), make_jwt(time.time() + 1800)
+    with patch("auth.exchange_token_funcs.exchange_token", side_effect=[old_token, new_token]) as mock_exchange, \
+         patch("auth.exchange_token_funcs.altinn_token_cache", cache), \
+         patch("clients.http_session._unauthorized_listeners", [cache.on_unauthorized]), \
+         patch.object(get_session(), "request", return_value=type("Response", (), {"status_code": 401})()):
+        assert cache.get_token(**TOKEN_ARGS) == old_token
+        http_request("GET", "https://platform.tt02.altinn.no/storage", headers={"Authorization": f"Bearer {old_token}"})
+        deadline = time.time() + 2
+        while mock_exchange.call_count < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        assert cache.get_token(**TOKEN_ARGS) == new_token
+    assert mock_exchange.call_count == 2
+    cache.clear()
+
+
+@pytest.fixture(scope="module")
+def jwk_secret():
+    return jwk.JWK.generate(kty="RSA", size=2048).export(private_key=True)
+
+
+def test_signer_builds_verifiable_assertion(jwk_secret):
+    signer = MaskinportenAssertionSigner("https://test.maskinporten.no/", jwk_secret, "kid", "client", "scope")
+    assertion = signer.build_assertion()
+    token = jwt.JWT(jwt=assertion, key=jwk.JWK.from_json(jwk_secret))
+    claims = json.loads(token.claims)
+    assert claims["iss"] == "client"
+    assert claims["aud"] == "https://test.maskinporten.no/"
+    assert claims["jti"] != json.loads(jwt.JWT(jwt=signer.build_assertion(), key=signer.key).claims)["jti"]
+
+
+def test_signing_key_is_parsed_once_per_secret(jwk_secret):
+    load_signing_key.cache_clear()
+    for _ in range(3):
+        MaskinportenAssertionSigner("aud", jwk_secret, "kid", "client", "scope")
+    assert load_signing_key.cache_info().misses == 1
+
+
+def test_benchmark_assertion_cost_before_and_after(jwk_secret):
+    iterations = 5
+
+    def build_assertion_with_parse():
+        # Per-call key parsing as get_maskinporten_token did before the signer was cached
+        load_signing_key.cache_clear()
+        return MaskinportenAssertionSigner("aud", jwk_secret, "kid", "client", "scope").build_assertion()
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        build_assertion_with_parse()
+    before = (time.perf_counter() - start) / iterations
+
+    signer = MaskinportenAssertionSigner("aud", jwk_secret, "kid", "client", "scope")
+    start = time.perf_counter()
+    for _ in range(iterations):
+        signer.build_assertion()
+    after = (time.perf_counter() - start) / iterations
+
+    print(f"Assertion cost per call: before {before * 1000:.2f} ms, after {after * 1000:.2f} ms")
+    assert after < before
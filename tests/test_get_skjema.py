@@ -11,15 +11,11 @@ SAMPLE_APP_NAME = "regvil-2025-initiell"
 @patch("get_initiell_skjema.get_reportid_from_blob")
 @patch("get_initiell_skjema.InstanceTracker")
 @patch("get_initiell_skjema.AltinnInstanceClient")
-@patch("get_initiell_skjema.SecretClient")
-@patch("get_initiell_skjema.DefaultAzureCredential")
 @patch("get_initiell_skjema.load_dotenv")
 @patch("get_initiell_skjema.load_full_config")
 def test_run_success(
     mock_load_config,
     mock_load_dotenv,
-    mock_default_cred,
-    mock_secret_client,
     mock_altinn_client,
     mock_tracker,
     mock_find_event
@@ -32,11 +28,6 @@ def test_run_success(
     }
     mock_load_config.return_value = mock_config
 
-    # Mock secret
-    mock_secret = MagicMock()
-    mock_secret.value = "supersecret"
-    mock_secret_client.return_value.get_secret.return_value = mock_secret
-
     # Mock event
     mock_find_event.return_value = "r1"
 
@@ -138,15 +129,11 @@ def test_run_success_full_flow(
 @patch("get_initiell_skjema.get_reportid_from_blob")
 @patch("get_initiell_skjema.InstanceTracker")
 @patch("get_initiell_skjema.AltinnInstanceClient")
-@patch("get_initiell_skjema.SecretClient")
-@patch("get_initiell_skjema.DefaultAzureCredential")
 @patch("get_initiell_skjema.load_dotenv")
 @patch("get_initiell_skjema.load_full_config")
 def test_run_logs_exception_when_instance_data_fails(
     mock_load_config,
     mock_load_dotenv,
-    mock_default_cred,
-    mock_secret_client,
     mock_altinn_client,
     mock_tracker,
     mock_find_event,
@@ -162,10 +149,6 @@ def test_run_logs_exception_when_instance_data_fails(
     }
     mock_load_config.return_value = mock_config
 
-    mock_secret = MagicMock()
-    mock_secret.value = "secret"
-    mock_secret_client.return_value.get_secret.return_value = mock_secret
-
     mock_find_event.return_value = "report001"
 
     mock_client = MagicMock()
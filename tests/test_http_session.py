@@ -0,0 +1,59 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from clients import http_session
+from clients.http_session import HTTPSessionConfig, configure_session, get_session, http_request
+from clients.instance_client import make_api_call
+from clients.pipeline_context import PipelineContext
+
+
+@pytest.fixture(autouse=True)
+def fresh_session():
+    configure_session(HTTPSessionConfig(pool_connections=4, pool_maxsize=8, connect_timeout=2, read_timeout=10))
+    yield
+    configure_session(HTTPSessionConfig.from_env())
+
+
+def test_session_is_shared_between_calls():
+    assert get_session() is get_session()
+
+
+def test_session_uses_configured_pool_size():
+    adapter = get_session().get_adapter("https://platform.tt02.altinn.no")
+    assert adapter._pool_maxsize == 8
+    assert adapter._pool_connections == 4
+
+
+def test_http_request_applies_default_timeout():
+    with patch.object(get_session(), "request") as mock_request:
+        http_request("GET", "https://platform.tt02.altinn.no/storage")
+        http_request("GET", "https://platform.tt02.altinn.no/storage", timeout=1)
+    assert mock_request.call_args_list[0].kwargs["timeout"] == (2, 10)
+    assert mock_request.call_args_list[1].kwargs["timeout"] == 1
+
+
+def test_session_config_from_env(monkeypatch):
+    monkeypatch.setenv("HTTP_POOL_MAXSIZE", "25")
+    monkeypatch.setenv("HTTP_READ_TIMEOUT", "60")
+    config = HTTPSessionConfig.from_env()
+    assert config.pool_maxsize == 25
+    assert config.timeout == (5.0, 60.0)
+
+
+def test_make_api_call_goes_through_shared_session():
+    response = MagicMock(status_code=200)
+    with patch.object(http_session.get_session(), "request", return_value=response) as mock_request:
+        for _ in range(3):
+            assert make_api_call("GET", "https://platform.tt02.altinn.no/storage", headers={}) is response
+    assert mock_request.call_count == 3
+
+
+def test_http_request_is_counted_in_active_pipeline_context():
+    context = PipelineContext()
+    with patch.object(get_session(), "request", return_value=MagicMock(status_code=200)):
+        http_request("GET", "https://platform.tt02.altinn.no/storage/api/v1/instances")
+        with context.activate():
+            http_request("GET", "https://platform.tt02.altinn.no/storage/api/v1/instances")
+            http_request("POST", "https://digdir.apps.tt02.altinn.no/digdir/app/instances")
+    assert context.call_summary() == {"GET platform.tt02.altinn.no": 1, "POST digdir.apps.tt02.altinn.no": 1}
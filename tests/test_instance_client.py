@@ -1,14 +1,19 @@
-from azure.keyvault.secrets import SecretClient
-from azure.identity import DefaultAzureCredential
 from pathlib import Path
 import json
 from typing import Dict, Any
 import os
 from dotenv import load_dotenv
 
-from clients.instance_client import AltinnInstanceClient
+import pytest
+import requests
+
+from clients.circuit_breaker import CircuitOpenError
+from clients.instance_client import (
+    NOT_SENT, REJECTED, UNKNOWN, AltinnInstanceClient, InstanceIndex, InstanceListingError,
+    extract_instances_ids, last_call_failure, make_api_call,
+)
 from config.config_loader import load_full_config
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
 load_dotenv()
 
@@ -20,12 +25,6 @@ path_to_config_folder = Path(__file__).parent.parent / "config_files"
 config = load_full_config(path_to_config_folder, "regvil-2025-initiell", os.getenv("ENV"))
 
 
-credential = DefaultAzureCredential()
-client = SecretClient(
-    vault_url=os.getenv("MASKINPORTEN_SECRET_VAULT_URL"), credential=credential
-)
-secret = client.get_secret(os.getenv("MASKINPORTEN_SECRET_NAME"))
-secret_value = secret.value
 
 
 def test_instance_created_found(monkeypatch):
@@ -76,4 +75,149 @@ def test_instance_created_different_org():
         "InitiellSkjemaLevert"  # Same report_id
     )
     
-    assert result is False
\ No newline at end of file
+    assert result is False
+
+
+def make_storage_instance(party_id: str, instance_guid: str, org_number: str, tags: list) -> Dict[str, Any]:
+    return {
+        "id": f"{party_id}/{instance_guid}",
+        "instanceOwner": {"partyId": party_id, "organisationNumber": org_number},
+        "data": [{"id": f"data-{instance_guid}", "dataType": "DataModel", "contentType": "application/json", "tags": tags}],
+    }
+
+
+def make_page(instances: list, next_url: str = None) -> MagicMock:
+    response = MagicMock(status_code=200)
+    response.json.return_value = {"count": len(instances), "next": next_url, "instances": instances}
+    return response
+
+
+def make_offline_client() -> AltinnInstanceClient:
+    client = AltinnInstanceClient(
+        base_app_url="https://digdir.apps.tt02.altinn.no",
+        base_platfrom_url="https://platform.tt02.altinn.no/storage/api/v1/instances",
+        application_owner_organisation="digdir",
+        appname="regvil-2025-initiell",
+        maskinport_client_id="client",
+        maskinport_kid="kid",
+        maskinport_scope="scope",
+        secret_value="secret",
+        maskinporten_endpoint="https://test.maskinporten.no/",
+    )
+    client._get_headers = lambda content_type=None: {}
+    return client
+
+
+def test_iter_instances_follows_next_link_lazily():
+    client = make_offline_client()
+    next_url = "https://platform.tt02.altinn.no/storage/api/v1/instances?continuationtoken=abc"
+    pages = [
+        make_page([make_storage_instance("1", "a", "310075728", ["Tag1"])], next_url),
+        make_page([make_storage_instance("2", "b", "999999999", [])]),
+    ]
+    with patch("clients.instance_client.make_api_call", side_effect=pages) as mock_call:
+        instances = client.iter_instances_by_completion(instance_complete=False, page_size=1)
+        first = next(instances)
+        assert first["instanceId"] == "1/a"
+        assert mock_call.call_count == 1
+        assert [instance["instanceId"] for instance in instances] == ["2/b"]
+    assert mock_call.call_args_list[0].kwargs["params"]["size"] == 1
+    assert mock_call.call_args_list[1].kwargs["url"] == next_url
+    assert mock_call.call_args_list[1].kwargs["params"] is None
+
+
+def test_iter_instances_uses_continuation_token_without_next_link():
+    client = make_offline_client()
+    first_page = make_page([make_storage_instance("1", "a", "310075728", [])])
+    first_page.json.return_value["continuationToken"] = "token-1"
+    with patch("clients.instance_client.make_api_call", side_effect=[first_page, make_page([])]) as mock_call:
+        assert len(client.get_stored_instances_ids()) == 1
+    assert mock_call.call_args_list[1].kwargs["params"]["continuationToken"] == "token-1"
+
+
+def test_iter_instances_continuation_token_after_next_link():
+    client = make_offline_client()
+    next_url = "https://platform.tt02.altinn.no/storage/api/v1/instances?continuationtoken=abc"
+    second_page = make_page([make_storage_instance("2", "b", "999999999", [])])
+    second_page.json.return_value["continuationToken"] = "token-2"
+    pages = [make_page([make_storage_instance("1", "a", "310075728", [])], next_url), second_page, make_page([])]
+    with patch("clients.instance_client.make_api_call", side_effect=pages) as mock_call:
+        assert len(client.get_stored_instances_ids(page_size=1)) == 2
+    third_call = mock_call.call_args_list[2].kwargs
+    assert third_call["url"] == client.base_platfrom_url
+    assert third_call["params"]["continuationToken"] == "token-2"
+    assert third_call["params"]["size"] == 1
+
+
+def test_iter_instances_raises_when_listing_fails():
+    client = make_offline_client()
+    with patch("clients.instance_client.make_api_call", return_value=None):
+        with pytest.raises(InstanceListingError):
+            client.get_stored_instances_ids()
+
+
+@pytest.mark.parametrize(
+    "outcome, cause",
+    [
+        (CircuitOpenError("open"), NOT_SENT),
+        (requests.exceptions.ConnectTimeout(), NOT_SENT),
+        (MagicMock(status_code=503), REJECTED),
+        (MagicMock(status_code=429), REJECTED),
+        (MagicMock(status_code=504), UNKNOWN),
+        (requests.exceptions.ReadTimeout(), UNKNOWN),
+        (MagicMock(status_code=201), None),
+    ],
+)
+def test_make_api_call_records_why_it_returned_no_response(outcome, cause):
+    kwargs = {"side_effect": outcome} if isinstance(outcome, Exception) else {"return_value": outcome}
+    with patch("clients.instance_client.call_with_retry", **kwargs):
+        make_api_call("POST", "https://platform.tt02.altinn.no/notifications/api/v1/future/orders", headers={})
+    assert last_call_failure() == cause
+
+
+def test_instance_index_lists_storage_once_for_many_checks():
+    client = make_offline_client()
+    page = make_page([
+        make_storage_instance("1", "a", "310075728", ["InitiellSkjemaLevert"]),
+        make_storage_instance("2", "b", "999999999", []),
+    ])
+    with patch("clients.instance_client.make_api_call", return_value=page) as mock_call:
+        index = client.build_instance_index()
+        assert client.instance_created("310075728", "InitiellSkjemaLevert", index=index)
+        assert not client.instance_created("999999999", "InitiellSkjemaLevert", index=index)
+        assert not client.instance_created("310075728", "AnotherSkjemaLevert", index=index)
+    assert mock_call.call_count == 1
+
+
+def test_instance_index_is_updated_incrementally():
+    index = InstanceIndex()
+    assert not index.contains("310075728", "report")
+    index.add("310075728", "report")
+    assert index.contains("310075728", "report")
+    assert len(index) == 1
+
+
+def test_extract_instances_ids_keeps_fields_needed_by_reminder_jobs():
+    instance = make_storage_instance("501", "a", "310075728", ["ReportA"])
+    instance["data"][0]["created"] = "2025-08-01T10:00:00Z"
+    instance.update({
+        "visibleAfter": "2025-08-02T00:00:00Z",
+        "createdBy": "user1",
+        "lastChangedBy": "user2",
+        "status": {"isSoftDeleted": True, "isHardDeleted": False},
+    })
+    record = extract_instances_ids({"instances": [instance]})[0]
+    assert record["created"] == "2025-08-01T10:00:00Z"
+    assert record["visibleAfter"] == "2025-08-02T00:00:00Z"
+    assert (record["createdBy"], record["lastChangedBy"]) == ("user1", "user2")
+    assert record["isSoftDeleted"] is True
+    assert record["isHardDeleted"] is False
+    assert record["isComplete"] is False
+
+
+def test_instance_created_with_party_id_lists_only_that_party():
+    client = make_offline_client()
+    page = make_page([make_storage_instance("501", "a", "310075728", ["InitiellSkjemaLevert"])])
+    with patch("clients.instance_client.make_api_call", return_value=page) as mock_call:
+        assert client.instance_created("310075728", "InitiellSkjemaLevert", party_id="501")
+    assert mock_call.call_args.kwargs["params"]["instanceOwner.partyId"] == "501"
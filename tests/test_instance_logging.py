@@ -0,0 +1,69 @@
+from unittest.mock import patch
+
+from clients.instance_logging import InstanceTracker, backfill_pending_shipments, logged_shipment_ids, notification_index_path, record_notification_sent
+
+
+def test_notification_index_path(monkeypatch):
+    monkeypatch.setenv("ENV", "test")
+    assert notification_index_path("R1", "regvil-2025-initiell") == "test/varsling_index/R1_regvil-2025-initiell.json"
+
+
+def test_record_notification_sent_appends_and_sorts():
+    existing = {"sent_times": ["2025-08-10T10:00:00Z"], "last_sent_time": "2025-08-10T10:00:00Z"}
+    with patch("clients.instance_logging.read_blob_with_etag", return_value=(existing, "etag-1")), \
+         patch("clients.instance_logging.write_blob_if_match", return_value=True) as mock_write:
+        assert record_notification_sent("R1", "app", "2025-08-01T10:00:00Z")
+    index = mock_write.call_args.args[1]
+    assert index["sent_times"] == ["2025-08-01T10:00:00Z", "2025-08-10T10:00:00Z"]
+    assert index["last_sent_time"] == "2025-08-10T10:00:00Z"
+    assert mock_write.call_args.args[2] == "etag-1"
+
+
+def test_record_notification_sent_retries_when_another_writer_wins():
+    theirs = {"sent_times": ["2025-08-10T10:00:00Z"]}
+    with patch("clients.instance_logging.read_blob_with_etag", side_effect=[(None, None), (theirs, "etag-2")]), \
+         patch("clients.instance_logging.write_blob_if_match", side_effect=[False, True]) as mock_write:
+        assert record_notification_sent("R1", "app", "2025-08-01T10:00:00Z")
+    # The first attempt only creates the blob; the retry keeps the other writer's entry
+    assert mock_write.call_args_list[0].args[2] is None
+    assert mock_write.call_args_list[1].args[1]["sent_times"] == ["2025-08-01T10:00:00Z", "2025-08-10T10:00:00Z"]
+    assert mock_write.call_args_list[1].args[2] == "etag-2"
+
+
+def test_logging_varlsing_updates_index_only_for_sent_notifications():
+    tracker = InstanceTracker.from_directory("test/varsling/")
+    with patch("clients.instance_logging.write_blob", return_value=True), \
+         patch("clients.instance_logging.record_notification_sent") as mock_record:
+        tracker.logging_varlsing("310075728", "Org", "app", "2025-08-01T10:00:00Z", "R1", "ship-1", "a@b.no", "Varsling1Send")
+        tracker.logging_varlsing("310075728", "Org", "app", "2025-08-01T10:00:00Z", "R1", "ship-1", "a@b.no", "Varsling1Status", {"status": "Completed"})
+    mock_record.assert_called_once_with("R1", "app", "2025-08-01T10:00:00Z")
+
+
+def test_logging_varlsing_registers_pending_shipment(monkeypatch):
+    monkeypatch.setenv("ENV", "test")
+    tracker = InstanceTracker.from_directory("test/varsling/")
+    with patch("clients.instance_logging.write_blob", return_value=True) as mock_write, \
+         patch("clients.instance_logging.record_notification_sent"):
+        tracker.logging_varlsing("310075728", "Org", "app", "2025-08-01T10:00:00Z", "R1", "ship-1", "a@b.no", "Varsling1Send")
+    written = {call.args[0]: call.args[1] for call in mock_write.call_args_list}
+    assert written["test/varsling_pending/R1_app_ship-1.json"]["recipientEmail"] == "a@b.no"
+
+
+def test_backfill_pending_shipments_skips_received():
+    blobs = {
+        "test/varsling/R1_app_Varsling1Send_s1.json": {"digitaliseringstiltak_report_id": "R1", "app_name": "app", "shipment_id": "s1"},
+        "test/varsling/R1_app_Varsling1Recieved_s1.json": {},
+        "test/varsling/R2_app_Varsling1Send_s2.json": {"digitaliseringstiltak_report_id": "R2", "app_name": "app", "shipment_id": "s2"},
+    }
+    with patch("clients.instance_logging.list_blobs_with_prefix", return_value=list(blobs)), \
+         patch("clients.instance_logging.read_blob", side_effect=blobs.get), \
+         patch("clients.instance_logging.add_pending_shipment", return_value=True) as mock_add:
+        assert backfill_pending_shipments("test/varsling/") == 1
+    assert mock_add.call_args.args[:3] == ("R2", "app", "s2")
+
+
+def test_logged_shipment_ids_reads_ids_from_log_blob_names():
+    prefix = "test/varsling/r1_app_Varsling1Send_"
+    with patch("clients.instance_logging.list_blobs_with_prefix", return_value=[f"{prefix}s1.json"]) as mock_list:
+        assert logged_shipment_ids("test/varsling/", "r1", "app", "Varsling1Send") == ["s1"]
+    mock_list.assert_called_once_with(prefix)
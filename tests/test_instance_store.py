@@ -0,0 +1,125 @@
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock
+
+import pytest
+
+from clients.instance_store import InstanceMetadataStore
+
+
+def make_record(instance_id, org_number, tags, last_changed, is_complete=False):
+    return {
+        "instanceOwnerPartyId": instance_id.split("/")[0],
+        "organisationNumber": org_number,
+        "personNumber": "",
+        "instanceId": instance_id,
+        "dataGuid": f"data-{instance_id}",
+        "tags": tags,
+        "lastChanged": last_changed,
+        "isComplete": is_complete,
+    }
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = InstanceMetadataStore(str(tmp_path / "instances.sqlite"))
+    yield store
+    store.close()
+
+
+def make_client(*listings):
+    client = MagicMock(appname="regvil-2025-initiell")
+    client.iter_instances_changed_since.side_effect = [iter(listing) for listing in listings]
+    return client
+
+
+def test_sync_stores_records_and_advances_watermark(store):
+    client = make_client([
+        make_record("1/a", "310075728", ["ReportA"], "2025-08-01T10:00:00.1234567Z"),
+        make_record("2/b", "999999999", [], "2025-08-02T10:00:00Z", is_complete=True),
+    ])
+    assert store.sync(client) == 2
+    assert store.get_watermark("regvil-2025-initiell") == "2025-08-02T10:00:00Z"
+    client.iter_instances_changed_since.assert_called_once_with(None, None)
+
+
+def test_delta_sync_only_requests_changes_since_watermark(store):
+    client = make_client(
+        [make_record("1/a", "310075728", [], "2025-08-01T10:00:00Z")],
+        [make_record("1/a", "310075728", ["ReportA"], "2025-08-03T10:00:00Z")],
+    )
+    store.sync(client)
+    assert store.sync(client) == 1
+    assert client.iter_instances_changed_since.call_args_list[1].args[0] == "2025-08-01T10:00:00Z"
+    assert store.query(tag="ReportA")[0]["instanceId"] == "1/a"
+    assert len(store.query(app_name="regvil-2025-initiell")) == 1
+
+
+def test_query_filters_by_org_tag_and_completion(store):
+    store.upsert("regvil-2025-initiell", [
+        make_record("1/a", "310075728", ["ReportA"], "2025-08-01T10:00:00Z"),
+        make_record("2/b", "310075728", ["ReportB"], "2025-08-02T10:00:00Z", is_complete=True),
+    ])
+    store.upsert("regvil-2025-status", [make_record("3/c", "310075728", ["ReportA"], "2025-08-03T10:00:00Z")])
+    assert [r["instanceId"] for r in store.query(org_number="310075728", tag="ReportA")] == ["1/a", "3/c"]
+    assert [r["instanceId"] for r in store.query(app_name="regvil-2025-initiell", is_complete=True)] == ["2/b"]
+    assert [r["instanceId"] for r in store.query(changed_after="2025-08-01T12:00:00Z")] == ["2/b", "3/c"]
+
+
+def test_full_sync_drops_instances_no_longer_listed(store):
+    client = make_client(
+        [make_record("1/a", "1", [], "2025-08-01T10:00:00Z"), make_record("2/b", "2", [], "2025-08-01T10:00:00Z")],
+        [make_record("2/b", "2", [], "2025-08-01T10:00:00Z")],
+    )
+    store.sync(client)
+    store.sync(client, full=True)
+    assert [r["instanceId"] for r in store.query()] == ["2/b"]
+
+
+def test_delta_sync_turns_full_when_last_full_sync_is_old(tmp_path):
+    store = InstanceMetadataStore(str(tmp_path / "instances.sqlite"), full_sync_days=7)
+    client = make_client(
+        [make_record("1/a", "1", ["R1"], "2025-08-01T10:00:00Z"), make_record("2/b", "2", [], "2025-08-01T10:00:00Z")],
+        [],
+        [make_record("2/b", "2", [], "2025-08-01T10:00:00Z")],
+    )
+    store.sync(client)
+    store.sync(client)
+    assert client.iter_instances_changed_since.call_args_list[1].args[0] == "2025-08-01T10:00:00Z"
+    assert not store.full_sync_due("regvil-2025-initiell")
+
+    old = (datetime.now(timezone.utc) - timedelta(days=8)).isoformat()
+    with store._conn:
+        store._conn.execute("UPDATE sync_state SET synced_at = ? WHERE app_name = ?", (old, "regvil-2025-initiell#full"))
+    store.sync(client)
+    assert client.iter_instances_changed_since.call_args_list[2].args[0] is None
+    assert [r["instanceId"] for r in store.query()] == ["2/b"]
+    assert not store.full_sync_due("regvil-2025-initiell")
+    store.close()
+
+
+def test_remove_drops_instance_and_reminder_state(store):
+    now = datetime(2025, 9, 1, tzinfo=timezone.utc)
+    store.upsert("regvil-2025-initiell", [make_record("1/a", "1", ["R1"], "2025-08-01T10:00:00Z")])
+    store.set_reminder_state("regvil-2025-initiell", "1/a", now - timedelta(days=1))
+    store.remove("regvil-2025-initiell", "1/a")
+    assert store.query() == []
+    assert store.reminder_candidates("regvil-2025-initiell", None, now) == []
+
+
+def test_reminder_candidates_are_new_changed_or_due(store):
+    now = datetime(2025, 9, 1, tzinfo=timezone.utc)
+    store.upsert("regvil-2025-initiell", [
+        make_record("1/new", "1", ["R1"], "2025-08-01T10:00:00Z"),
+        make_record("2/unchanged", "2", ["R2"], "2025-08-01T10:00:00Z"),
+        make_record("3/changed", "3", ["R3"], "2025-08-20T10:00:00Z"),
+        make_record("4/due", "4", ["R4"], "2025-08-01T10:00:00Z"),
+        make_record("5/inactive", "5", [], "2025-08-01T10:00:00Z"),
+        make_record("6/complete", "6", ["R6"], "2025-08-20T10:00:00Z", is_complete=True),
+    ])
+    store.set_reminder_state("regvil-2025-initiell", "2/unchanged", now + timedelta(days=3))
+    store.set_reminder_state("regvil-2025-initiell", "3/changed", now + timedelta(days=3))
+    store.set_reminder_state("regvil-2025-initiell", "4/due", now - timedelta(days=1))
+    store.set_reminder_state("regvil-2025-initiell", "5/inactive", None)
+
+    candidates = store.reminder_candidates("regvil-2025-initiell", "2025-08-10T00:00:00Z", now)
+    assert [r["instanceId"] for r in candidates] == ["1/new", "3/changed", "4/due"]
@@ -0,0 +1,86 @@
+import time
+from unittest.mock import MagicMock, patch
+
+import notification_status
+
+
+def make_entry(shipment_id):
+    return {
+        "digitaliseringstiltak_report_id": "R1",
+        "app_name": "regvil-2025-initiell",
+        "shipment_id": shipment_id,
+        "org_number": "310075728",
+        "org_name": "Org",
+        "send_time": "2025-08-01T10:00:00Z",
+        "recipientEmail": "a@b.no",
+    }
+
+
+def make_status_response(status):
+    response = MagicMock(status_code=200)
+    response.json.return_value = {"status": status, "recipients": [{"status": "Email_Delivered"}]}
+    return response
+
+
+def test_main_polls_only_pending_shipments_and_drains_finished_ones():
+    varsling_client = MagicMock()
+    varsling_client.get_shipment_status.side_effect = lambda shipment_id: make_status_response(
+        {"done": "Order_Completed", "waiting": "Order_Processing", "cancelled": "Order_Cancelled"}[shipment_id]
+    )
+    tracker = MagicMock()
+    with patch("notification_status.list_pending_shipments", return_value=[make_entry("done"), make_entry("waiting"), make_entry("cancelled")]), \
+         patch("notification_status.load_full_config"), \
+         patch("notification_status.AltinnVarslingClient.init_from_config", return_value=varsling_client), \
+         patch("notification_status.InstanceTracker.from_directory", return_value=tracker), \
+         patch("notification_status.remove_pending_shipment") as mock_remove, \
+         patch("notification_status.backfill_pending_shipments") as mock_backfill:
+        notification_status.main()
+
+    assert varsling_client.get_shipment_status.call_count == 3
+    tracker.logging_varlsing.assert_called_once()
+    assert tracker.logging_varlsing.call_args.kwargs["event_type"] == "Varsling1Recieved"
+    assert tracker.logging_varlsing.call_args.kwargs["shipment_id"] == "done"
+    assert [call.args[2] for call in mock_remove.call_args_list] == ["done", "cancelled"]
+    mock_backfill.assert_not_called()
+
+
+def test_main_builds_one_client_per_app_and_polls_concurrently(monkeypatch):
+    monkeypatch.setenv("NOTIFICATION_STATUS_CONCURRENCY", "4")
+    entries = [dict(make_entry(f"s{i}"), app_name=f"app-{i % 2}") for i in range(8)]
+
+    def slow_status(shipment_id):
+        time.sleep(0.05)
+        return make_status_response("Order_Processing")
+
+    varsling_client = MagicMock()
+    varsling_client.get_shipment_status.side_effect = slow_status
+    with patch("notification_status.list_pending_shipments", return_value=entries), \
+         patch("notification_status.load_full_config") as mock_config, \
+         patch("notification_status.AltinnVarslingClient.init_from_config", return_value=varsling_client) as mock_init, \
+         patch("notification_status.remove_pending_shipment") as mock_remove:
+        started = time.monotonic()
+        summary = notification_status.main()
+        elapsed = time.monotonic() - started
+
+    assert mock_config.call_count == 2
+    assert mock_init.call_count == 2
+    assert varsling_client.get_shipment_status.call_count == 8
+    mock_remove.assert_not_called()
+    assert summary["polled"] == 8 and summary["finished"] == 0
+    assert summary["shipments_per_second"] > 0
+    # Sequentially this takes 8 * 0.05 = 0.4s
+    assert elapsed < 0.3
+
+
+def test_main_backfills_when_manifest_is_empty():
+    backfilled = []
+    with patch("notification_status.list_pending_shipments", side_effect=lambda: list(backfilled)), \
+         patch("notification_status.backfill_pending_shipments", side_effect=lambda directory: backfilled.append(make_entry("old"))) as mock_backfill, \
+         patch("notification_status.load_full_config"), \
+         patch("notification_status.AltinnVarslingClient.init_from_config") as mock_init, \
+         patch("notification_status.remove_pending_shipment"):
+        mock_init.return_value.get_shipment_status.return_value = make_status_response("Order_Processing")
+        result = notification_status.main()
+
+    mock_backfill.assert_called_once()
+    assert result["polled"] == 1
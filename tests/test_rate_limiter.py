@@ -0,0 +1,54 @@
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from clients.instance_client import make_api_call
+from clients.rate_limiter import TokenBucket, clear_rate_limits, configure_rate_limit, get_rate_limiter
+
+PLATFORM_URL = "https://platform.tt02.altinn.no/storage/api/v1/instances"
+VARSLING_URL = "https://platform.tt02.altinn.no/notifications/api/v1"
+
+
+@pytest.fixture(autouse=True)
+def reset_limits():
+    clear_rate_limits()
+    yield
+    clear_rate_limits()
+
+
+def test_token_bucket_allows_burst_then_throttles():
+    bucket = TokenBucket(rate=20, capacity=5)
+    start = time.monotonic()
+    for _ in range(10):
+        bucket.acquire()
+    elapsed = time.monotonic() - start
+    # Five calls fit in the burst, the remaining five are spaced at 20/s
+    assert 0.2 <= elapsed < 1.0
+
+
+def test_rate_limiter_is_chosen_per_base_url():
+    configure_rate_limit(PLATFORM_URL, 10)
+    configure_rate_limit(VARSLING_URL, 5)
+    assert get_rate_limiter(f"{PLATFORM_URL}?org=digdir").rate == 10
+    assert get_rate_limiter(f"{VARSLING_URL}/future/orders").rate == 5
+    assert get_rate_limiter("https://digdir.apps.tt02.altinn.no/digdir") is None
+
+
+def test_configure_rate_limit_keeps_existing_bucket_and_can_disable():
+    configure_rate_limit(PLATFORM_URL, 10)
+    bucket = get_rate_limiter(PLATFORM_URL)
+    configure_rate_limit(PLATFORM_URL, 10)
+    assert get_rate_limiter(PLATFORM_URL) is bucket
+    configure_rate_limit(PLATFORM_URL, None)
+    assert get_rate_limiter(PLATFORM_URL) is None
+
+
+def test_make_api_call_waits_for_rate_limiter():
+    configure_rate_limit(PLATFORM_URL, 1000)
+    limiter = get_rate_limiter(PLATFORM_URL)
+    with patch.object(limiter, "acquire", wraps=limiter.acquire) as mock_acquire, \
+         patch("clients.instance_client.http_request", return_value=MagicMock(status_code=200)):
+        make_api_call("GET", PLATFORM_URL, headers={})
+        make_api_call("GET", "https://digdir.apps.tt02.altinn.no/digdir", headers={})
+    assert mock_acquire.call_count == 1
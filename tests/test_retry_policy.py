@@ -0,0 +1,74 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+import requests
+
+from clients.retry_policy import RetryPolicy, call_with_retry, endpoint_key, retry_metrics
+
+URL = "https://digdir.apps.tt02.altinn.no/digdir/regvil-2025-initiell/instances/51625403/a72223a3-926b-4095-a2a6-bacc10815f2d"
+
+
+def make_response(status_code, headers=None):
+    return MagicMock(status_code=status_code, headers=headers or {})
+
+
+@pytest.fixture(autouse=True)
+def no_sleep():
+    retry_metrics.reset()
+    with patch("clients.retry_policy.time.sleep") as mock_sleep:
+        yield mock_sleep
+
+
+def test_endpoint_key_groups_ids():
+    assert endpoint_key("get", URL) == "GET digdir.apps.tt02.altinn.no/digdir/regvil-2025-initiell/instances/{id}/{id}"
+
+
+def test_retries_idempotent_request_until_success(no_sleep):
+    send = MagicMock(side_effect=[make_response(503), make_response(500), make_response(200)])
+    response = call_with_retry(send, "GET", URL, RetryPolicy(max_attempts=4))
+    assert response.status_code == 200
+    assert send.call_count == 3
+    assert retry_metrics.snapshot() == {endpoint_key("GET", URL): 2}
+
+
+def test_does_not_retry_post_on_server_error():
+    send = MagicMock(return_value=make_response(500))
+    assert call_with_retry(send, "POST", URL, RetryPolicy()).status_code == 500
+    assert send.call_count == 1
+
+
+def test_retries_post_on_429_and_honours_retry_after(no_sleep):
+    send = MagicMock(side_effect=[make_response(429, {"Retry-After": "3"}), make_response(201)])
+    assert call_with_retry(send, "POST", URL, RetryPolicy()).status_code == 201
+    no_sleep.assert_called_once_with(3.0)
+
+
+def test_returns_last_response_when_attempts_exhausted():
+    send = MagicMock(return_value=make_response(502))
+    assert call_with_retry(send, "GET", URL, RetryPolicy(max_attempts=3)).status_code == 502
+    assert send.call_count == 3
+
+
+def test_stops_when_retry_after_exceeds_deadline(no_sleep):
+    send = MagicMock(return_value=make_response(503, {"Retry-After": "120"}))
+    assert call_with_retry(send, "GET", URL, RetryPolicy(total_deadline=30)).status_code == 503
+    assert send.call_count == 1
+    no_sleep.assert_not_called()
+
+
+def test_retries_connection_errors_only_for_idempotent_methods():
+    send = MagicMock(side_effect=[requests.exceptions.ConnectionError(), make_response(200)])
+    assert call_with_retry(send, "DELETE", URL, RetryPolicy()).status_code == 200
+
+    send = MagicMock(side_effect=requests.exceptions.ReadTimeout())
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        call_with_retry(send, "POST", URL, RetryPolicy())
+    assert send.call_count == 1
+
+    send = MagicMock(side_effect=[requests.exceptions.ConnectTimeout(), make_response(201)])
+    assert call_with_retry(send, "POST", URL, RetryPolicy()).status_code == 201
+
+
+def test_backoff_is_bounded():
+    policy = RetryPolicy(backoff_base=1, backoff_max=4)
+    assert all(0 <= policy.backoff(attempt) <= 4 for attempt in range(1, 10))
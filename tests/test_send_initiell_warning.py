@@ -0,0 +1,86 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+import send_initiell_warning
+from clients.checkpoint import DONE, FAILED, IN_PROGRESS, open_checkpoint_journal
+from clients.instance_client import NOT_SENT, REJECTED, UNKNOWN
+
+
+def make_row(report_id):
+    return {
+        "digitaliseringstiltak_report_id": report_id,
+        "Kontaktperson.EPostadresse": f"{report_id}@example.no",
+        "AnsvarligVirksomhet.Organisasjonsnummer": "310075728",
+        "AnsvarligVirksomhet.Navn": "Org",
+    }
+
+
+def open_journal():
+    return open_checkpoint_journal("send_initiell_warning", "regvil-2025-initiell-2020-01-01T00:00:00+00:00")
+
+
+def run_main(rows, varsling_client, failure_cause=None, logged_shipments=None, resend_in_progress=False):
+    config = MagicMock()
+    config.app_config.visibleAfter = "2020-01-01T00:00:00+00:00"
+    config.app_config.app_name = "regvil-2025-initiell"
+    with patch("send_initiell_warning.load_full_config", return_value=config), \
+         patch("send_initiell_warning.AltinnVarslingClient.init_from_config", return_value=varsling_client), \
+         patch("send_initiell_warning.read_blob", return_value=rows), \
+         patch("send_initiell_warning.last_call_failure", return_value=failure_cause), \
+         patch("send_initiell_warning.logged_shipment_ids", side_effect=lambda path, report_id, app, event: (logged_shipments or {}).get(report_id, [])), \
+         patch("send_initiell_warning.InstanceTracker.from_directory"):
+        return send_initiell_warning.main(resend_in_progress=resend_in_progress)
+
+
+def test_main_resumes_without_resending_done_or_interrupted_reports(monkeypatch, tmp_path):
+    monkeypatch.setenv("CHECKPOINT_DIR", str(tmp_path))
+    journal = open_journal()
+    journal.mark("r1", DONE, shipment_id="s1")
+    journal.mark("r2", IN_PROGRESS)
+
+    varsling_client = MagicMock()
+    varsling_client.send_notification.return_value.status_code = 201
+    varsling_client.send_notification.return_value.json.return_value = {"notification": {"shipmentId": "s3"}}
+    outcomes = run_main([make_row("r1"), make_row("r2"), make_row("r3")], varsling_client)
+
+    assert outcomes == {"resumed": 1, "unknown": 1, "sent": 1}
+    varsling_client.send_notification.assert_called_once()
+    assert varsling_client.send_notification.call_args.kwargs["recipient_email"] == "r3@example.no"
+    assert open_journal().state("r3") == DONE
+
+
+def test_in_progress_report_with_send_log_is_marked_done(monkeypatch, tmp_path):
+    monkeypatch.setenv("CHECKPOINT_DIR", str(tmp_path))
+    open_journal().mark("r1", IN_PROGRESS)
+    varsling_client = MagicMock()
+
+    assert run_main([make_row("r1")], varsling_client, logged_shipments={"r1": ["s1"]}) == {"resolved": 1}
+    varsling_client.send_notification.assert_not_called()
+    assert open_journal().get("r1")["shipment_id"] == "s1"
+    assert open_journal().state("r1") == DONE
+
+
+def test_in_progress_report_without_send_log_is_resent_on_request(monkeypatch, tmp_path):
+    monkeypatch.setenv("CHECKPOINT_DIR", str(tmp_path))
+    open_journal().mark("r1", IN_PROGRESS)
+    varsling_client = MagicMock()
+    varsling_client.send_notification.return_value.status_code = 201
+    varsling_client.send_notification.return_value.json.return_value = {"notification": {"shipmentId": "s2"}}
+
+    assert run_main([make_row("r1")], varsling_client, resend_in_progress=True) == {"sent": 1}
+    varsling_client.send_notification.assert_called_once()
+    assert open_journal().get("r1")["shipment_id"] == "s2"
+
+
+@pytest.mark.parametrize(
+    "cause, outcome, state",
+    [(NOT_SENT, "failed", FAILED), (REJECTED, "failed", FAILED), (UNKNOWN, "unknown", IN_PROGRESS)],
+)
+def test_failed_send_is_only_left_in_progress_when_altinn_may_have_accepted_it(monkeypatch, tmp_path, cause, outcome, state):
+    monkeypatch.setenv("CHECKPOINT_DIR", str(tmp_path))
+    varsling_client = MagicMock()
+    varsling_client.send_notification.return_value = None
+
+    assert run_main([make_row("r1")], varsling_client, failure_cause=cause) == {outcome: 1}
+    assert open_journal().state("r1") == state
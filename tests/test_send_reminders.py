@@ -1,5 +1,6 @@
 import pytest
 from datetime import datetime, timedelta, timezone
+import time
 from unittest.mock import patch, MagicMock
 from send_reminders import get_latest_notification_date, check_instance_active, run
 
@@ -15,7 +16,9 @@ def mock_blob_data():
 
 def test_get_latest_notification_date_parses_times(mock_blob_data):
     """Ensure get_latest_notification_date parses blob sent_time correctly."""
-    with patch("send_reminders.list_blobs_with_prefix", return_value=["blob1", "blob2"]), \
+    with patch("send_reminders.read_notification_index", return_value=None), \
+         patch("send_reminders.write_notification_index"), \
+         patch("send_reminders.list_blobs_with_prefix", return_value=["blob1", "blob2"]), \
          patch("send_reminders.read_blob", side_effect=mock_blob_data):
         result = get_latest_notification_date(["tag1"], "myapp")
         assert len(result) == 2
@@ -23,6 +26,26 @@ def test_get_latest_notification_date_parses_times(mock_blob_data):
         assert max(result) > min(result)
 
 
+def test_get_latest_notification_date_uses_index_without_listing_blobs():
+    sent_time = "2025-08-01T10:00:00.000000Z"
+    with patch("send_reminders.read_notification_index", return_value={"sent_times": [sent_time], "last_sent_time": sent_time}), \
+         patch("send_reminders.list_blobs_with_prefix") as mock_list, \
+         patch("send_reminders.read_blob") as mock_read:
+        result = get_latest_notification_date(["tag1"], "myapp")
+    assert result == [datetime(2025, 8, 1, 10, tzinfo=timezone.utc)]
+    mock_list.assert_not_called()
+    mock_read.assert_not_called()
+
+
+def test_get_latest_notification_date_backfills_index(mock_blob_data):
+    with patch("send_reminders.read_notification_index", return_value=None), \
+         patch("send_reminders.write_notification_index") as mock_write, \
+         patch("send_reminders.list_blobs_with_prefix", return_value=["blob1", "blob2"]), \
+         patch("send_reminders.read_blob", side_effect=mock_blob_data):
+        get_latest_notification_date(["tag1"], "myapp")
+    mock_write.assert_called_once_with("tag1", "myapp", [blob["sent_time"] for blob in mock_blob_data])
+
+
 @pytest.mark.parametrize(
     "instance_meta, tag, expected",
     [
@@ -38,65 +61,163 @@ def test_check_instance_active(instance_meta, tag, expected):
     assert result is expected
 
 
-def test_run_sends_warning_only_when_conditions_met(tmp_path):
-    """Test run() flow with everything mocked to trigger send_warning."""
-    fake_instance_meta = {
-        "data": {},
-        "visibleAfter": (datetime.now(timezone.utc) - timedelta(days=20)).isoformat().replace("+00:00", "Z"),
-        "createdBy": "user1", "lastChangedBy": "user1",
+def make_listing_record(created_days_ago=20, visible_days_ago=20, tags=("tag1",), **overrides):
+    now = datetime.now(timezone.utc)
+    record = {
+        "instanceOwnerPartyId": "123",
+        "organisationNumber": "123456789",
+        "instanceId": "123/456",
+        "dataGuid": "dataguid",
+        "tags": list(tags),
+        "created": (now - timedelta(days=created_days_ago)).isoformat().replace("+00:00", "Z"),
+        "visibleAfter": (now - timedelta(days=visible_days_ago)).isoformat().replace("+00:00", "Z"),
+        "createdBy": "user1",
+        "lastChangedBy": "user1",
         "isHardDeleted": False,
         "isSoftDeleted": False,
+        "isComplete": False,
     }
+    record.update(overrides)
+    return record
+
+
+def test_run_sends_warning_only_when_conditions_met(tmp_path):
+    """Test run() flow with everything mocked to trigger send_warning."""
     fake_data = {"Prefill": {"AnsvarligVirksomhet": {"Organisasjonsnummer": "123456789"}}}
 
     mock_client = MagicMock()
-    mock_client.get_stored_instances_ids.return_value = [{"instanceId": "123/456"}]
-    mock_client.get_instance.return_value.status_code = 200
-    mock_client.get_instance.return_value.json.return_value = fake_instance_meta
+    mock_client.iter_instances_by_completion.return_value = [make_listing_record()]
     mock_client.get_instance_data.return_value.status_code = 200
     mock_client.get_instance_data.return_value.json.return_value = fake_data
 
     with patch("send_reminders.apps", ["regvil-2025-initiell"]), \
-         patch("send_reminders.load_full_config", return_value={"dummy": "config"}), \
+         patch("send_reminders.load_full_config", return_value=MagicMock()), \
          patch("send_reminders.AltinnInstanceClient.init_from_config", return_value=mock_client), \
-         patch("send_reminders.get_meta_data_info", return_value={"id": "dataguid", "tags": ["tag1"],  "created": (datetime.now(timezone.utc) - timedelta(days=20)).isoformat().replace("+00:00", "Z")}), \
-         patch("send_reminders.list_blobs_with_prefix", return_value=[]), \
-         patch("send_reminders.read_blob", return_value={}), \
          patch("send_reminders.get_latest_notification_date", return_value=[datetime.now(timezone.utc) - timedelta(days=20)]), \
          patch("send_reminders.send_warning") as mock_send:
         result, status_code = run()
         assert result == [{'org_number': '123456789', 'party_id': '123', 'instance_id': '456', 'org_name': None, 'digitaliseringstiltak_report_id': 'tag1', 'dato': datetime.now(timezone.utc).strftime("%Y-%m-%d"), 'app_name': 'regvil-2025-initiell'}]
         assert status_code == 201
         mock_send.assert_called_once()
+        mock_client.get_instance.assert_not_called()
+        mock_client.get_instance_data.assert_called_once_with("123", "456", "dataguid")
 
 
 def test_run_skips_when_recent_notification():
     """Ensure run() skips sending if last notification < 14 days ago."""
     now = datetime.now(timezone.utc)
     recent_time = (now - timedelta(days=5)).isoformat()
-    fake_instance_meta = {
-        "data": {},
-        "visibleAfter": (now - timedelta(days=20)).isoformat().replace("+00:00", "Z"),
-        "status": {"createdBy": "user1", "lastChangedBy": "user1"},
-        "isHardDeleted": False,
-        "isSoftDeleted": False,
-    }
-    fake_data = {"Prefill": {"AnsvarligVirksomhet": {"Organisasjonsnummer": "123456789"}}}
 
     mock_client = MagicMock()
-    mock_client.get_stored_instances_ids.return_value = [{"instanceId": "123/456"}]
-    mock_client.get_instance.return_value.status_code = 200
-    mock_client.get_instance.return_value.json.return_value = fake_instance_meta
-    mock_client.get_instance_data.return_value.status_code = 200
-    mock_client.get_instance_data.return_value.json.return_value = fake_data
+    mock_client.iter_instances_by_completion.return_value = [make_listing_record()]
 
-    with patch("send_reminders.load_full_config", return_value={"dummy": "config"}), \
+    with patch("send_reminders.apps", ["regvil-2025-initiell"]), \
+         patch("send_reminders.load_full_config", return_value={"dummy": "config"}), \
          patch("send_reminders.AltinnInstanceClient.init_from_config", return_value=mock_client), \
-         patch("send_reminders.get_meta_data_info", return_value={"id": "dataguid", "tags": ["tag1"],"created": (now - timedelta(days=20)).isoformat().replace("+00:00", "Z")}), \
          patch("send_reminders.list_blobs_with_prefix", return_value=["blob1"]), \
          patch("send_reminders.read_blob", return_value={"sent_time": recent_time, "event_type": "Varsling1Send"}), \
+         patch("send_reminders.read_notification_index", return_value=None), \
+         patch("send_reminders.write_notification_index") as mock_write_index, \
          patch("send_reminders.send_warning") as mock_send:
         result, status_code = run()
         assert result == []
         assert status_code == 200
-        mock_send.assert_not_called()
\ No newline at end of file
+        mock_send.assert_not_called()
+        mock_write_index.assert_called_once()
+        mock_client.get_instance.assert_not_called()
+        mock_client.get_instance_data.assert_not_called()
+
+
+def test_run_fetches_instance_for_records_without_listing_fields():
+    """Records stored before the listing carried dates and flags fall back to get_instance."""
+    mock_client = MagicMock()
+    mock_client.iter_instances_by_completion.return_value = [{"instanceId": "123/456", "tags": ["tag1"]}]
+    mock_client.get_instance.return_value.status_code = 200
+    mock_client.get_instance.return_value.json.return_value = {
+        "id": "123/456",
+        "instanceOwner": {"partyId": "123", "organisationNumber": "123456789"},
+        "visibleAfter": "2025-01-01T00:00:00Z",
+        "status": {"isSoftDeleted": True},
+        "data": [{"id": "dataguid", "dataType": "DataModel", "contentType": "application/xml", "tags": ["tag1"], "created": "2025-01-01T00:00:00Z"}],
+    }
+
+    with patch("send_reminders.apps", ["regvil-2025-initiell"]), \
+         patch("send_reminders.load_full_config", return_value={"dummy": "config"}), \
+         patch("send_reminders.AltinnInstanceClient.init_from_config", return_value=mock_client), \
+         patch("send_reminders.send_warning") as mock_send:
+        assert run() == ([], 200)
+        mock_client.get_instance.assert_called_once_with("123", "456")
+        mock_client.get_instance_data.assert_not_called()
+        mock_send.assert_not_called()
+
+def test_run_with_instance_store_only_reevaluates_changed_or_due(tmp_path, monkeypatch):
+    """With INSTANCE_STORE_PATH set, a second run skips instances that are unchanged and not due."""
+    monkeypatch.setenv("INSTANCE_STORE_PATH", str(tmp_path / "instances.sqlite"))
+    now = datetime.now(timezone.utc)
+    records = [
+        {"instanceId": "1/a", "tags": ["R1"], "lastChanged": "2025-08-01T10:00:00Z", "isComplete": False},
+        {"instanceId": "2/b", "tags": ["R2"], "lastChanged": "2025-08-01T10:00:00Z", "isComplete": False},
+    ]
+    mock_client = MagicMock(appname="regvil-2025-initiell")
+    mock_client.iter_instances_changed_since.side_effect = [iter(records), iter([])]
+    evaluate = MagicMock(side_effect=[(None, now + timedelta(days=3)), (None, now - timedelta(days=1)), (None, now + timedelta(days=14))])
+
+    with patch("send_reminders.apps", ["regvil-2025-initiell"]), \
+         patch("send_reminders.load_full_config", return_value={"dummy": "config"}), \
+         patch("send_reminders.AltinnInstanceClient.init_from_config", return_value=mock_client), \
+         patch("send_reminders.evaluate_instance", evaluate):
+        assert run() == ([], 200)
+        assert run() == ([], 200)
+
+    evaluated = [call.args[3]["instanceId"] for call in evaluate.call_args_list]
+    assert evaluated == ["1/a", "2/b", "2/b"]
+
+
+def test_run_evaluates_concurrently_and_keeps_listing_order(monkeypatch):
+    """Slow early instances must not reorder the returned reminders."""
+    monkeypatch.setenv("REMINDER_CONCURRENCY", "4")
+    apps = ["app-a", "app-b"]
+    clients = {}
+    for app in apps:
+        client = MagicMock(appname=app)
+        client.iter_instances_by_completion.return_value = [{"instanceId": f"{i}/{app}"} for i in range(4)]
+        clients[app] = client
+
+    def fake_evaluate(client, config, app, instance):
+        party_id = int(instance["instanceId"].split("/")[0])
+        time.sleep(0.05 * (3 - party_id))
+        return {"instance_id": instance["instanceId"]}, None
+
+    with patch("send_reminders.apps", apps), \
+         patch("send_reminders.load_full_config", side_effect=lambda path, app, env: app), \
+         patch("send_reminders.AltinnInstanceClient.init_from_config", side_effect=lambda config: clients[config]), \
+         patch("send_reminders.evaluate_instance", side_effect=fake_evaluate):
+        started = time.monotonic()
+        result, status_code = run()
+        elapsed = time.monotonic() - started
+
+    assert [r["instance_id"] for r in result] == [f"{i}/{app}" for app in apps for i in range(4)]
+    assert status_code == 201
+    # Sequentially this takes 2 * (0.15 + 0.1 + 0.05) = 0.6s
+    assert elapsed < 0.45
+
+
+def test_run_skips_instances_whose_calls_return_no_response():
+    """A transport error for one instance must not end the run for the others."""
+    mock_client = MagicMock()
+    mock_client.iter_instances_by_completion.return_value = [
+        {"instanceId": "123/456", "tags": ["tag1"]},
+        make_listing_record(instanceId="789/012"),
+    ]
+    mock_client.get_instance.return_value = None
+    mock_client.get_instance_data.return_value = None
+
+    with patch("send_reminders.apps", ["regvil-2025-initiell"]), \
+         patch("send_reminders.load_full_config", return_value=MagicMock()), \
+         patch("send_reminders.AltinnInstanceClient.init_from_config", return_value=mock_client), \
+         patch("send_reminders.get_latest_notification_date", return_value=[datetime.now(timezone.utc) - timedelta(days=20)]), \
+         patch("send_reminders.send_warning") as mock_send:
+        assert run() == ([], 200)
+    mock_client.get_instance.assert_called_once_with("123", "456")
+    mock_client.get_instance_data.assert_called_once_with("789", "012", "dataguid")
+    mock_send.assert_not_called()
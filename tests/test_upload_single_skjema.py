@@ -98,3 +98,61 @@ def test_create_payload():
 
     datamodel_content = json.loads(result["DataModel"][1])
     assert datamodel_content == prefill_data
+
+
+def make_upload_mocks(monkeypatch, data_element):
+    monkeypatch.setattr("upload_single_skjema.load_full_config", lambda path, app_name, env: MagicMock(
+        app_config=MagicMock(app_name="regvil-2025-initiell", tag={"tag_instance": "InitiellSkjemaLevert"})
+    ))
+    monkeypatch.setattr("upload_single_skjema.create_payload", lambda org, dato, config, prefill: {
+        "DataModel": ("datamodel.json", json.dumps(prefill, ensure_ascii=False), "application/json"),
+    })
+    mock_client = MagicMock()
+    mock_client.instance_created.return_value = False
+    mock_client.post_new_instance.return_value.status_code = 201
+    mock_client.post_new_instance.return_value.json.return_value = {
+        "id": "51625403/abc123",
+        "instanceOwner": {"partyId": "51625403"},
+        "data": [dict(data_element, id="data-guid-123", dataType="DataModel")],
+    }
+    mock_client.tag_instance_data.return_value.status_code = 201
+    mock_client.get_instance_data.return_value.status_code = 200
+    mock_client.get_instance_data.return_value.json.return_value = {"from": "altinn"}
+    monkeypatch.setattr("upload_single_skjema.AltinnInstanceClient.init_from_config", lambda config: mock_client)
+    mock_tracker = MagicMock()
+    monkeypatch.setattr("upload_single_skjema.InstanceTracker.from_directory", lambda _: mock_tracker)
+    return mock_client, mock_tracker
+
+
+def run_upload(**kwargs):
+    return run(
+        org_number="51625403",
+        digitaliseringstiltak_report_id="test-report-001",
+        dato="2025-08-01T00:00:00Z",
+        app_name="regvil-2025-initiell",
+        prefill_data={"Prefill": {"Navn": "Bærum"}},
+        **kwargs,
+    )
+
+
+def test_run_logs_local_prefill_when_data_element_matches(monkeypatch):
+    size = len(json.dumps({"Prefill": {"Navn": "Bærum"}}, ensure_ascii=False).encode("utf-8"))
+    mock_client, mock_tracker = make_upload_mocks(monkeypatch, {"contentType": "application/json", "size": size})
+    assert run_upload() == 200
+    mock_client.get_instance_data.assert_not_called()
+    assert mock_tracker.logging_instance.call_args.args[4] == {"Prefill": {"Navn": "Bærum"}}
+
+
+@pytest.mark.parametrize(
+    "data_element, refetch_data",
+    [
+        ({"contentType": "application/json", "size": 1}, None),
+        ({"contentType": "application/json"}, None),
+        ({"contentType": "application/json", "size": 31}, True),
+    ],
+)
+def test_run_downloads_data_when_not_verified_or_requested(monkeypatch, data_element, refetch_data):
+    mock_client, mock_tracker = make_upload_mocks(monkeypatch, data_element)
+    assert run_upload(refetch_data=refetch_data) == 200
+    mock_client.get_instance_data.assert_called_once_with("51625403", "abc123", "data-guid-123")
+    assert mock_tracker.logging_instance.call_args.args[4] == {"from": "altinn"}
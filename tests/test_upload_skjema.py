@@ -0,0 +1,168 @@
+import threading
+from unittest.mock import MagicMock, patch
+
+import upload_skjema
+from clients.instance_client import InstanceIndex
+
+
+def make_row(org_number, report_id):
+    return {"AnsvarligVirksomhet.Organisasjonsnummer": org_number, "digitaliseringstiltak_report_id": report_id}
+
+
+def make_created(party_id):
+    response = MagicMock(status_code=201)
+    response.json.return_value = {
+        "id": f"{party_id}/guid",
+        "data": [{"id": "data-guid", "dataType": "DataModel", "contentType": "application/json"}],
+    }
+    return response
+
+
+def make_rows():
+    # Report ids differ per row but all map to the tag "ReportA"
+    return [
+        make_row("111111111", "ReportA-1"),
+        make_row("111111111", "ReportA-2"),
+        make_row("222222222", "ReportA-3"),
+        make_row("333333333", "ReportA-4"),
+        make_row("444444444", "ReportA-5"),
+        make_row("555555555", "ReportA-6"),
+    ]
+
+
+def run_main(rows, fail_orgs=("444444444",), setup=None, instance_store=None):
+    def validate(row):
+        if row["AnsvarligVirksomhet.Organisasjonsnummer"] == "555555555":
+            raise ValueError("bad row")
+        return True
+
+    config = MagicMock()
+    config.app_config.app_name = "regvil-2025-initiell"
+    config.app_config.visibleAfter = "2025-09-01T08:00:00Z"
+    config.app_config.validate_prefill_data.side_effect = validate
+    config.app_config.get_prefill_data.side_effect = lambda row: {"org": row["AnsvarligVirksomhet.Organisasjonsnummer"]}
+
+    created_lock = threading.Lock()
+    created_orgs = []
+
+    def post_new_instance(files):
+        org = files["instance"][1]
+        if org in fail_orgs:
+            return MagicMock(status_code=500)
+        with created_lock:
+            created_orgs.append(org)
+        return make_created("50001")
+
+    client = MagicMock()
+    client.post_new_instance.side_effect = post_new_instance
+    client.build_instance_index.return_value = InstanceIndex([{"organisationNumber": "222222222", "tags": ["ReportA"]}])
+    client.get_instance_data.return_value.status_code = 200
+    client.get_instance_data.return_value.json.return_value = {}
+    client.tag_instance_data.return_value.status_code = 201
+    if setup is not None:
+        setup(client)
+
+    with patch("upload_skjema.load_full_config", return_value=config), \
+         patch("upload_skjema.read_blob", return_value=rows), \
+         patch("upload_skjema.AltinnInstanceClient.init_from_config", return_value=client), \
+         patch("upload_skjema.InstanceTracker.from_directory", return_value=MagicMock()), \
+         patch("upload_skjema.open_instance_store", return_value=instance_store), \
+         patch("upload_skjema.create_payload", side_effect=lambda org, dato, cfg, data: {
+             "instance": ("instance.json", org, "application/json"),
+             "DataModel": ("datamodel.json", "{}", "application/json"),
+         }):
+        return upload_skjema.main(), created_orgs
+
+
+def test_main_uploads_rows_concurrently_and_reports_summary(monkeypatch, tmp_path):
+    monkeypatch.setenv("UPLOAD_CONCURRENCY", "4")
+    monkeypatch.setenv("CHECKPOINT_DIR", str(tmp_path))
+    summary, created_orgs = run_main(make_rows())
+
+    assert (summary["created"], summary["skipped"], summary["failed"]) == (2, 2, 2)
+    assert summary["rows"] == 6
+    assert summary["concurrency"] == 4
+    assert summary["stages"]["create"]["count"] == 3
+    assert summary["stages"]["tag"]["count"] == 2
+    assert sorted(created_orgs) == ["111111111", "333333333"]
+
+
+def test_rerun_resumes_after_completed_rows(monkeypatch, tmp_path):
+    monkeypatch.setenv("CHECKPOINT_DIR", str(tmp_path))
+    run_main(make_rows())
+    summary, created_orgs = run_main(make_rows(), fail_orgs=())
+
+    # Only the two failed rows are retried; the previously failing create now succeeds
+    assert summary["resumed"] == 4
+    assert created_orgs == ["444444444"]
+    assert (summary["created"], summary["failed"]) == (1, 1)
+
+
+def test_index_from_store_is_built_after_a_full_sync(monkeypatch, tmp_path):
+    monkeypatch.setenv("CHECKPOINT_DIR", str(tmp_path))
+    instance_store = MagicMock()
+    instance_store.query.return_value = [{"organisationNumber": "111111111", "tags": ["ReportA"]}]
+
+    summary, created_orgs = run_main([make_row("111111111", "ReportA-1"), make_row("333333333", "ReportA-2")], instance_store=instance_store)
+
+    assert instance_store.sync.call_args.kwargs["full"] is True
+    assert created_orgs == ["333333333"]
+    assert summary["skipped"] == 1
+
+
+def make_stored_instance(status_code=200, tags=()):
+    response = MagicMock(status_code=status_code)
+    response.json.return_value = {
+        "id": "50001/guid",
+        "status": {},
+        "data": [{"id": "data-guid", "dataType": "DataModel", "contentType": "application/json", "tags": list(tags)}],
+    }
+    return response
+
+
+def test_rerun_finishes_created_instance_instead_of_creating_another(monkeypatch, tmp_path):
+    monkeypatch.setenv("CHECKPOINT_DIR", str(tmp_path))
+
+    def tagging_fails(client):
+        client.tag_instance_data.side_effect = RuntimeError("tagging failed")
+
+    first, _ = run_main(make_rows(), setup=tagging_fails)
+    assert first["failed"] == 4
+
+    clients = []
+
+    def instance_exists_untagged(client):
+        client.get_instance.return_value = make_stored_instance()
+        clients.append(client)
+
+    summary, created_orgs = run_main(make_rows(), fail_orgs=(), setup=instance_exists_untagged)
+
+    # The two rows whose instance exists untagged are finished, only the failed create is retried
+    assert created_orgs == ["444444444"]
+    assert clients[0].get_instance.call_count == 2
+    assert clients[0].tag_instance_data.call_count == 3
+    assert (summary["created"], summary["failed"], summary["resumed"]) == (3, 1, 2)
+
+
+def test_rerun_uploads_again_when_journaled_instance_is_gone(monkeypatch, tmp_path):
+    monkeypatch.setenv("CHECKPOINT_DIR", str(tmp_path))
+    rows = [make_row("111111111", "ReportA-1")]
+
+    def tagging_fails(client):
+        client.tag_instance_data.return_value.status_code = 500
+
+    def instance_deleted(client):
+        client.get_instance.return_value = make_stored_instance(status_code=404)
+
+    assert run_main(rows, setup=tagging_fails)[0]["failed"] == 1
+    summary, created_orgs = run_main(rows, setup=instance_deleted)
+    assert created_orgs == ["111111111"]
+    assert summary["created"] == 1
+
+
+def test_instance_index_claim_is_exclusive():
+    index = InstanceIndex()
+    assert index.claim("111111111", "ReportA")
+    assert not index.claim("111111111", "ReportA")
+    index.discard("111111111", "ReportA")
+    assert index.claim("111111111", "ReportA")
@@ -1,6 +1,4 @@
-from typing import Any, Dict, Tuple
-from azure.keyvault.secrets import SecretClient
-from azure.identity import DefaultAzureCredential
+from typing import Any, Dict, Optional, Tuple
 from pathlib import Path
 import json
 import logging
@@ -9,39 +7,40 @@ import os
 
 from clients.instance_client import AltinnInstanceClient, get_meta_data_info
 from clients.instance_logging import InstanceTracker
+from clients.pipeline_context import PipelineContext
 from config.type_dict_structure import DataModel
 from config.config_loader import load_full_config
-from config.utils import create_payload
+from config.utils import create_payload, verified_local_data
 
 load_dotenv()
 
-credential = DefaultAzureCredential()
-client = SecretClient(
-    vault_url=os.getenv("MASKINPORTEN_SECRET_VAULT_URL"), credential=credential
-)
-secret = client.get_secret(os.getenv("MASKINPORTEN_SECRET_NAME"))
-secret_value = secret.value
 
 def split_party_instance_id(party_instance_id: str) -> Tuple[str]:
      party_id, instance_id = party_instance_id.split("/")
      return party_id, instance_id
 
-def run(org_number: str, digitaliseringstiltak_report_id: str, dato: str, app_name: str, prefill_data: DataModel) -> str:
+def run(org_number: str, digitaliseringstiltak_report_id: str, dato: str, app_name: str, prefill_data: DataModel, context: Optional[PipelineContext] = None, refetch_data: Optional[bool] = None) -> str:
 
     logging.info("UPLOAD:Starting Altinn survey sending instance processing")
+    context = context or PipelineContext()
+    if refetch_data is None:
+        refetch_data = os.getenv("UPLOAD_REFETCH_DATA", "").lower() in ("1", "true", "yes")
     path_to_config_folder = Path(__file__).parent / "config_files"
-    api_config = load_full_config(path_to_config_folder, app_name, os.getenv("ENV"))
+    api_config = context.get_or_create(("config", app_name), lambda: load_full_config(path_to_config_folder, app_name, os.getenv("ENV")))
 
-    regvil_instance_client = AltinnInstanceClient.init_from_config(
+    regvil_instance_client = context.get_or_create(("instance_client", app_name), lambda: AltinnInstanceClient.init_from_config(
         api_config,
-    )
+    ))
 
-    tracker = InstanceTracker.from_directory(f"{os.getenv('ENV')}/event_log/")
+    tracker = context.get_or_create("event_log_tracker", lambda: InstanceTracker.from_directory(f"{os.getenv('ENV')}/event_log/"))
 
     logging.info(f"UPLOAD:Processing org {org_number}, report {digitaliseringstiltak_report_id}")
 
+    # The downloaded instance belongs to the same organisation, so only its party needs checking
+    owner = (context.instance_meta or {}).get("instanceOwner") or {}
+    party_id = owner.get("partyId") if owner.get("organisationNumber") == org_number else None
     if regvil_instance_client.instance_created(
-        org_number, digitaliseringstiltak_report_id
+        org_number, digitaliseringstiltak_report_id, party_id=party_id
         ):
         logging.warning(
                 f"UPLOAD:Skipping org {org_number} and report {digitaliseringstiltak_report_id}- already in storage"
@@ -76,40 +75,39 @@ def run(org_number: str, digitaliseringstiltak_report_id: str, dato: str, app_na
     logging.info(
                 f"UPLOAD:Successfully created instance for org nr {org_number}/ report id {digitaliseringstiltak_report_id}: {instance_meta_data['id']}"
             )
-    instance_data = regvil_instance_client.get_instance_data(
-                party_id,
-                instance_id,
-                instance_data_meta_data.get('id')
-            )
-    if instance_data.status_code == 200:
-        instance_data_file = instance_data.json()
-        # Log the instance creation & save it
-
-        tracker.logging_instance(
-            instance_id,
-            org_number,
-            digitaliseringstiltak_report_id,
-            instance_meta_data,
-            instance_data_file,
-            api_config.app_config.tag["tag_instance"],
-        )
-
-        tag_result = regvil_instance_client.tag_instance_data(
+    instance_data_file = None if refetch_data else verified_local_data(files, instance_data_meta_data)
+    if instance_data_file is None:
+        instance_data = regvil_instance_client.get_instance_data(
                     party_id,
                     instance_id,
-                    instance_data_meta_data["id"],
-                    digitaliseringstiltak_report_id,
+                    instance_data_meta_data.get('id')
                 )
-        if tag_result.status_code == 201:
-                logging.info(f"UPLOAD:Successfully tagged instance for org number: {org_number} party id: {instance_meta_data['instanceOwner']['partyId']} instance id: {instance_meta_data['id']}")
-        else:
-                logging.warning(f"UPLOAD:Failed to tag instance org number: {org_number} party id: {instance_meta_data['instanceOwner']['partyId']} instance id: {instance_meta_data['id']}")
-                return 206
-        logging.info(f"UPLOAD:Successfully send out instance id: {instance_id}, party id {party_id}, report id: {digitaliseringstiltak_report_id} to app name {app_name} Orgnumber: {org_number}")
-        return 200
+        if instance_data.status_code != 200:
+            logging.error(
+                f"UPLOAD:Failed to retrieve instance data for org nr {org_number}/ report id {digitaliseringstiltak_report_id}: {instance_data.status_code}"
+            )
+            return 502
+        instance_data_file = instance_data.json()
+    # Log the instance creation & save it
+    tracker.logging_instance(
+        instance_id,
+        org_number,
+        digitaliseringstiltak_report_id,
+        instance_meta_data,
+        instance_data_file,
+        api_config.app_config.tag["tag_instance"],
+    )
+
+    tag_result = regvil_instance_client.tag_instance_data(
+                party_id,
+                instance_id,
+                instance_data_meta_data["id"],
+                digitaliseringstiltak_report_id,
+            )
+    if tag_result.status_code == 201:
+        logging.info(f"UPLOAD:Successfully tagged instance for org number: {org_number} party id: {instance_meta_data['instanceOwner']['partyId']} instance id: {instance_meta_data['id']}")
     else:
-        logging.error(
-            f"UPLOAD:Failed to retrieve instance data for org nr {org_number}/ report id {digitaliseringstiltak_report_id}: {instance_data.status_code}"
-        )
-        return 502
-        
\ No newline at end of file
+        logging.warning(f"UPLOAD:Failed to tag instance org number: {org_number} party id: {instance_meta_data['instanceOwner']['partyId']} instance id: {instance_meta_data['id']}")
+        return 206
+    logging.info(f"UPLOAD:Successfully send out instance id: {instance_id}, party id {party_id}, report id: {digitaliseringstiltak_report_id} to app name {app_name} Orgnumber: {org_number}")
+    return 200
@@ -1,111 +1,92 @@
-from typing import Any
-from azure.keyvault.secrets import SecretClient
-from azure.identity import DefaultAzureCredential
+from typing import Any, Callable, Dict, List, Optional
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
 import re
 import logging
+import threading
+import time
 from dotenv import load_dotenv
 import os
 
-from clients.instance_client import AltinnInstanceClient, get_meta_data_info
+from clients.instance_client import AltinnInstanceClient, InstanceIndex, get_meta_data_info
+from clients.instance_store import open_instance_store
 from clients.instance_logging import InstanceTracker
+from clients.checkpoint import DONE, FAILED, IN_PROGRESS, open_checkpoint_journal, send_out_run_id
 from config.config_loader import load_full_config
-from config.utils import read_blob, create_payload, split_party_instance_id
+from config.utils import read_blob, create_payload, split_party_instance_id, verified_local_data
 
 load_dotenv()
 
-credential = DefaultAzureCredential()
-client = SecretClient(
-    vault_url=os.getenv("MASKINPORTEN_SECRET_VAULT_URL"), credential=credential
-)
-secret = client.get_secret(os.getenv("MASKINPORTEN_SECRET_NAME"))
-secret_value = secret.value
 
 def transform_uiid_to_tag(digitaliseringstiltak_report_id: str):
     return "".join(re.findall(r"[a-zA-Z]+",digitaliseringstiltak_report_id))
 
-def main() -> None:
-    logging.info("Starting Altinn survey sending instance processing")
-    path_to_config_folder = Path(__file__).parent / "config_files"
-    config = load_full_config(path_to_config_folder, "regvil-2025-initiell", os.getenv("ENV"))
-    test_prefill_data = read_blob(f"{os.getenv("ENV")}/virksomheter_prefill_with_uuid.json")
+class StageTimings:
+    """Thread-safe totals of time spent per upload stage."""
 
-    regvil_instance_client = AltinnInstanceClient.init_from_config(
-        config,
-    )
-    tracker = InstanceTracker.from_directory(f"{os.getenv("ENV")}/event_log/")
-    logging.info(f"UPLOAD:Processing {len(test_prefill_data)} organizations")
+    def __init__(self):
+        self._totals: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def measure(self, stage: str):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            with self._lock:
+                count, total = self._totals.get(stage, [0, 0.0])
+                self._totals[stage] = [count + 1, total + elapsed]
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                stage: {"count": count, "total_seconds": round(total, 3), "avg_ms": round(total / count * 1000, 1)}
+                for stage, (count, total) in self._totals.items()
+            }
 
 
-    for prefill_data_row in test_prefill_data:
+def upload_row(prefill_data_row: Dict[str, Any], config, regvil_instance_client: AltinnInstanceClient, tracker: InstanceTracker, instance_index: InstanceIndex, refetch_data: bool, timings: StageTimings, on_created: Optional[Callable[[str], None]] = None) -> str:
+    """Create, log and tag the instance for one prefill row. Returns "created", "skipped" or "failed".
+
+    on_created gets the new instance id as soon as Altinn has created it, before logging and tagging.
+    """
+    with timings.measure("validate"):
         config.app_config.validate_prefill_data(prefill_data_row)
         data_model = config.app_config.get_prefill_data(prefill_data_row)
-        org_number = prefill_data_row["AnsvarligVirksomhet.Organisasjonsnummer"]
-        report_id = transform_uiid_to_tag(prefill_data_row["digitaliseringstiltak_report_id"])
-
-        logging.info(f"UPLOAD:Processing org {org_number}, report {report_id}")
+    org_number = prefill_data_row["AnsvarligVirksomhet.Organisasjonsnummer"]
+    report_id = transform_uiid_to_tag(prefill_data_row["digitaliseringstiltak_report_id"])
 
-        if regvil_instance_client.instance_created(
-            org_number, report_id
-        ):
-            logging.info(
-                f"UPLOAD:Skipping org {org_number} and report {report_id}- already in storage"
-            )
-            continue
+    logging.info(f"UPLOAD:Processing org {org_number}, report {report_id}")
 
+    # Claiming the pair up front keeps two in-flight rows from creating the same instance
+    if not instance_index.claim(org_number, report_id):
         logging.info(
-            f"UPLOAD:Creating new instance for org {org_number} and report id {report_id}"
+            f"UPLOAD:Skipping org {org_number} and report {report_id}- already in storage"
         )
-        files = create_payload(org_number, config.app_config.visibleAfter, config, data_model)
-        created_instance = regvil_instance_client.post_new_instance(files)
-
-        if created_instance.status_code == 201:
-            instance_meta_data = created_instance.json()
-            instance_client_data_meta_data = get_meta_data_info(
-                instance_meta_data["data"]
-            )
+        return "skipped"
 
-            logging.info(
-                f"UPLOAD:Successfully created instance for org nr {org_number}/ report id {report_id}: {instance_meta_data['id']}"
-            )
-            party_id, instance_id = split_party_instance_id(instance_meta_data["id"])
-            #New code to handle instance data
-            instance_data = regvil_instance_client.get_instance_data(
-                party_id,
-                instance_id,
-                instance_client_data_meta_data.get('id')
-            )
-            if instance_data.status_code != 200:
-                logging.error(
-                    f"UPLOAD:Failed to retrieve instance data for org nr {org_number}/ report id {report_id}: {instance_data.status_code}"
-                )
-                
-            instance_data_file = instance_data.json()
-            # Log the instance creation & save it
-            tracker.logging_instance(
-                instance_id,
-                prefill_data_row["AnsvarligVirksomhet.Organisasjonsnummer"],
-                report_id,
-                instance_meta_data,
-                instance_data_file,
-                config.app_config.tag["tag_instance"],
-            )
-
-            tag_result = regvil_instance_client.tag_instance_data(
-                party_id,
-                instance_id,
-                instance_client_data_meta_data["id"],
-                report_id,
-            )
-            if tag_result.status_code == 201:
-                logging.info(f"UPLOAD:Successfully tagged instance for org {org_number}")
-            else:
-                logging.error(f"UPLOAD:Failed to tag instance for org {org_number}")
+    logging.info(
+        f"UPLOAD:Creating new instance for org {org_number} and report id {report_id}"
+    )
+    files = create_payload(org_number, config.app_config.visibleAfter, config, data_model)
+    try:
+        with timings.measure("create"):
+            created_instance = regvil_instance_client.post_new_instance(files)
+    except Exception:
+        instance_index.discard(org_number, report_id)
+        raise
 
-        else:
-            logging.error(
-                f"UPLOAD:Failed to create instance for org nr {org_number}/ report id {report_id}: Status {created_instance.status_code}"
-            )
+    if not created_instance or created_instance.status_code != 201:
+        instance_index.discard(org_number, report_id)
+        status_code = created_instance.status_code if created_instance else None
+        logging.error(
+            f"UPLOAD:Failed to create instance for org nr {org_number}/ report id {report_id}: Status {status_code}"
+        )
+        if created_instance is not None:
             try:
                 error_details = created_instance.json()
                 error_msg = error_details.get("error", "Unknown error")
@@ -118,6 +99,187 @@ def main() -> None:
                     f"Status: {created_instance.status_code} - "
                     f"Error message: {error_msg}"
                 )
+        return "failed"
+
+    instance_meta_data = created_instance.json()
+    logging.info(
+        f"UPLOAD:Successfully created instance for org nr {org_number}/ report id {report_id}: {instance_meta_data['id']}"
+    )
+    if on_created is not None:
+        on_created(instance_meta_data["id"])
+    return finish_instance(
+        instance_meta_data, org_number, report_id, data_model, None if refetch_data else files,
+        config, regvil_instance_client, tracker, timings,
+    )
+
+
+def finish_instance(instance_meta_data: Dict[str, Any], org_number: str, report_id: str, data_model: Dict[str, Any], files: Optional[Dict[str, Any]], config, regvil_instance_client: AltinnInstanceClient, tracker: InstanceTracker, timings: StageTimings) -> str:
+    """Log and tag a created instance. Returns "created", or "failed" when tagging failed.
+
+    Without files, or when they do not match what Altinn stored, the data is fetched again.
+    """
+    instance_client_data_meta_data = get_meta_data_info(
+        instance_meta_data["data"]
+    )
+    party_id, instance_id = split_party_instance_id(instance_meta_data["id"])
+    instance_data_file = verified_local_data(files, instance_client_data_meta_data) if files else None
+    if instance_data_file is None:
+        with timings.measure("fetch_data"):
+            instance_data = regvil_instance_client.get_instance_data(
+                party_id,
+                instance_id,
+                instance_client_data_meta_data.get('id')
+            )
+        if instance_data.status_code != 200:
+            logging.error(
+                f"UPLOAD:Failed to retrieve instance data for org nr {org_number}/ report id {report_id}: {instance_data.status_code}"
+            )
+            instance_data_file = data_model
+        else:
+            instance_data_file = instance_data.json()
+    # Log the instance creation & save it
+    with timings.measure("log"):
+        tracker.logging_instance(
+            instance_id,
+            org_number,
+            report_id,
+            instance_meta_data,
+            instance_data_file,
+            config.app_config.tag["tag_instance"],
+        )
+
+    with timings.measure("tag"):
+        tag_result = regvil_instance_client.tag_instance_data(
+            party_id,
+            instance_id,
+            instance_client_data_meta_data["id"],
+            report_id,
+        )
+    if tag_result is not None and tag_result.status_code == 201:
+        logging.info(f"UPLOAD:Successfully tagged instance for org {org_number}")
+        return "created"
+    # Untagged instances are invisible to the instance index, so the row stays open for a rerun
+    logging.error(f"UPLOAD:Failed to tag instance {instance_meta_data['id']} for org {org_number}")
+    return "failed"
+
+
+def resume_instance(instance_ref: str, prefill_data_row: Dict[str, Any], config, regvil_instance_client: AltinnInstanceClient, tracker: InstanceTracker, instance_index: InstanceIndex, timings: StageTimings) -> Optional[str]:
+    """Finish logging and tagging an instance an earlier run created for this row.
+
+    Returns None when the instance no longer exists, so the row is uploaded again.
+    """
+    config.app_config.validate_prefill_data(prefill_data_row)
+    data_model = config.app_config.get_prefill_data(prefill_data_row)
+    org_number = prefill_data_row["AnsvarligVirksomhet.Organisasjonsnummer"]
+    report_id = transform_uiid_to_tag(prefill_data_row["digitaliseringstiltak_report_id"])
+
+    party_id, instance_id = split_party_instance_id(instance_ref)
+    response = regvil_instance_client.get_instance(party_id, instance_id)
+    if response is not None and response.status_code == 404:
+        return None
+    if response is None or response.status_code != 200:
+        status_code = response.status_code if response is not None else None
+        logging.error(f"UPLOAD:Failed to get instance {instance_ref} for report {report_id}: Status {status_code}")
+        return "failed"
+    instance_meta_data = response.json()
+    status = instance_meta_data.get("status") or {}
+    if status.get("isSoftDeleted") or status.get("isHardDeleted"):
+        return None
+
+    instance_index.add(org_number, report_id)
+    if report_id in (get_meta_data_info(instance_meta_data["data"]).get("tags") or []):
+        logging.info(f"UPLOAD:Instance {instance_ref} for report {report_id} is already tagged")
+        return "created"
+    return finish_instance(
+        instance_meta_data, org_number, report_id, data_model, None,
+        config, regvil_instance_client, tracker, timings,
+    )
+
+
+def main() -> Dict[str, Any]:
+    logging.info("Starting Altinn survey sending instance processing")
+    path_to_config_folder = Path(__file__).parent / "config_files"
+    config = load_full_config(path_to_config_folder, "regvil-2025-initiell", os.getenv("ENV"))
+    test_prefill_data = read_blob(f"{os.getenv("ENV")}/virksomheter_prefill_with_uuid.json")
+
+    regvil_instance_client = AltinnInstanceClient.init_from_config(
+        config,
+    )
+    tracker = InstanceTracker.from_directory(f"{os.getenv("ENV")}/event_log/")
+    logging.info(f"UPLOAD:Processing {len(test_prefill_data)} organizations")
+    instance_store = open_instance_store()
+    if instance_store:
+        # Delta sync cannot see deleted instances, and skipping an org whose instance was deleted
+        # would leave it without one, so the upload index is always built from a full listing
+        instance_store.sync(regvil_instance_client, full=True)
+        instance_index = InstanceIndex(instance_store.query(app_name=config.app_config.app_name))
+    else:
+        instance_index = regvil_instance_client.build_instance_index()
+    logging.info(f"UPLOAD:Indexed {len(instance_index)} existing (organisation, report) pairs")
+    refetch_data = os.getenv("UPLOAD_REFETCH_DATA", "").lower() in ("1", "true", "yes")
+    concurrency = max(1, int(os.getenv("UPLOAD_CONCURRENCY", "8")))
+    timings = StageTimings()
+    journal = open_checkpoint_journal(
+        "upload_skjema", send_out_run_id(config.app_config.app_name, config.app_config.visibleAfter)
+    )
+
+    def process(prefill_data_row):
+        report_id = prefill_data_row.get("digitaliseringstiltak_report_id")
+        entry = journal.get(report_id) or {}
+        if entry.get("state") == DONE:
+            return "resumed"
+        # The instance id is journaled right after create, so a crash or error before tagging
+        # is finished on the next run instead of creating a second instance
+        created = {"instance_id": entry["instance_id"]} if entry.get("instance_id") else {}
+
+        def on_created(instance_id):
+            created["instance_id"] = instance_id
+            journal.mark(report_id, IN_PROGRESS, instance_id=instance_id)
+
+        journal.mark(report_id, IN_PROGRESS, **created)
+        try:
+            outcome = None
+            if created:
+                logging.warning(
+                    f"UPLOAD:Report {report_id} already has instance {created['instance_id']} from an earlier run; finishing it"
+                )
+                outcome = resume_instance(created["instance_id"], prefill_data_row, config, regvil_instance_client, tracker, instance_index, timings)
+                if outcome is None:
+                    logging.warning(f"UPLOAD:Instance {created['instance_id']} for report {report_id} no longer exists; uploading again")
+                    created.clear()
+            elif entry.get("state") == IN_PROGRESS:
+                logging.warning(f"UPLOAD:Report {report_id} was in progress when the last run stopped, before an instance id was journaled; checking storage again")
+            if outcome is None:
+                outcome = upload_row(prefill_data_row, config, regvil_instance_client, tracker, instance_index, refetch_data, timings, on_created)
+        except Exception as e:
+            logging.exception(
+                f"UPLOAD:Failed to process org {prefill_data_row.get('AnsvarligVirksomhet.Organisasjonsnummer')} "
+                f"report {report_id}: {e}"
+            )
+            outcome = "failed"
+        journal.mark(report_id, FAILED if outcome == "failed" else DONE, outcome=outcome, **created)
+        return outcome
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="upload") as pool:
+        outcomes = Counter(pool.map(process, test_prefill_data))
+    elapsed = time.monotonic() - started
+
+    # Throughput only counts rows handled in this run, not those resumed past from the checkpoint
+    processed = len(test_prefill_data) - outcomes["resumed"]
+    summary = {
+        "rows": len(test_prefill_data),
+        "created": outcomes["created"],
+        "skipped": outcomes["skipped"],
+        "failed": outcomes["failed"],
+        "resumed": outcomes["resumed"],
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(processed / elapsed, 2) if elapsed > 0 else 0.0,
+        "concurrency": concurrency,
+        "stages": timings.summary(),
+    }
+    logging.info(f"UPLOAD:Summary {summary}")
+    return summary
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()